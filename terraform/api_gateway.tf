@@ -62,7 +62,10 @@ resource "aws_api_gateway_deployment" "rekognition" {
   rest_api_id = aws_api_gateway_rest_api.rekognition.id
   depends_on = [
     aws_api_gateway_integration.index_put,
-    aws_api_gateway_integration.search
+    aws_api_gateway_integration.search,
+    aws_api_gateway_integration.search_jobs,
+    aws_api_gateway_integration.search_job,
+    aws_api_gateway_integration.search_uploads
   ]
   triggers = {
     redeployment = timestamp()
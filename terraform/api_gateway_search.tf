@@ -52,3 +52,103 @@ resource "aws_api_gateway_method_response" "search_response_200" {
   }
   response_parameters = {}
 }
+
+###############################################################################
+# REST API resources - Search jobs
+# POST /search/jobs accepts the same body as a batch search, and returns a
+# job id right away. GET /search/jobs/{job_id} returns the status of the
+# job, and its results once it has finished. see rekognition_api/jobs.py
+###############################################################################
+resource "aws_api_gateway_resource" "search_jobs" {
+  path_part   = "jobs"
+  parent_id   = aws_api_gateway_resource.search.id
+  rest_api_id = aws_api_gateway_rest_api.rekognition.id
+}
+resource "aws_api_gateway_method" "search_jobs" {
+  rest_api_id      = aws_api_gateway_rest_api.rekognition.id
+  resource_id      = aws_api_gateway_resource.search_jobs.id
+  http_method      = "POST"
+  authorization    = "NONE"
+  api_key_required = "true"
+}
+resource "aws_api_gateway_integration" "search_jobs" {
+  rest_api_id             = aws_api_gateway_rest_api.rekognition.id
+  resource_id             = aws_api_gateway_resource.search_jobs.id
+  http_method             = aws_api_gateway_method.search_jobs.http_method
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY"
+  uri                     = aws_lambda_function.search.invoke_arn
+}
+resource "aws_lambda_permission" "search_jobs" {
+  statement_id  = "AllowExecutionFromAPIGatewaySearchJobs"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.search.function_name
+  principal     = "apigateway.amazonaws.com"
+  source_arn    = "arn:aws:execute-api:${var.aws_region}:${data.aws_caller_identity.current.account_id}:${aws_api_gateway_rest_api.rekognition.id}/*/${aws_api_gateway_method.search_jobs.http_method}${aws_api_gateway_resource.search_jobs.path}"
+}
+
+resource "aws_api_gateway_resource" "search_job" {
+  path_part   = "{job_id}"
+  parent_id   = aws_api_gateway_resource.search_jobs.id
+  rest_api_id = aws_api_gateway_rest_api.rekognition.id
+}
+resource "aws_api_gateway_method" "search_job" {
+  rest_api_id        = aws_api_gateway_rest_api.rekognition.id
+  resource_id        = aws_api_gateway_resource.search_job.id
+  http_method        = "GET"
+  authorization      = "NONE"
+  api_key_required   = "true"
+  request_parameters = {
+    "method.request.path.job_id" = true
+  }
+}
+resource "aws_api_gateway_integration" "search_job" {
+  rest_api_id             = aws_api_gateway_rest_api.rekognition.id
+  resource_id             = aws_api_gateway_resource.search_job.id
+  http_method             = aws_api_gateway_method.search_job.http_method
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY"
+  uri                     = aws_lambda_function.search.invoke_arn
+}
+resource "aws_lambda_permission" "search_job" {
+  statement_id  = "AllowExecutionFromAPIGatewaySearchJob"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.search.function_name
+  principal     = "apigateway.amazonaws.com"
+  source_arn    = "arn:aws:execute-api:${var.aws_region}:${data.aws_caller_identity.current.account_id}:${aws_api_gateway_rest_api.rekognition.id}/*/${aws_api_gateway_method.search_job.http_method}/search/jobs/*"
+}
+
+###############################################################################
+# REST API resources - Search uploads
+# POST /search/uploads returns a presigned URL that uploads an image straight
+# to the S3 bucket, bypassing the API Gateway payload limit. The image is then
+# searched with a {"bucket": "...", "key": "..."} reference to it. see
+# rekognition_api/uploads.py
+###############################################################################
+resource "aws_api_gateway_resource" "search_uploads" {
+  path_part   = "uploads"
+  parent_id   = aws_api_gateway_resource.search.id
+  rest_api_id = aws_api_gateway_rest_api.rekognition.id
+}
+resource "aws_api_gateway_method" "search_uploads" {
+  rest_api_id      = aws_api_gateway_rest_api.rekognition.id
+  resource_id      = aws_api_gateway_resource.search_uploads.id
+  http_method      = "POST"
+  authorization    = "NONE"
+  api_key_required = "true"
+}
+resource "aws_api_gateway_integration" "search_uploads" {
+  rest_api_id             = aws_api_gateway_rest_api.rekognition.id
+  resource_id             = aws_api_gateway_resource.search_uploads.id
+  http_method             = aws_api_gateway_method.search_uploads.http_method
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY"
+  uri                     = aws_lambda_function.search.invoke_arn
+}
+resource "aws_lambda_permission" "search_uploads" {
+  statement_id  = "AllowExecutionFromAPIGatewaySearchUploads"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.search.function_name
+  principal     = "apigateway.amazonaws.com"
+  source_arn    = "arn:aws:execute-api:${var.aws_region}:${data.aws_caller_identity.current.account_id}:${aws_api_gateway_rest_api.rekognition.id}/*/${aws_api_gateway_method.search_uploads.http_method}${aws_api_gateway_resource.search_uploads.path}"
+}
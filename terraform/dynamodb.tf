@@ -22,3 +22,116 @@ module "dynamodb_table" {
 
   tags = var.tags
 }
+
+# idempotency ledger for lambda_index, keyed on s3://bucket/key#ETag
+module "dynamodb_ledger_table" {
+  source  = "terraform-aws-modules/dynamodb-table/aws"
+  version = "~> 4.0"
+
+  name                        = local.ledger_table_name
+  hash_key                    = "LedgerId"
+  table_class                 = "STANDARD"
+  deletion_protection_enabled = false
+  billing_mode                = "PAY_PER_REQUEST"
+
+  attributes = [
+    {
+      name = "LedgerId"
+      type = "S"
+    }
+  ]
+
+  tags = var.tags
+}
+
+# content-addressed deduplication for lambda_index, keyed on sha256:<hex digest>
+module "dynamodb_content_table" {
+  source  = "terraform-aws-modules/dynamodb-table/aws"
+  version = "~> 4.0"
+
+  name                        = local.content_table_name
+  hash_key                    = "ContentHash"
+  table_class                 = "STANDARD"
+  deletion_protection_enabled = false
+  billing_mode                = "PAY_PER_REQUEST"
+
+  attributes = [
+    {
+      name = "ContentHash"
+      type = "S"
+    }
+  ]
+
+  tags = var.tags
+}
+
+# per-second Rekognition call counters, shared by every Lambda container.
+# see settings.aws_rekognition_rate_limit_coordinated
+module "dynamodb_rate_limit_table" {
+  source  = "terraform-aws-modules/dynamodb-table/aws"
+  version = "~> 4.0"
+
+  name                        = local.rate_limit_table_name
+  hash_key                    = "CounterId"
+  table_class                 = "STANDARD"
+  deletion_protection_enabled = false
+  billing_mode                = "PAY_PER_REQUEST"
+  ttl_enabled                 = true
+  ttl_attribute_name          = "expiresAt"
+
+  attributes = [
+    {
+      name = "CounterId"
+      type = "S"
+    }
+  ]
+
+  tags = var.tags
+}
+
+# cached search results, and the collection version counters that invalidate them.
+# see settings.aws_lambda_search_result_cache
+module "dynamodb_search_cache_table" {
+  source  = "terraform-aws-modules/dynamodb-table/aws"
+  version = "~> 4.0"
+
+  name                        = local.search_cache_table_name
+  hash_key                    = "CacheKey"
+  table_class                 = "STANDARD"
+  deletion_protection_enabled = false
+  billing_mode                = "PAY_PER_REQUEST"
+  ttl_enabled                 = true
+  ttl_attribute_name          = "expiresAt"
+
+  attributes = [
+    {
+      name = "CacheKey"
+      type = "S"
+    }
+  ]
+
+  tags = var.tags
+}
+
+# asynchronous search jobs, keyed on a random job id. see rekognition_api/jobs.py
+module "dynamodb_search_jobs_table" {
+  source  = "terraform-aws-modules/dynamodb-table/aws"
+  version = "~> 4.0"
+
+  name                        = local.search_jobs_table_name
+  hash_key                    = "JobId"
+  table_class                 = "STANDARD"
+  deletion_protection_enabled = false
+  billing_mode                = "PAY_PER_REQUEST"
+  ttl_enabled                 = true
+  ttl_attribute_name          = "expiresAt"
+
+  attributes = [
+    {
+      name = "JobId"
+      type = "S"
+    }
+  ]
+
+  tags = var.tags
+}
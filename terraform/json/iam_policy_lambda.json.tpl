@@ -17,11 +17,42 @@
     },
     {
       "Effect": "Allow",
-      "Action": ["dynamodb:PutItem"],
+      "Action": ["s3:PutObject", "s3:DeleteObject"],
+      "Resource": [
+        "${s3_bucket_arn}/search-jobs/*",
+        "${s3_bucket_arn}/search-uploads/*"
+      ]
+    },
+    {
+      "Effect": "Allow",
+      "Action": ["sqs:SendMessage"],
+      "Resource": ["${search_jobs_queue_arn}"]
+    },
+    {
+      "Effect": "Allow",
+      "Action": ["dynamodb:PutItem", "dynamodb:BatchWriteItem"],
       "Resource": [
         "${dynamodb_table_arn}/*"
       ]
     },
+    {
+      "Effect": "Allow",
+      "Action": [
+        "dynamodb:GetItem",
+        "dynamodb:PutItem",
+        "dynamodb:UpdateItem",
+        "dynamodb:DeleteItem",
+        "dynamodb:BatchWriteItem",
+        "dynamodb:BatchGetItem"
+      ],
+      "Resource": [
+        "${dynamodb_ledger_table_arn}",
+        "${dynamodb_content_table_arn}",
+        "${dynamodb_rate_limit_table_arn}",
+        "${dynamodb_search_cache_table_arn}",
+        "${dynamodb_search_jobs_table_arn}"
+      ]
+    },
     {
         "Effect": "Allow",
         "Action": [
@@ -2,10 +2,16 @@ locals {
   lambda_role_name   = "${var.shared_resource_identifier}-lambda"
   lambda_policy_name = "${var.shared_resource_identifier}-lambda"
   iam_policy_lambda = templatefile("${path.module}/json/iam_policy_lambda.json.tpl", {
-    s3_bucket_arn      = module.s3_bucket.s3_bucket_arn
-    dynamodb_table_arn = module.dynamodb_table.dynamodb_table_arn
-    aws_region         = var.aws_region
-    aws_account_id     = var.aws_account_id
+    s3_bucket_arn                   = module.s3_bucket.s3_bucket_arn
+    dynamodb_table_arn              = module.dynamodb_table.dynamodb_table_arn
+    dynamodb_ledger_table_arn       = module.dynamodb_ledger_table.dynamodb_table_arn
+    dynamodb_content_table_arn      = module.dynamodb_content_table.dynamodb_table_arn
+    dynamodb_rate_limit_table_arn   = module.dynamodb_rate_limit_table.dynamodb_table_arn
+    dynamodb_search_cache_table_arn = module.dynamodb_search_cache_table.dynamodb_table_arn
+    dynamodb_search_jobs_table_arn  = module.dynamodb_search_jobs_table.dynamodb_table_arn
+    search_jobs_queue_arn           = aws_sqs_queue.search_jobs.arn
+    aws_region                      = var.aws_region
+    aws_account_id                  = var.aws_account_id
   })
 }
 
@@ -46,6 +52,10 @@ resource "aws_iam_role_policy_attachment" "AmazonDynamoDBFullAccess" {
   role       = aws_iam_role.lambda.id
   policy_arn = "arn:aws:iam::aws:policy/AmazonDynamoDBFullAccess"
 }
+resource "aws_iam_role_policy_attachment" "AWSLambdaSQSQueueExecutionRole" {
+  role       = aws_iam_role.lambda.id
+  policy_arn = "arn:aws:iam::aws:policy/service-role/AWSLambdaSQSQueueExecutionRole"
+}
 resource "aws_iam_role_policy_attachment" "AmazonRekognitionFullAccess" {
   role       = aws_iam_role.lambda.id
   policy_arn = "arn:aws:iam::aws:policy/AmazonRekognitionFullAccess"
@@ -63,3 +73,41 @@ resource "aws_iam_role_policy_attachment" "lambda_logs" {
   role       = aws_iam_role.lambda.name
   policy_arn = aws_iam_policy.lambda_logging.arn
 }
+
+###############################################################################
+# Warm-up. A schedule invokes each Lambda with {"warmup": true}, which sets up
+# its clients and connections without indexing or searching an image.
+# see rekognition_api/warmup.py
+###############################################################################
+locals {
+  warmup_functions = var.lambda_warmup ? {
+    index  = aws_lambda_function.index
+    search = aws_lambda_function.search
+    info   = aws_lambda_function.info
+  } : {}
+}
+
+resource "aws_cloudwatch_event_rule" "warmup" {
+  count               = var.lambda_warmup ? 1 : 0
+  name                = "${var.shared_resource_identifier}-warmup"
+  description         = "${var.shared_resource_identifier}: keeps the Lambda containers warm"
+  schedule_expression = var.lambda_warmup_schedule
+  tags                = var.tags
+}
+
+resource "aws_cloudwatch_event_target" "warmup" {
+  for_each  = local.warmup_functions
+  rule      = aws_cloudwatch_event_rule.warmup[0].name
+  target_id = "${each.key}-warmup"
+  arn       = each.value.arn
+  input     = jsonencode({ warmup = true })
+}
+
+resource "aws_lambda_permission" "warmup" {
+  for_each      = local.warmup_functions
+  statement_id  = "AllowExecutionFromEventBridgeWarmup"
+  action        = "lambda:InvokeFunction"
+  function_name = each.value.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.warmup[0].arn
+}
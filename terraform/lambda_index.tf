@@ -29,14 +29,27 @@ resource "aws_lambda_function" "index" {
 
   environment {
     variables = {
-      DEBUG_MODE                             = var.debug_mode
-      AWS_REKOGNITION_COLLECTION_ID          = local.aws_rekognition_collection_id
-      AWS_DYNAMODB_TABLE_ID                  = local.table_name
-      MAX_FACES_COUNT                        = var.aws_rekognition_max_faces_count
-      S3_BUCKET_NAME                         = module.s3_bucket.s3_bucket_id
-      AWS_REKOGNITION_FACE_DETECT_ATTRIBUTES = var.aws_rekognition_face_detect_attributes
-      QUALITY_FILTER                         = var.aws_rekognition_face_detect_quality_filter
-      AWS_DEPLOYED                           = true
+      DEBUG_MODE                                  = var.debug_mode
+      AWS_REKOGNITION_COLLECTION_ID               = local.aws_rekognition_collection_id
+      AWS_DYNAMODB_TABLE_ID                       = local.table_name
+      AWS_DYNAMODB_LEDGER_TABLE_ID                = local.ledger_table_name
+      AWS_DYNAMODB_CONTENT_TABLE_ID               = local.content_table_name
+      AWS_LAMBDA_INDEX_CONTENT_DEDUP              = var.lambda_index_content_dedup
+      MAX_FACES_COUNT                             = var.aws_rekognition_max_faces_count
+      S3_BUCKET_NAME                              = module.s3_bucket.s3_bucket_id
+      AWS_REKOGNITION_FACE_DETECT_ATTRIBUTES      = var.aws_rekognition_face_detect_attributes
+      QUALITY_FILTER                              = var.aws_rekognition_face_detect_quality_filter
+      AWS_DEPLOYED                                = true
+      AWS_REKOGNITION_INDEX_FACES_TPS             = var.aws_rekognition_index_faces_tps
+      AWS_REKOGNITION_SEARCH_FACES_TPS            = var.aws_rekognition_search_faces_tps
+      AWS_REKOGNITION_RATE_LIMIT_MAX_WAIT_SECONDS = var.aws_rekognition_rate_limit_max_wait_seconds
+      AWS_REKOGNITION_RATE_LIMIT_COORDINATED      = var.aws_rekognition_rate_limit_coordinated
+      AWS_DYNAMODB_RATE_LIMIT_TABLE_ID            = local.rate_limit_table_name
+      AWS_REKOGNITION_IMAGE_NORMALIZE             = var.aws_rekognition_image_normalize
+      AWS_REKOGNITION_IMAGE_MAX_EDGE              = var.aws_rekognition_image_max_edge
+      AWS_REKOGNITION_IMAGE_JPEG_QUALITY          = var.aws_rekognition_image_jpeg_quality
+      AWS_DYNAMODB_SEARCH_CACHE_TABLE_ID          = local.search_cache_table_name
+      AWS_LAMBDA_SEARCH_RESULT_CACHE              = var.lambda_search_result_cache
     }
   }
 }
@@ -78,18 +91,88 @@ resource "aws_lambda_permission" "s3_permission_to_trigger_lambda" {
 resource "aws_s3_bucket_notification" "incoming_jpg" {
   bucket = module.s3_bucket.s3_bucket_id
 
-  lambda_function {
-    lambda_function_arn = aws_lambda_function.index.arn
-    events              = ["s3:ObjectCreated:*"]
-    filter_suffix       = ".jpg"
-    #filter_prefix       = ""
+  # invoke the Lambda directly for every uploaded image ...
+  dynamic "lambda_function" {
+    for_each = var.lambda_index_sqs_buffered ? [] : [1]
+    content {
+      lambda_function_arn = aws_lambda_function.index.arn
+      events              = ["s3:ObjectCreated:*"]
+      filter_suffix       = ".jpg"
+      #filter_prefix       = ""
+    }
+  }
+
+  # ... or buffer the notifications in SQS, so that the indexing throughput
+  # is set by the event source mapping rather than by bursts of uploads.
+  dynamic "queue" {
+    for_each = var.lambda_index_sqs_buffered ? [1] : []
+    content {
+      queue_arn     = aws_sqs_queue.index[0].arn
+      events        = ["s3:ObjectCreated:*"]
+      filter_suffix = ".jpg"
+    }
   }
 
   depends_on = [
-    aws_lambda_permission.s3_permission_to_trigger_lambda
+    aws_lambda_permission.s3_permission_to_trigger_lambda,
+    aws_sqs_queue_policy.index
   ]
 }
 
+###############################################################################
+# Optional SQS buffering of S3 notifications
+###############################################################################
+resource "aws_sqs_queue" "index_dlq" {
+  count                     = var.lambda_index_sqs_buffered ? 1 : 0
+  name                      = "${local.index_function_name}-dlq"
+  message_retention_seconds = 1209600
+  tags                      = var.tags
+}
+
+resource "aws_sqs_queue" "index" {
+  count = var.lambda_index_sqs_buffered ? 1 : 0
+  name  = local.index_function_name
+
+  # see https://docs.aws.amazon.com/lambda/latest/dg/with-sqs.html#events-sqs-queueconfig
+  visibility_timeout_seconds = 6 * var.lambda_timeout
+  redrive_policy = jsonencode({
+    deadLetterTargetArn = aws_sqs_queue.index_dlq[0].arn
+    maxReceiveCount     = var.lambda_index_sqs_max_receive_count
+  })
+  tags = var.tags
+}
+
+resource "aws_sqs_queue_policy" "index" {
+  count     = var.lambda_index_sqs_buffered ? 1 : 0
+  queue_url = aws_sqs_queue.index[0].id
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect    = "Allow"
+        Principal = { Service = "s3.amazonaws.com" }
+        Action    = "sqs:SendMessage"
+        Resource  = aws_sqs_queue.index[0].arn
+        Condition = { ArnEquals = { "aws:SourceArn" = module.s3_bucket.s3_bucket_arn } }
+      }
+    ]
+  })
+}
+
+# see https://registry.terraform.io/providers/hashicorp/aws/latest/docs/resources/lambda_event_source_mapping
+resource "aws_lambda_event_source_mapping" "index" {
+  count                              = var.lambda_index_sqs_buffered ? 1 : 0
+  event_source_arn                   = aws_sqs_queue.index[0].arn
+  function_name                      = aws_lambda_function.index.arn
+  batch_size                         = var.lambda_index_sqs_batch_size
+  maximum_batching_window_in_seconds = var.lambda_index_sqs_batching_window
+  function_response_types            = ["ReportBatchItemFailures"]
+
+  scaling_config {
+    maximum_concurrency = var.lambda_index_sqs_maximum_concurrency
+  }
+}
+
 ###############################################################################
 # Cloudwatch logging
 ###############################################################################
@@ -31,18 +31,82 @@ resource "aws_lambda_function" "search" {
 
   environment {
     variables = {
-      DEBUG_MODE                             = var.debug_mode
-      MAX_FACES_COUNT                        = var.aws_rekognition_max_faces_count
-      AWS_REKOGNITION_FACE_DETECT_THRESHOLD  = var.aws_rekognition_face_detect_threshold
-      QUALITY_FILTER                         = var.aws_rekognition_face_detect_quality_filter
-      AWS_REKOGNITION_FACE_DETECT_ATTRIBUTES = var.aws_rekognition_face_detect_attributes
-      AWS_DYNAMODB_TABLE_ID                  = local.table_name
-      AWS_DEPLOYED                           = true
-      AWS_REKOGNITION_COLLECTION_ID          = local.aws_rekognition_collection_id
+      DEBUG_MODE                                         = var.debug_mode
+      MAX_FACES_COUNT                                    = var.aws_rekognition_max_faces_count
+      AWS_REKOGNITION_FACE_DETECT_THRESHOLD              = var.aws_rekognition_face_detect_threshold
+      QUALITY_FILTER                                     = var.aws_rekognition_face_detect_quality_filter
+      AWS_REKOGNITION_FACE_DETECT_ATTRIBUTES             = var.aws_rekognition_face_detect_attributes
+      AWS_DYNAMODB_TABLE_ID                              = local.table_name
+      AWS_DEPLOYED                                       = true
+      AWS_REKOGNITION_INDEX_FACES_TPS                    = var.aws_rekognition_index_faces_tps
+      AWS_REKOGNITION_SEARCH_FACES_TPS                   = var.aws_rekognition_search_faces_tps
+      AWS_REKOGNITION_RATE_LIMIT_MAX_WAIT_SECONDS        = var.aws_rekognition_rate_limit_max_wait_seconds
+      AWS_REKOGNITION_RATE_LIMIT_COORDINATED             = var.aws_rekognition_rate_limit_coordinated
+      AWS_DYNAMODB_RATE_LIMIT_TABLE_ID                   = local.rate_limit_table_name
+      AWS_REKOGNITION_COLLECTION_ID                      = local.aws_rekognition_collection_id
+      AWS_REKOGNITION_IMAGE_NORMALIZE                    = var.aws_rekognition_image_normalize
+      AWS_REKOGNITION_IMAGE_MAX_EDGE                     = var.aws_rekognition_image_max_edge
+      AWS_REKOGNITION_IMAGE_JPEG_QUALITY                 = var.aws_rekognition_image_jpeg_quality
+      AWS_LAMBDA_SEARCH_FACE_CACHE_MAX_ENTRIES           = var.lambda_search_face_cache_max_entries
+      AWS_LAMBDA_SEARCH_FACE_CACHE_MAX_BYTES             = var.lambda_search_face_cache_max_bytes
+      AWS_LAMBDA_SEARCH_FACE_CACHE_TTL_SECONDS           = var.lambda_search_face_cache_ttl_seconds
+      AWS_LAMBDA_SEARCH_FACE_CACHE_NEGATIVE              = var.lambda_search_face_cache_negative
+      AWS_LAMBDA_SEARCH_FACE_CACHE_NEGATIVE_TTL_SECONDS  = var.lambda_search_face_cache_negative_ttl_seconds
+      AWS_DYNAMODB_SEARCH_CACHE_TABLE_ID                 = local.search_cache_table_name
+      AWS_LAMBDA_SEARCH_RESULT_CACHE                     = var.lambda_search_result_cache
+      AWS_LAMBDA_SEARCH_RESULT_CACHE_TTL_SECONDS         = var.lambda_search_result_cache_ttl_seconds
+      AWS_LAMBDA_SEARCH_RESULT_CACHE_MAX_ENTRIES         = var.lambda_search_result_cache_max_entries
+      AWS_LAMBDA_SEARCH_RESULT_CACHE_MAX_BYTES           = var.lambda_search_result_cache_max_bytes
+      AWS_LAMBDA_SEARCH_RESULT_CACHE_VERSION_TTL_SECONDS = var.lambda_search_result_cache_version_ttl_seconds
+      AWS_LAMBDA_SEARCH_MULTI_FACE_MAX_FACES             = var.lambda_search_multi_face_max_faces
+      AWS_LAMBDA_SEARCH_MULTI_FACE_MAX_WORKERS           = var.lambda_search_multi_face_max_workers
+      AWS_LAMBDA_SEARCH_BATCH_MAX_IMAGES                 = var.lambda_search_batch_max_images
+      AWS_LAMBDA_SEARCH_BATCH_MAX_WORKERS                = var.lambda_search_batch_max_workers
+      AWS_DYNAMODB_SEARCH_JOBS_TABLE_ID                  = local.search_jobs_table_name
+      AWS_LAMBDA_SEARCH_BUCKET                           = module.s3_bucket.s3_bucket_id
+      AWS_LAMBDA_SEARCH_JOBS_QUEUE_URL                   = aws_sqs_queue.search_jobs.url
+      AWS_LAMBDA_SEARCH_JOBS_MAX_IMAGES                  = var.lambda_search_jobs_max_images
+      AWS_LAMBDA_SEARCH_JOBS_RETENTION_DAYS              = var.lambda_search_jobs_retention_days
+      AWS_LAMBDA_SEARCH_JOBS_MAX_RECEIVE_COUNT           = var.lambda_search_jobs_max_receive_count
+      AWS_LAMBDA_SEARCH_UPLOAD_EXPIRES_SECONDS           = var.lambda_search_upload_expires_seconds
     }
   }
 }
 
+###############################################################################
+# Asynchronous search jobs. POST /search/jobs enqueues the chunks of a job,
+# and the search Lambda consumes them. see rekognition_api/jobs.py
+###############################################################################
+resource "aws_sqs_queue" "search_jobs_dlq" {
+  name                      = "${local.search_function_name}_jobs-dlq"
+  message_retention_seconds = 1209600
+  tags                      = var.tags
+}
+
+resource "aws_sqs_queue" "search_jobs" {
+  name = "${local.search_function_name}_jobs"
+
+  # see https://docs.aws.amazon.com/lambda/latest/dg/with-sqs.html#events-sqs-queueconfig
+  visibility_timeout_seconds = 6 * var.lambda_timeout
+  redrive_policy = jsonencode({
+    deadLetterTargetArn = aws_sqs_queue.search_jobs_dlq.arn
+    maxReceiveCount     = var.lambda_search_jobs_max_receive_count
+  })
+  tags = var.tags
+}
+
+# one chunk per invocation: a chunk is as large as a synchronous batch search
+resource "aws_lambda_event_source_mapping" "search_jobs" {
+  event_source_arn        = aws_sqs_queue.search_jobs.arn
+  function_name           = aws_lambda_function.search.arn
+  batch_size              = 1
+  function_response_types = ["ReportBatchItemFailures"]
+
+  scaling_config {
+    maximum_concurrency = var.lambda_search_jobs_maximum_concurrency
+  }
+}
+
 ###############################################################################
 # Cloudwatch logging
 ###############################################################################
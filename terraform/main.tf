@@ -9,4 +9,9 @@
 locals {
   aws_rekognition_collection_id = "${var.shared_resource_identifier}-collection"
   table_name                    = var.shared_resource_identifier
+  ledger_table_name             = "${var.shared_resource_identifier}-ledger"
+  content_table_name            = "${var.shared_resource_identifier}-content"
+  rate_limit_table_name         = "${var.shared_resource_identifier}-ratelimit"
+  search_cache_table_name       = "${var.shared_resource_identifier}-searchcache"
+  search_jobs_table_name        = "${var.shared_resource_identifier}-searchjobs"
 }
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+Backfill: index the images that were already in the S3 bucket before the
+S3 notification that triggers lambda_index existed.
+
+    python -m rekognition_api.backfill --bucket BUCKET --prefix photos/ --workers 16
+
+Objects are listed one list_objects_v2 page (up to 1,000 keys) at a time,
+wrapped in S3 event records and indexed by the lambda_index pipeline, see
+lambda_index.index_records(). Once the faceprints of a page have been
+written, the status of each of its keys and the continuation token of the
+next page are appended to a local JSON Lines checkpoint file, so that an
+interrupted backfill resumes with the page that it was working on:
+
+    python -m rekognition_api.backfill --bucket BUCKET --prefix photos/ --checkpoint photos.jsonl
+
+The bucket name of a deployment has a random suffix, see s3.tf, so it is
+always passed explicitly, for instance from `terraform output -raw s3_bucket`.
+
+Objects that are already indexed are skipped by the idempotency ledger
+(see ledger.py), so overlapping or repeated backfills are cheap. Rekognition
+calls are paced by the rate limiter, see throttle.py
+"""
+
+# python stuff
+import argparse
+import json
+import time
+from urllib.parse import quote_plus
+
+# our stuff
+from rekognition_api.checkpoint import append_checkpoint, read_checkpoint
+from rekognition_api.conf import settings
+from rekognition_api.lambda_index import index_records
+from rekognition_api.s3 import get_s3_client
+
+
+BACKFILL_PAGE_SIZE = 1000
+BACKFILL_SUFFIXES = (".jpg",)
+
+
+def s3_event_record(bucket: str, s3_object: dict) -> dict:
+    """Return an S3 'ObjectCreated:Put' event record for an object returned by list_objects_v2."""
+    return {
+        "eventSource": "aws:s3",
+        "eventName": "ObjectCreated:Put",
+        "s3": {
+            "bucket": {"name": bucket},
+            "object": {
+                # S3 event notifications url-encode the object key
+                "key": quote_plus(s3_object["Key"], encoding="utf-8"),
+                "eTag": s3_object.get("ETag", "").strip('"') or None,
+                "size": s3_object.get("Size"),
+            },
+        },
+    }
+
+
+def list_pages(bucket: str, prefix: str, continuation_token: str = None, page_size: int = BACKFILL_PAGE_SIZE):
+    """Yield (objects, next continuation token) for each list_objects_v2 page under a prefix."""
+    client = get_s3_client()
+    while True:
+        kwargs = {"Bucket": bucket, "Prefix": prefix, "MaxKeys": page_size}
+        if continuation_token:
+            kwargs["ContinuationToken"] = continuation_token
+        response = client.list_objects_v2(**kwargs)
+        continuation_token = response.get("NextContinuationToken")
+        yield response.get("Contents", []), continuation_token
+        if not continuation_token:
+            return
+
+
+class Checkpoint:
+    """
+    Append-only JSON Lines checkpoint of a backfill. Each completed page
+    appends one {"key", "statusCode"} line per object, followed by a
+    {"continuationToken", "done"} line for the next page.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.continuation_token = None
+        self.done = False
+        self.statuses = {}
+        self.load()
+
+    def load(self):
+        """Read the state of a previous run of the backfill."""
+        for entry in read_checkpoint(self.path):
+            if "key" in entry:
+                self.statuses[entry["key"]] = entry["statusCode"]
+            else:
+                self.continuation_token = entry.get("continuationToken")
+                self.done = entry.get("done", False)
+
+    @property
+    def failed_keys(self) -> list:
+        """Return the keys whose most recent attempt failed."""
+        return [key for key, status_code in self.statuses.items() if status_code != 200]
+
+    def is_indexed(self, key: str) -> bool:
+        """Was this key indexed by a previous run?"""
+        return self.statuses.get(key) == 200
+
+    def save_page(self, results: list, continuation_token: str = None, done: bool = False):
+        """Append the per-key results of a completed page, and where to continue from."""
+        for result in results:
+            self.statuses[result["key"]] = result["statusCode"]
+        self.continuation_token = continuation_token
+        self.done = done
+        entries = [{"key": result["key"], "statusCode": result["statusCode"]} for result in results]
+        entries.append({"continuationToken": continuation_token, "done": done})
+        append_checkpoint(self.path, entries)
+
+
+class BackfillStats:
+    """Running totals and throughput of a backfill."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.counts = dict.fromkeys(("pages", "objects", "indexed", "skipped", "failed", "faces", "itemsWritten"), 0)
+        self.counts["consumedCapacityUnits"] = 0.0
+
+    def add(self, results: list, dynamodb_stats: dict):
+        """Add the results of one page."""
+        counts = self.counts
+        counts["pages"] += 1
+        for result in results:
+            counts["objects"] += 1
+            body = result["body"]
+            if result["statusCode"] != 200:
+                counts["failed"] += 1
+            elif "skipped" in body:
+                counts["skipped"] += 1
+            else:
+                counts["indexed"] += 1
+                counts["faces"] += len(body.get("FaceRecords", []))
+        counts["itemsWritten"] += dynamodb_stats.get("itemsWritten", 0)
+        counts["consumedCapacityUnits"] += dynamodb_stats.get("consumedCapacityUnits", 0.0)
+
+    def to_dict(self) -> dict:
+        """Return the totals and the throughput since the backfill started."""
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        return {
+            **self.counts,
+            "elapsedSeconds": round(elapsed, 1),
+            "objectsPerSecond": round(self.counts["objects"] / elapsed, 2),
+            "facesPerSecond": round(self.counts["faces"] / elapsed, 2),
+        }
+
+
+def index_page(records: list, max_workers: int, checkpoint: Checkpoint, stats: BackfillStats, **kwargs):
+    """Index the records of one page and checkpoint them."""
+    results, dynamodb_stats = index_records(records, max_workers=max_workers) if records else ([], {})
+    checkpoint.save_page(results, **kwargs)
+    stats.add(results, dynamodb_stats)
+    print(json.dumps({"backfill": stats.to_dict()}))
+
+
+# pylint: disable=too-many-arguments,too-many-positional-arguments
+def backfill(
+    bucket: str,
+    prefix: str = "",
+    checkpoint_path: str = None,
+    max_workers: int = None,
+    page_size: int = BACKFILL_PAGE_SIZE,
+    suffixes: tuple = BACKFILL_SUFFIXES,
+    retry_failed: bool = False,
+) -> dict:
+    """
+    Index every object under a prefix whose key ends with one of the suffixes.
+    Returns the backfill stats.
+    """
+    checkpoint = Checkpoint(checkpoint_path)
+    stats = BackfillStats()
+    max_workers = max_workers or settings.aws_lambda_index_max_workers
+
+    if retry_failed:
+        failed_keys = checkpoint.failed_keys
+        for i in range(0, len(failed_keys), page_size):
+            records = [s3_event_record(bucket, {"Key": key}) for key in failed_keys[i : i + page_size]]
+            index_page(
+                records,
+                max_workers,
+                checkpoint,
+                stats,
+                continuation_token=checkpoint.continuation_token,
+                done=checkpoint.done,
+            )
+
+    if checkpoint.done:
+        return stats.to_dict()
+
+    for objects, continuation_token in list_pages(bucket, prefix, checkpoint.continuation_token, page_size):
+        records = [
+            s3_event_record(bucket, s3_object)
+            for s3_object in objects
+            if s3_object["Key"].lower().endswith(suffixes) and not checkpoint.is_indexed(s3_object["Key"])
+        ]
+        index_page(
+            records, max_workers, checkpoint, stats, continuation_token=continuation_token, done=not continuation_token
+        )
+
+    return stats.to_dict()
+
+
+def main(argv=None):
+    """Command-line entry point."""
+    parser = argparse.ArgumentParser(
+        prog="python -m rekognition_api.backfill",
+        description="Index the images that are already in the S3 bucket.",
+    )
+    parser.add_argument(
+        "--bucket", required=True, help="the bucket to index, for instance from `terraform output -raw s3_bucket`"
+    )
+    parser.add_argument("--prefix", default="", help="only index objects under this key prefix")
+    parser.add_argument("--checkpoint", default=None, help="JSON Lines file to checkpoint to and resume from")
+    parser.add_argument("--workers", type=int, default=settings.aws_lambda_index_max_workers, help="thread pool size")
+    parser.add_argument("--page-size", type=int, default=BACKFILL_PAGE_SIZE, help="list_objects_v2 MaxKeys")
+    parser.add_argument(
+        "--suffix", action="append", default=None, help=f"object key suffix to index. default: {BACKFILL_SUFFIXES}"
+    )
+    parser.add_argument("--retry-failed", action="store_true", help="re-index the keys that failed in the checkpoint")
+    args = parser.parse_args(argv)
+
+    try:
+        stats = backfill(
+            bucket=args.bucket,
+            prefix=args.prefix,
+            checkpoint_path=args.checkpoint,
+            max_workers=args.workers,
+            page_size=args.page_size,
+            suffixes=tuple(suffix.lower() for suffix in args.suffix) if args.suffix else BACKFILL_SUFFIXES,
+            retry_failed=args.retry_failed,
+        )
+    except KeyboardInterrupt:
+        print(json.dumps({"backfill": "interrupted. re-run with the same --checkpoint to resume."}))
+        return 130
+
+    print(json.dumps({"backfill": "complete", "stats": stats}))
+    return 1 if stats["failed"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+In-process caches that survive across warm Lambda invocations.
+
+A Lambda container serves many invocations, one after another, and module
+level state lives as long as the container does. LRUCache is a bounded,
+thread-safe, least-recently-used cache with a time-to-live per entry and an
+estimate of the memory that its entries use, so that a long-lived container
+can't grow it beyond settings.aws_lambda_search_face_cache_max_bytes.
+
+The face cache sits in front of the faceprint lookup of lambda_search.
+Faceprint rows never change after they are indexed, so their only reason to
+expire is to bound the age of a row that was deleted. FaceIds without a row
+are cached too, as NOT_FOUND, but only for a short negative TTL, because
+lambda_index writes a faceprint row shortly after Rekognition has indexed
+the face, and a search can land in between.
+
+    cache = get_face_cache()
+    item = cache.get(face_id)  # MISSING, NOT_FOUND or the cached item
+"""
+
+# python stuff
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# our stuff
+from rekognition_api.conf import settings
+
+
+MISSING = object()
+NOT_FOUND = object()
+
+_lock = threading.Lock()
+_face_cache = None
+
+
+def estimate_size(value) -> int:
+    """Return an estimate, in bytes, of the memory used by a value and everything that it contains."""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set)):
+        size += sum(estimate_size(v) for v in value)
+    return size
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache with a TTL per entry, bounded by a number of
+    entries and by the estimated memory of its keys and values.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl_seconds: float, sizeof=estimate_size):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.sizeof = sizeof
+        self.counts = {"bytes": 0, "hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+        self._entries = OrderedDict()  # key -> (value, expires, size), least recently used first
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def bytes(self) -> int:
+        """Return the estimated memory of the keys and values."""
+        return self.counts["bytes"]
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self.counts["bytes"] -= size
+
+    def get(self, key, default=MISSING):
+        """Return the value of an unexpired entry and mark it as recently used, or `default`."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= time.monotonic():
+                self._remove(key)
+                self.counts["expirations"] += 1
+                entry = None
+            if entry is None:
+                self.counts["misses"] += 1
+                return default
+            self._entries.move_to_end(key)
+            self.counts["hits"] += 1
+            return entry[0]
+
+    def put(self, key, value, ttl_seconds: float = None):
+        """Add or replace an entry, evicting least recently used entries to stay within bounds."""
+        size = self.sizeof(key) + self.sizeof(value)
+        if size > self.max_bytes:
+            # would evict everything else and still not fit
+            return
+        expires = time.monotonic() + (ttl_seconds if ttl_seconds is not None else self.ttl_seconds)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, expires, size)
+            self.counts["bytes"] += size
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.counts["evictions"] += 1
+
+    def clear(self):
+        """Remove every entry. The counters are kept."""
+        with self._lock:
+            self._entries.clear()
+            self.counts["bytes"] = 0
+
+    @property
+    def stats(self) -> dict:
+        """Return the size and the counters of the cache."""
+        with self._lock:
+            counts = dict(self.counts)
+        lookups = counts["hits"] + counts["misses"]
+        return {
+            "entries": len(self._entries),
+            **counts,
+            "hitRatio": round(counts["hits"] / lookups, 4) if lookups else None,
+        }
+
+
+class FaceCache(LRUCache):
+    """LRU cache of faceprint items keyed on FaceId, with an optional negative cache."""
+
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    def __init__(
+        self,
+        max_entries: int,
+        max_bytes: int,
+        ttl_seconds: float,
+        negative: bool = True,
+        negative_ttl_seconds: float = 60,
+    ):
+        super().__init__(max_entries, max_bytes, ttl_seconds)
+        self.negative = negative
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.counts["negativeHits"] = 0
+
+    def get(self, key, default=MISSING):
+        """Return the cached item of a FaceId, NOT_FOUND if it has no faceprint row, or `default`."""
+        value = super().get(key, default)
+        if value is NOT_FOUND:
+            with self._lock:
+                self.counts["negativeHits"] += 1
+        return value
+
+    def put_not_found(self, face_id: str):
+        """Remember, briefly, that a FaceId has no faceprint row."""
+        if self.negative:
+            self.put(face_id, NOT_FOUND, ttl_seconds=self.negative_ttl_seconds)
+
+
+def get_face_cache() -> FaceCache:
+    """Return the face cache that is shared by every invocation and thread of this container."""
+    global _face_cache  # pylint: disable=global-statement
+    with _lock:
+        if _face_cache is None:
+            _face_cache = FaceCache(
+                max_entries=settings.aws_lambda_search_face_cache_max_entries,
+                max_bytes=settings.aws_lambda_search_face_cache_max_bytes,
+                ttl_seconds=settings.aws_lambda_search_face_cache_ttl_seconds,
+                negative=settings.aws_lambda_search_face_cache_negative,
+                negative_ttl_seconds=settings.aws_lambda_search_face_cache_negative_ttl_seconds,
+            )
+    return _face_cache
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""
+Append-only JSON Lines checkpoint files, shared by the backfill and rebuild
+commands. Each completed unit of work appends its entries as one write,
+which is flushed and fsync'ed, so that an interrupted run resumes from the
+last unit that was written in full.
+"""
+
+# python stuff
+import json
+import os
+
+
+def read_checkpoint(path: str):
+    """Yield the entries of a checkpoint file, oldest first. Yields nothing if there is no file yet."""
+    if not path or not os.path.exists(path):
+        return
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def append_checkpoint(path: str, entries: list):
+    """Append entries to a checkpoint file, durably. Does nothing without a path."""
+    if not path:
+        return
+    lines = [json.dumps(entry) for entry in entries]
+    with open(path, "a", encoding="utf-8") as file:
+        file.write("\n".join(lines) + "\n")
+        file.flush()
+        os.fsync(file.fileno())
@@ -164,6 +164,11 @@ class SettingsDefaults:
 
     # aws dynamodb defaults
     AWS_DYNAMODB_TABLE_ID = SHARED_RESOURCE_IDENTIFIER
+    AWS_DYNAMODB_LEDGER_TABLE_ID = SHARED_RESOURCE_IDENTIFIER + "-ledger"
+    AWS_DYNAMODB_CONTENT_TABLE_ID = SHARED_RESOURCE_IDENTIFIER + "-content"
+    AWS_DYNAMODB_RATE_LIMIT_TABLE_ID = SHARED_RESOURCE_IDENTIFIER + "-ratelimit"
+    AWS_DYNAMODB_SEARCH_CACHE_TABLE_ID = SHARED_RESOURCE_IDENTIFIER + "-searchcache"
+    AWS_DYNAMODB_SEARCH_JOBS_TABLE_ID = SHARED_RESOURCE_IDENTIFIER + "-searchjobs"
 
     # aws rekognition defaults
     AWS_REKOGNITION_COLLECTION_ID = SHARED_RESOURCE_IDENTIFIER + "-collection"
@@ -171,6 +176,55 @@ class SettingsDefaults:
     AWS_REKOGNITION_FACE_DETECT_THRESHOLD: int = int(TFVARS.get("aws_rekognition_face_detect_threshold", 10))
     AWS_REKOGNITION_FACE_DETECT_ATTRIBUTES = TFVARS.get("aws_rekognition_face_detect_attributes", "DEFAULT")
     AWS_REKOGNITION_FACE_DETECT_QUALITY_FILTER = TFVARS.get("aws_rekognition_face_detect_quality_filter", "AUTO")
+    AWS_REKOGNITION_INDEX_FACES_TPS: float = float(TFVARS.get("aws_rekognition_index_faces_tps", 50))
+    AWS_REKOGNITION_SEARCH_FACES_TPS: float = float(TFVARS.get("aws_rekognition_search_faces_tps", 50))
+    AWS_REKOGNITION_RATE_LIMIT_MAX_WAIT_SECONDS: int = int(
+        TFVARS.get("aws_rekognition_rate_limit_max_wait_seconds", 10)
+    )
+    AWS_REKOGNITION_RATE_LIMIT_COORDINATED: bool = bool(TFVARS.get("aws_rekognition_rate_limit_coordinated", False))
+    AWS_REKOGNITION_IMAGE_PREFLIGHT: bool = bool(TFVARS.get("aws_rekognition_image_preflight", True))
+    AWS_REKOGNITION_IMAGE_MIN_EDGE: int = int(TFVARS.get("aws_rekognition_image_min_edge", 80))
+    AWS_REKOGNITION_IMAGE_NORMALIZE: bool = bool(TFVARS.get("aws_rekognition_image_normalize", False))
+    AWS_REKOGNITION_IMAGE_MAX_EDGE: int = int(TFVARS.get("aws_rekognition_image_max_edge", 1920))
+    AWS_REKOGNITION_IMAGE_JPEG_QUALITY: int = int(TFVARS.get("aws_rekognition_image_jpeg_quality", 85))
+
+    # aws lambda defaults
+    AWS_LAMBDA_INDEX_MAX_WORKERS: int = int(TFVARS.get("aws_lambda_index_max_workers", 8))
+    AWS_LAMBDA_INDEX_IDEMPOTENCY: bool = bool(TFVARS.get("aws_lambda_index_idempotency", True))
+    AWS_LAMBDA_INDEX_LEDGER_LEASE_SECONDS: int = int(TFVARS.get("aws_lambda_index_ledger_lease_seconds", 300))
+    AWS_LAMBDA_INDEX_CONTENT_DEDUP: bool = bool(TFVARS.get("aws_lambda_index_content_dedup", False))
+    AWS_LAMBDA_SEARCH_FACE_CACHE_MAX_ENTRIES: int = int(TFVARS.get("aws_lambda_search_face_cache_max_entries", 10000))
+    AWS_LAMBDA_SEARCH_FACE_CACHE_MAX_BYTES: int = int(
+        TFVARS.get("aws_lambda_search_face_cache_max_bytes", 8 * 1024 * 1024)
+    )
+    AWS_LAMBDA_SEARCH_FACE_CACHE_TTL_SECONDS: int = int(TFVARS.get("aws_lambda_search_face_cache_ttl_seconds", 3600))
+    AWS_LAMBDA_SEARCH_FACE_CACHE_NEGATIVE: bool = bool(TFVARS.get("aws_lambda_search_face_cache_negative", True))
+    AWS_LAMBDA_SEARCH_FACE_CACHE_NEGATIVE_TTL_SECONDS: int = int(
+        TFVARS.get("aws_lambda_search_face_cache_negative_ttl_seconds", 60)
+    )
+    AWS_LAMBDA_SEARCH_RESULT_CACHE: bool = bool(TFVARS.get("aws_lambda_search_result_cache", True))
+    AWS_LAMBDA_SEARCH_RESULT_CACHE_TTL_SECONDS: int = int(
+        TFVARS.get("aws_lambda_search_result_cache_ttl_seconds", 3600)
+    )
+    AWS_LAMBDA_SEARCH_RESULT_CACHE_MAX_ENTRIES: int = int(
+        TFVARS.get("aws_lambda_search_result_cache_max_entries", 1000)
+    )
+    AWS_LAMBDA_SEARCH_RESULT_CACHE_MAX_BYTES: int = int(
+        TFVARS.get("aws_lambda_search_result_cache_max_bytes", 16 * 1024 * 1024)
+    )
+    AWS_LAMBDA_SEARCH_RESULT_CACHE_VERSION_TTL_SECONDS: int = int(
+        TFVARS.get("aws_lambda_search_result_cache_version_ttl_seconds", 1)
+    )
+    AWS_LAMBDA_SEARCH_MULTI_FACE_MAX_FACES: int = int(TFVARS.get("aws_lambda_search_multi_face_max_faces", 10))
+    AWS_LAMBDA_SEARCH_MULTI_FACE_MAX_WORKERS: int = int(TFVARS.get("aws_lambda_search_multi_face_max_workers", 4))
+    AWS_LAMBDA_SEARCH_BATCH_MAX_IMAGES: int = int(TFVARS.get("aws_lambda_search_batch_max_images", 50))
+    AWS_LAMBDA_SEARCH_BATCH_MAX_WORKERS: int = int(TFVARS.get("aws_lambda_search_batch_max_workers", 8))
+    AWS_LAMBDA_SEARCH_BUCKET = ""
+    AWS_LAMBDA_SEARCH_JOBS_QUEUE_URL = ""
+    AWS_LAMBDA_SEARCH_JOBS_MAX_IMAGES: int = int(TFVARS.get("aws_lambda_search_jobs_max_images", 1000))
+    AWS_LAMBDA_SEARCH_JOBS_RETENTION_DAYS: int = int(TFVARS.get("aws_lambda_search_jobs_retention_days", 1))
+    AWS_LAMBDA_SEARCH_JOBS_MAX_RECEIVE_COUNT: int = int(TFVARS.get("aws_lambda_search_jobs_max_receive_count", 3))
+    AWS_LAMBDA_SEARCH_UPLOAD_EXPIRES_SECONDS: int = int(TFVARS.get("aws_lambda_search_upload_expires_seconds", 300))
 
     @classmethod
     def to_dict(cls):
@@ -215,6 +269,7 @@ class Settings(BaseSettings):
     _aws_apigateway_client = None
     _aws_s3_client = None
     _aws_dynamodb_client = None
+    _aws_dynamodb_resource = None
     _aws_rekognition_client = None
     _aws_access_key_id_source: str = "unset"
     _aws_secret_access_key_source: str = "unset"
@@ -302,9 +357,7 @@ class Settings(BaseSettings):
         logger.debug(f"initialized settings: {self.aws_auth}")
         self._initialized = True
 
-    shared_resource_identifier: Optional[str] = Field(
-        SettingsDefaults.SHARED_RESOURCE_IDENTIFIER, env="SHARED_RESOURCE_IDENTIFIER"
-    )
+    shared_resource_identifier: Optional[str] = Field(SettingsDefaults.SHARED_RESOURCE_IDENTIFIER)
     debug_mode: Optional[bool] = Field(
         SettingsDefaults.DEBUG_MODE,
         env="DEBUG_MODE",
@@ -319,20 +372,16 @@ class Settings(BaseSettings):
     )
     aws_profile: Optional[str] = Field(
         SettingsDefaults.AWS_PROFILE,
-        env="AWS_PROFILE",
     )
     aws_access_key_id: Optional[SecretStr] = Field(
         SettingsDefaults.AWS_ACCESS_KEY_ID,
-        env="AWS_ACCESS_KEY_ID",
     )
     aws_secret_access_key: Optional[SecretStr] = Field(
         SettingsDefaults.AWS_SECRET_ACCESS_KEY,
-        env="AWS_SECRET_ACCESS_KEY",
     )
     aws_regions: Optional[List[str]] = Field(AWS_REGIONS, description="The list of AWS regions")
     aws_region: Optional[str] = Field(
         SettingsDefaults.AWS_REGION,
-        env="AWS_REGION",
     )
     aws_apigateway_create_custom_domaim: Optional[bool] = Field(
         SettingsDefaults.AWS_APIGATEWAY_CREATE_CUSTOM_DOMAIN,
@@ -342,24 +391,20 @@ class Settings(BaseSettings):
     )
     aws_apigateway_root_domain: Optional[str] = Field(
         SettingsDefaults.AWS_APIGATEWAY_ROOT_DOMAIN,
-        env="AWS_APIGATEWAY_ROOT_DOMAIN",
     )
     aws_dynamodb_table_id: Optional[str] = Field(
         SettingsDefaults.AWS_DYNAMODB_TABLE_ID,
-        env="AWS_DYNAMODB_TABLE_ID",
     )
+    aws_dynamodb_ledger_table_id: Optional[str] = Field(SettingsDefaults.AWS_DYNAMODB_LEDGER_TABLE_ID)
     aws_rekognition_collection_id: Optional[str] = Field(
         SettingsDefaults.AWS_REKOGNITION_COLLECTION_ID,
-        env="AWS_REKOGNITION_COLLECTION_ID",
     )
 
     aws_rekognition_face_detect_attributes: Optional[str] = Field(
         SettingsDefaults.AWS_REKOGNITION_FACE_DETECT_ATTRIBUTES,
-        env="AWS_REKOGNITION_FACE_DETECT_ATTRIBUTES",
     )
     aws_rekognition_face_detect_quality_filter: Optional[str] = Field(
         SettingsDefaults.AWS_REKOGNITION_FACE_DETECT_QUALITY_FILTER,
-        env="AWS_REKOGNITION_FACE_DETECT_QUALITY_FILTER",
     )
     aws_rekognition_face_detect_max_faces_count: Optional[int] = Field(
         SettingsDefaults.AWS_REKOGNITION_FACE_DETECT_MAX_FACES_COUNT,
@@ -375,6 +420,79 @@ class Settings(BaseSettings):
         pre=True,
         getter=lambda v: empty_str_to_int_default(v, SettingsDefaults.AWS_REKOGNITION_FACE_DETECT_THRESHOLD),
     )
+    aws_lambda_index_max_workers: Optional[int] = Field(SettingsDefaults.AWS_LAMBDA_INDEX_MAX_WORKERS, gt=0)
+    aws_lambda_index_idempotency: Optional[bool] = Field(SettingsDefaults.AWS_LAMBDA_INDEX_IDEMPOTENCY)
+    aws_lambda_index_ledger_lease_seconds: Optional[int] = Field(
+        SettingsDefaults.AWS_LAMBDA_INDEX_LEDGER_LEASE_SECONDS, gt=0
+    )
+    aws_dynamodb_content_table_id: Optional[str] = Field(SettingsDefaults.AWS_DYNAMODB_CONTENT_TABLE_ID)
+    aws_lambda_index_content_dedup: Optional[bool] = Field(SettingsDefaults.AWS_LAMBDA_INDEX_CONTENT_DEDUP)
+    aws_rekognition_index_faces_tps: Optional[float] = Field(SettingsDefaults.AWS_REKOGNITION_INDEX_FACES_TPS, gt=0)
+    aws_rekognition_search_faces_tps: Optional[float] = Field(SettingsDefaults.AWS_REKOGNITION_SEARCH_FACES_TPS, gt=0)
+    aws_rekognition_rate_limit_max_wait_seconds: Optional[int] = Field(
+        SettingsDefaults.AWS_REKOGNITION_RATE_LIMIT_MAX_WAIT_SECONDS, gt=0
+    )
+    aws_rekognition_rate_limit_coordinated: Optional[bool] = Field(
+        SettingsDefaults.AWS_REKOGNITION_RATE_LIMIT_COORDINATED
+    )
+    aws_dynamodb_rate_limit_table_id: Optional[str] = Field(SettingsDefaults.AWS_DYNAMODB_RATE_LIMIT_TABLE_ID)
+    aws_rekognition_image_preflight: Optional[bool] = Field(SettingsDefaults.AWS_REKOGNITION_IMAGE_PREFLIGHT)
+    aws_rekognition_image_min_edge: Optional[int] = Field(SettingsDefaults.AWS_REKOGNITION_IMAGE_MIN_EDGE, gt=0)
+    aws_rekognition_image_normalize: Optional[bool] = Field(SettingsDefaults.AWS_REKOGNITION_IMAGE_NORMALIZE)
+    aws_rekognition_image_max_edge: Optional[int] = Field(SettingsDefaults.AWS_REKOGNITION_IMAGE_MAX_EDGE, gt=0)
+    aws_rekognition_image_jpeg_quality: Optional[int] = Field(SettingsDefaults.AWS_REKOGNITION_IMAGE_JPEG_QUALITY, gt=0)
+    aws_lambda_search_face_cache_max_entries: Optional[int] = Field(
+        SettingsDefaults.AWS_LAMBDA_SEARCH_FACE_CACHE_MAX_ENTRIES, gt=0
+    )
+    aws_lambda_search_face_cache_max_bytes: Optional[int] = Field(
+        SettingsDefaults.AWS_LAMBDA_SEARCH_FACE_CACHE_MAX_BYTES, gt=0
+    )
+    aws_lambda_search_face_cache_ttl_seconds: Optional[int] = Field(
+        SettingsDefaults.AWS_LAMBDA_SEARCH_FACE_CACHE_TTL_SECONDS, gt=0
+    )
+    aws_lambda_search_face_cache_negative: Optional[bool] = Field(
+        SettingsDefaults.AWS_LAMBDA_SEARCH_FACE_CACHE_NEGATIVE
+    )
+    aws_lambda_search_face_cache_negative_ttl_seconds: Optional[int] = Field(
+        SettingsDefaults.AWS_LAMBDA_SEARCH_FACE_CACHE_NEGATIVE_TTL_SECONDS, gt=0
+    )
+    aws_dynamodb_search_cache_table_id: Optional[str] = Field(SettingsDefaults.AWS_DYNAMODB_SEARCH_CACHE_TABLE_ID)
+    aws_lambda_search_result_cache: Optional[bool] = Field(SettingsDefaults.AWS_LAMBDA_SEARCH_RESULT_CACHE)
+    aws_lambda_search_result_cache_ttl_seconds: Optional[int] = Field(
+        SettingsDefaults.AWS_LAMBDA_SEARCH_RESULT_CACHE_TTL_SECONDS, gt=0
+    )
+    aws_lambda_search_result_cache_max_entries: Optional[int] = Field(
+        SettingsDefaults.AWS_LAMBDA_SEARCH_RESULT_CACHE_MAX_ENTRIES, gt=0
+    )
+    aws_lambda_search_result_cache_max_bytes: Optional[int] = Field(
+        SettingsDefaults.AWS_LAMBDA_SEARCH_RESULT_CACHE_MAX_BYTES, gt=0
+    )
+    aws_lambda_search_result_cache_version_ttl_seconds: Optional[int] = Field(
+        SettingsDefaults.AWS_LAMBDA_SEARCH_RESULT_CACHE_VERSION_TTL_SECONDS, gt=0
+    )
+    aws_lambda_search_multi_face_max_faces: Optional[int] = Field(
+        SettingsDefaults.AWS_LAMBDA_SEARCH_MULTI_FACE_MAX_FACES, gt=0
+    )
+    aws_lambda_search_multi_face_max_workers: Optional[int] = Field(
+        SettingsDefaults.AWS_LAMBDA_SEARCH_MULTI_FACE_MAX_WORKERS, gt=0
+    )
+    aws_lambda_search_batch_max_images: Optional[int] = Field(SettingsDefaults.AWS_LAMBDA_SEARCH_BATCH_MAX_IMAGES, gt=0)
+    aws_lambda_search_batch_max_workers: Optional[int] = Field(
+        SettingsDefaults.AWS_LAMBDA_SEARCH_BATCH_MAX_WORKERS, gt=0
+    )
+    aws_dynamodb_search_jobs_table_id: Optional[str] = Field(SettingsDefaults.AWS_DYNAMODB_SEARCH_JOBS_TABLE_ID)
+    aws_lambda_search_bucket: Optional[str] = Field(SettingsDefaults.AWS_LAMBDA_SEARCH_BUCKET)
+    aws_lambda_search_jobs_queue_url: Optional[str] = Field(SettingsDefaults.AWS_LAMBDA_SEARCH_JOBS_QUEUE_URL)
+    aws_lambda_search_jobs_max_images: Optional[int] = Field(SettingsDefaults.AWS_LAMBDA_SEARCH_JOBS_MAX_IMAGES, gt=0)
+    aws_lambda_search_jobs_retention_days: Optional[int] = Field(
+        SettingsDefaults.AWS_LAMBDA_SEARCH_JOBS_RETENTION_DAYS, gt=0
+    )
+    aws_lambda_search_jobs_max_receive_count: Optional[int] = Field(
+        SettingsDefaults.AWS_LAMBDA_SEARCH_JOBS_MAX_RECEIVE_COUNT, gt=0
+    )
+    aws_lambda_search_upload_expires_seconds: Optional[int] = Field(
+        SettingsDefaults.AWS_LAMBDA_SEARCH_UPLOAD_EXPIRES_SECONDS, gt=0
+    )
     init_info: Optional[str] = Field(
         None,
         env="INIT_INFO",
@@ -482,6 +600,14 @@ class Settings(BaseSettings):
             self._aws_dynamodb_client = self.aws_session.client("dynamodb")
         return self._aws_dynamodb_client
 
+    @property
+    def aws_dynamodb_resource(self):
+        """DynamoDB resource"""
+        Services.raise_error_on_disabled(Services.AWS_DYNAMODB)
+        if not self._aws_dynamodb_resource:
+            self._aws_dynamodb_resource = self.aws_session.resource("dynamodb")
+        return self._aws_dynamodb_resource
+
     @property
     def aws_rekognition_client(self):
         """Rekognition client"""
@@ -494,8 +620,7 @@ class Settings(BaseSettings):
     def dynamodb_table(self):
         """DynamoDB table"""
         Services.raise_error_on_disabled(Services.AWS_DYNAMODB)
-        dynamodb_resource = boto3.resource("dynamodb")
-        return dynamodb_resource.Table(self.aws_dynamodb_table_id)
+        return self.aws_dynamodb_resource.Table(self.aws_dynamodb_table_id)
 
     @property
     def aws_s3_bucket_name(self) -> str:
@@ -558,6 +683,10 @@ class Settings(BaseSettings):
         """OpenAI API version"""
         return get_semantic_version()
 
+    def dump_prefix(self, prefix: str) -> dict:
+        """Dump the settings whose names start with a prefix."""
+        return {name: value for name, value in self if name.startswith(prefix)}
+
     @property
     def dump(self) -> dict:
         """Dump all settings."""
@@ -599,23 +728,15 @@ class Settings(BaseSettings):
                 "python_installed_packages": packages_dict,
             },
             "aws_auth": self.aws_auth,
-            "aws_rekognition": {
-                "aws_rekognition_collection_id": self.aws_rekognition_collection_id,
-                "aws_rekognition_face_detect_max_faces_count": self.aws_rekognition_face_detect_max_faces_count,
-                "aws_rekognition_face_detect_attributes": self.aws_rekognition_face_detect_attributes,
-                "aws_rekognition_face_detect_quality_filter": self.aws_rekognition_face_detect_quality_filter,
-                "aws_rekognition_face_detect_threshold": self.aws_rekognition_face_detect_threshold,
-            },
-            "aws_dynamodb": {
-                "aws_dynamodb_table_id": self.aws_dynamodb_table_id,
-            },
+            "aws_rekognition": self.dump_prefix("aws_rekognition_"),
+            "aws_dynamodb": self.dump_prefix("aws_dynamodb_"),
             "aws_apigateway": {
                 "aws_apigateway_create_custom_domaim": self.aws_apigateway_create_custom_domaim,
                 "aws_apigateway_name": self.aws_apigateway_name,
                 "aws_apigateway_root_domain": self.aws_apigateway_root_domain,
                 "aws_apigateway_domain_name": self.aws_apigateway_domain_name,
             },
-            "aws_lambda": {},
+            "aws_lambda": self.dump_prefix("aws_lambda_"),
             "aws_s3": {
                 "aws_s3_bucket_prefix": self.aws_s3_bucket_name,
             },
@@ -760,6 +881,82 @@ class Settings(BaseSettings):
             return SettingsDefaults.AWS_REKOGNITION_FACE_DETECT_THRESHOLD
         return int(v)
 
+    @field_validator(
+        "aws_dynamodb_ledger_table_id",
+        "aws_dynamodb_content_table_id",
+        "aws_dynamodb_rate_limit_table_id",
+        "aws_dynamodb_search_cache_table_id",
+        "aws_dynamodb_search_jobs_table_id",
+        "aws_lambda_search_bucket",
+        "aws_lambda_search_jobs_queue_url",
+    )
+    def validate_str_settings(cls, v, info: ValidationInfo) -> str:
+        """Validate the table, bucket and queue settings. An empty value is the default"""
+        if v in [None, ""]:
+            return getattr(SettingsDefaults, info.field_name.upper())
+        return v
+
+    @field_validator(
+        "aws_lambda_index_idempotency",
+        "aws_lambda_index_content_dedup",
+        "aws_rekognition_rate_limit_coordinated",
+        "aws_rekognition_image_preflight",
+        "aws_rekognition_image_normalize",
+        "aws_lambda_search_face_cache_negative",
+        "aws_lambda_search_result_cache",
+    )
+    def parse_bool_settings(cls, v, info: ValidationInfo) -> bool:
+        """Parse the feature flags. An empty value is the default"""
+        if isinstance(v, bool):
+            return v
+        if v in [None, ""]:
+            return getattr(SettingsDefaults, info.field_name.upper())
+        return v.lower() in ["true", "1", "t", "y", "yes"]
+
+    @field_validator(
+        "aws_lambda_index_max_workers",
+        "aws_lambda_index_ledger_lease_seconds",
+        "aws_rekognition_rate_limit_max_wait_seconds",
+        "aws_rekognition_image_min_edge",
+        "aws_rekognition_image_max_edge",
+        "aws_rekognition_image_jpeg_quality",
+        "aws_lambda_search_face_cache_max_entries",
+        "aws_lambda_search_face_cache_max_bytes",
+        "aws_lambda_search_face_cache_ttl_seconds",
+        "aws_lambda_search_face_cache_negative_ttl_seconds",
+        "aws_lambda_search_result_cache_ttl_seconds",
+        "aws_lambda_search_result_cache_max_entries",
+        "aws_lambda_search_result_cache_max_bytes",
+        "aws_lambda_search_result_cache_version_ttl_seconds",
+        "aws_lambda_search_multi_face_max_faces",
+        "aws_lambda_search_multi_face_max_workers",
+        "aws_lambda_search_batch_max_images",
+        "aws_lambda_search_batch_max_workers",
+        "aws_lambda_search_jobs_max_images",
+        "aws_lambda_search_jobs_retention_days",
+        "aws_lambda_search_jobs_max_receive_count",
+        "aws_lambda_search_upload_expires_seconds",
+    )
+    def check_int_settings(cls, v, info: ValidationInfo) -> int:
+        """Check the sizes, limits and durations. An empty value is the default"""
+        if isinstance(v, int):
+            return v
+        if v in [None, ""]:
+            return getattr(SettingsDefaults, info.field_name.upper())
+        return int(v)
+
+    @field_validator(
+        "aws_rekognition_index_faces_tps",
+        "aws_rekognition_search_faces_tps",
+    )
+    def check_float_settings(cls, v, info: ValidationInfo) -> float:
+        """Check the rate limits. An empty value is the default"""
+        if isinstance(v, (int, float)):
+            return float(v)
+        if v in [None, ""]:
+            return getattr(SettingsDefaults, info.field_name.upper())
+        return float(v)
+
 
 class SingletonSettings:
     """Singleton for Settings"""
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Content-addressed deduplication for lambda_index.
+
+The same photo is often uploaded under many different object keys. Each
+object is hashed (SHA-256, streamed from S3 in chunks rather than buffered)
+and the hash is looked up in a content table that maps ContentHash to the
+FaceIds that Rekognition returned for the first copy. A known hash links the
+new object key to the existing faceprints instead of calling IndexFaces again.
+
+This costs one S3 GET per new object, so it only pays off on buckets with
+many duplicates. see settings.aws_lambda_index_content_dedup
+"""
+
+# python stuff
+import hashlib
+import time
+
+# our stuff
+from rekognition_api.conf import settings
+from rekognition_api.s3 import S3ObjectDescriptor, get_s3_client
+
+
+CONTENT_HASH_ALGORITHM = "sha256"
+CONTENT_HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def get_content_client():
+    """Return the thread-safe client of the DynamoDB resource."""
+    return settings.aws_dynamodb_resource.meta.client
+
+
+def get_s3_uri(s3_object: S3ObjectDescriptor) -> str:
+    """Return the s3:// uri of an S3 object."""
+    return f"s3://{s3_object.bucket}/{s3_object.key}"
+
+
+def hash_s3_object(s3_object: S3ObjectDescriptor) -> str:
+    """Return the content hash of an S3 object, streaming its body in chunks."""
+    content_hash = hashlib.new(CONTENT_HASH_ALGORITHM)
+    body = get_s3_client().get_object(Bucket=s3_object.bucket, Key=s3_object.key)["Body"]
+    try:
+        for chunk in body.iter_chunks(chunk_size=CONTENT_HASH_CHUNK_SIZE):
+            content_hash.update(chunk)
+    finally:
+        body.close()
+    return f"{CONTENT_HASH_ALGORITHM}:{content_hash.hexdigest()}"
+
+
+def get_content_entry(content_hash: str) -> dict:
+    """Return the content table entry of a content hash, or None."""
+    response = get_content_client().get_item(
+        TableName=settings.aws_dynamodb_content_table_id,
+        Key={"ContentHash": content_hash},
+    )
+    return response.get("Item")
+
+
+def link_content_entry(content_hash: str, s3_object: S3ObjectDescriptor):
+    """Add an S3 object to the set of objects that share a content hash."""
+    get_content_client().update_item(
+        TableName=settings.aws_dynamodb_content_table_id,
+        Key={"ContentHash": content_hash},
+        UpdateExpression="ADD #objects :uri",
+        ExpressionAttributeNames={"#objects": "objects"},
+        ExpressionAttributeValues={":uri": {get_s3_uri(s3_object)}},
+    )
+
+
+def content_entry(content_hash: str, s3_object: S3ObjectDescriptor, face_ids: list) -> dict:
+    """Return the content table entry of a newly indexed S3 object."""
+    return {
+        "ContentHash": content_hash,
+        "FaceIds": face_ids,
+        "objects": {get_s3_uri(s3_object)},
+        "indexedAt": int(time.time()),
+    }
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""
+DynamoDB helpers shared by the Lambda functions.
+
+BatchWriter buffers items and writes them with BatchWriteItem, 25 items per
+request, which is the hard limit imposed by DynamoDB. Items that DynamoDB
+returns as UnprocessedItems are retried with jittered exponential backoff.
+
+batch_get_items() reads items with BatchGetItem, 100 keys per request, and
+retries UnprocessedKeys the same way.
+
+see https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/dynamodb/client/batch_write_item.html
+see https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/dynamodb/client/batch_get_item.html
+"""
+
+# python stuff
+import logging
+import random
+import threading
+import time
+from dataclasses import dataclass
+
+# our stuff
+from rekognition_api.conf import settings
+from rekognition_api.exceptions import RekognitionUnprocessedItemsError
+
+
+logger = logging.getLogger(__name__)
+
+BATCH_WRITE_MAX_ITEMS = 25
+BATCH_GET_MAX_KEYS = 100
+BATCH_MAX_ATTEMPTS = 8
+BATCH_BACKOFF_BASE_SECONDS = 0.05
+BATCH_BACKOFF_MAX_SECONDS = 5.0
+
+
+def backoff_delay(attempt: int) -> float:
+    """Return a 'full jitter' exponential backoff delay, in seconds, for the given retry attempt."""
+    return random.uniform(0, min(BATCH_BACKOFF_MAX_SECONDS, BATCH_BACKOFF_BASE_SECONDS * 2**attempt))  # nosec
+
+
+def consumed_capacity_units(response: dict) -> float:
+    """Sum the CapacityUnits of a response that was called with ReturnConsumedCapacity=TOTAL."""
+    return sum(float(capacity.get("CapacityUnits", 0)) for capacity in response.get("ConsumedCapacity", []))
+
+
+# pylint: disable=too-many-locals
+def batch_get_items(
+    key_values: list,
+    key_name: str = "FaceId",
+    table_name: str = None,
+    projection: tuple = None,
+    max_attempts: int = BATCH_MAX_ATTEMPTS,
+) -> dict:
+    """
+    Read the items of a list of primary key values with BatchGetItem, and
+    return them keyed on their primary key value. Keys without an item are
+    absent from the result. BatchGetItem returns items in no particular
+    order, so callers re-order them by their own list of keys.
+
+    projection: the attribute names to read. defaults to all attributes.
+    """
+    table_name = table_name or settings.aws_dynamodb_table_id
+    client = settings.aws_dynamodb_resource.meta.client
+    table_request = {}
+    if projection:
+        # attribute names such as 'key' are reserved words, so always use placeholders
+        names = {f"#p{i}": name for i, name in enumerate(projection)}
+        table_request = {"ProjectionExpression": ", ".join(names), "ExpressionAttributeNames": names}
+
+    # BatchGetItem rejects a request that contains the same key twice
+    unique_values = list(dict.fromkeys(key_values))
+    items = {}
+    for i in range(0, len(unique_values), BATCH_GET_MAX_KEYS):
+        keys = [{key_name: value} for value in unique_values[i : i + BATCH_GET_MAX_KEYS]]
+        request_items = {table_name: dict(table_request, Keys=keys)}
+        for attempt in range(max_attempts):
+            if attempt > 0:
+                time.sleep(backoff_delay(attempt))
+            response = client.batch_get_item(RequestItems=request_items)
+            for item in response.get("Responses", {}).get(table_name, []):
+                items[item[key_name]] = item
+            request_items = response.get("UnprocessedKeys") or {}
+            if not request_items:
+                break
+            logger.debug(
+                "BatchGetItem left %s keys unprocessed, attempt %s", len(request_items[table_name]["Keys"]), attempt + 1
+            )
+        else:
+            raise RekognitionUnprocessedItemsError(
+                f"BatchGetItem left {len(request_items[table_name]['Keys'])} keys unprocessed after {max_attempts} attempts"
+            )
+    return items
+
+
+@dataclass(frozen=True)
+class BatchWriterOptions:
+    """How a BatchWriter flushes and retries."""
+
+    max_attempts: int = BATCH_MAX_ATTEMPTS
+    auto_flush: bool = True
+
+
+class BatchWriter:
+    """
+    Thread-safe, buffered DynamoDB writer.
+
+    A single instance can be shared by all of the records of a multi-record
+    event, so that their writes coalesce into as few BatchWriteItem requests
+    as possible. Items may target more than one table. Items are flushed
+    automatically every 25 puts, unless auto_flush is False, and on exit when
+    used as a context manager:
+
+        with BatchWriter() as writer:
+            writer.put_item(item)
+
+    An item may be tagged with an owner, such as the index of the event record
+    that buffered it. A batch that can't be written lost the items of every
+    owner in it, not just those of the caller whose put triggered the write,
+    so the owners of every failed batch are collected in failed_owners.
+    """
+
+    def __init__(
+        self,
+        table_name: str = None,
+        key_names: tuple = ("FaceId",),
+        max_attempts: int = BATCH_MAX_ATTEMPTS,
+        auto_flush: bool = True,
+    ):
+        self.table_name = table_name or settings.aws_dynamodb_table_id
+        self.key_names = key_names
+        self.options = BatchWriterOptions(max_attempts=max_attempts, auto_flush=auto_flush)
+        self.failed_owners = set()
+        self.counts = {"itemsWritten": 0, "requests": 0, "retries": 0, "consumedCapacityUnits": 0.0}
+        self._lock = threading.Lock()
+
+        # keyed on the primary key because BatchWriteItem rejects a request
+        # that contains the same key twice. the last put wins.
+        self._pending = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+
+    def put_item(self, item: dict, table_name: str = None, key_names: tuple = None, owner=None):
+        """Buffer an item, writing a full batch if one is ready."""
+        table_name = table_name or self.table_name
+        key = (table_name,) + tuple(item[key_name] for key_name in key_names or self.key_names)
+        with self._lock:
+            self._pending[key] = (table_name, {"PutRequest": {"Item": item}}, owner)
+            ready = self.options.auto_flush and len(self._pending) >= BATCH_WRITE_MAX_ITEMS
+            batch = self._take_batch() if ready else None
+        if batch:
+            self._write(batch)
+
+    def flush(self):
+        """Write all buffered items. Every batch is attempted, then the first error is raised."""
+        error = None
+        while True:
+            with self._lock:
+                batch = self._take_batch()
+            if not batch:
+                break
+            try:
+                self._write(batch)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                error = error or e
+        if error:
+            raise error
+
+    def discard(self, owners: set):
+        """Drop the buffered items of the given owners."""
+        with self._lock:
+            self._pending = {key: value for key, value in self._pending.items() if value[2] not in owners}
+
+    def for_owner(self, owner) -> "OwnedBatchWriter":
+        """Return a view of this writer that tags every put with an owner."""
+        return OwnedBatchWriter(self, owner)
+
+    @property
+    def stats(self) -> dict:
+        """Return the write statistics of this writer."""
+        with self._lock:
+            return dict(self.counts)
+
+    def _take_batch(self) -> list:
+        """Remove and return up to BATCH_WRITE_MAX_ITEMS pending write requests. Caller holds the lock."""
+        keys = list(self._pending.keys())[:BATCH_WRITE_MAX_ITEMS]
+        return [self._pending.pop(key) for key in keys]
+
+    def _write(self, batch: list):
+        """Write a batch, recording its owners as failed if it can't be written."""
+        try:
+            self._write_requests(batch)
+        except Exception:
+            with self._lock:
+                self.failed_owners.update(owner for _, _, owner in batch if owner is not None)
+            raise
+
+    def _write_requests(self, batch: list):
+        """Write a batch, retrying UnprocessedItems with jittered exponential backoff."""
+        # the resource's client serializes native Python types (Decimal, dict, list)
+        # just like Table.put_item(), and unlike the resource itself it is thread-safe.
+        client = settings.aws_dynamodb_resource.meta.client
+        request_items = {}
+        for table_name, request, _owner in batch:
+            request_items.setdefault(table_name, []).append(request)
+        for attempt in range(self.options.max_attempts):
+            if attempt > 0:
+                time.sleep(backoff_delay(attempt))
+            response = client.batch_write_item(RequestItems=request_items, ReturnConsumedCapacity="TOTAL")
+            unprocessed_items = response.get("UnprocessedItems") or {}
+            unprocessed_count = sum(len(requests) for requests in unprocessed_items.values())
+            sent_count = sum(len(requests) for requests in request_items.values())
+            with self._lock:
+                self.counts["requests"] += 1
+                self.counts["retries"] += 1 if attempt > 0 else 0
+                self.counts["itemsWritten"] += sent_count - unprocessed_count
+                self.counts["consumedCapacityUnits"] += consumed_capacity_units(response)
+            if not unprocessed_items:
+                return
+            logger.debug("BatchWriteItem left %s items unprocessed, attempt %s", unprocessed_count, attempt + 1)
+            request_items = unprocessed_items
+
+        raise RekognitionUnprocessedItemsError(
+            f"BatchWriteItem left {unprocessed_count} items unprocessed after {self.options.max_attempts} attempts"
+        )
+
+
+class OwnedBatchWriter:
+    """A view of a shared BatchWriter that tags every put with an owner."""
+
+    def __init__(self, writer: BatchWriter, owner):
+        self.writer = writer
+        self.owner = owner
+
+    def put_item(self, item: dict, table_name: str = None, key_names: tuple = None):
+        """Buffer an item of this owner."""
+        self.writer.put_item(item, table_name=table_name, key_names=key_names, owner=self.owner)
+
+    def flush(self):
+        """Write all buffered items of the shared writer."""
+        self.writer.flush()
@@ -6,9 +6,29 @@ import boto3
 
 rekognition_client = boto3.client("rekognition")
 
+
+class RekognitionRateLimitExceededError(Exception):
+    """Exception raised when a Rekognition call would wait longer than allowed for the rate limiter."""
+
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+
+class RekognitionImageValidationError(Exception):
+    """Exception raised when an image fails pre-flight validation, before it is sent to Rekognition."""
+
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+
 EXCEPTION_MAP = {
-    rekognition_client.exceptions.ThrottlingException: (401, "InvalidParameterException"),
-    rekognition_client.exceptions.ProvisionedThroughputExceededException: (401, "InvalidParameterException"),
+    rekognition_client.exceptions.ThrottlingException: (429, "ThrottlingException"),
+    rekognition_client.exceptions.ProvisionedThroughputExceededException: (
+        429,
+        "ProvisionedThroughputExceededException",
+    ),
     rekognition_client.exceptions.ServiceQuotaExceededException: (401, "InvalidParameterException"),
     rekognition_client.exceptions.AccessDeniedException: (403, "AccessDeniedException"),
     rekognition_client.exceptions.ResourceNotFoundException: (404, "ResourceNotFoundException"),
@@ -16,6 +36,8 @@ EXCEPTION_MAP = {
     rekognition_client.exceptions.ImageTooLargeException: (406, "ImageTooLargeException"),
     rekognition_client.exceptions.InvalidImageFormatException: (406, "InvalidImageFormatException"),
     rekognition_client.exceptions.InternalServerError: (500, "InternalServerError"),
+    RekognitionRateLimitExceededError: (429, "ThrottlingException"),
+    RekognitionImageValidationError: (406, "ImageValidationError"),
     Exception: (500, "InternalServerError"),
 }
 
@@ -42,3 +64,19 @@ class RekognitionIlligalInvocationError(Exception):
     def __init__(self, message):
         self.message = message
         super().__init__(self.message)
+
+
+class RekognitionUnprocessedItemsError(Exception):
+    """Exception raised when DynamoDB leaves items unprocessed after all retries."""
+
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+
+class RekognitionSearchJobError(Exception):
+    """Exception raised when an asynchronous search job can't be created."""
+
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
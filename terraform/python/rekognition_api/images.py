@@ -0,0 +1,374 @@
+# -*- coding: utf-8 -*-
+"""
+Pre-flight validation of images, before they are sent to Rekognition.
+
+Rekognition only accepts JPEG and PNG images of at most 5 MB as Bytes, or
+15 MB as an S3 object, and it can't find faces in images smaller than
+80 pixels on either edge. Rather than paying for a round trip that ends in an
+InvalidImageFormatException or an ImageTooLargeException, the format and the
+dimensions are sniffed from the image header without decoding the image:
+
+- PNG: the IHDR chunk, which immediately follows the 8-byte signature.
+- JPEG: the first SOFn (start of frame) marker, found by walking the marker
+  segments that precede it. EXIF and ICC segments can push it past the first
+  few KB, so the header is read on demand, one small chunk at a time.
+
+For S3 objects each chunk is a ranged GET, so a typical image costs one or
+two requests of a few KB instead of downloading the whole object.
+
+Optionally, oversized images are normalized rather than rejected: they are
+downscaled to settings.aws_rekognition_image_max_edge and re-encoded as JPEG
+at settings.aws_rekognition_image_jpeg_quality. Rekognition gains nothing
+from pixels beyond face-sized detail, so a 12-48 MP phone photo becomes a
+few hundred KB. Normalization requires Pillow, which is an optional
+dependency. Without it, images are passed through unchanged.
+
+- Bytes (search): images whose longest edge exceeds the max edge, or that
+  exceed the 5 MB limit, are normalized.
+- S3 objects (index): Rekognition reads these from S3 itself, so only objects
+  that exceed the 15 MB limit are downloaded, normalized and sent as Bytes.
+
+Multi-face search crops each face that detect_faces found out of the image,
+see crop_faces(). This also requires Pillow.
+
+see https://docs.aws.amazon.com/rekognition/latest/dg/limits.html
+"""
+
+# python stuff
+import io
+import json
+import time
+from dataclasses import asdict, dataclass
+
+# our stuff
+from rekognition_api.conf import settings
+from rekognition_api.exceptions import (
+    RekognitionConfigurationError,
+    RekognitionImageValidationError,
+)
+from rekognition_api.s3 import S3ObjectDescriptor, get_object_bytes, get_s3_client
+
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = ImageOps = None
+
+IMAGE_FORMAT_JPEG = "jpeg"
+IMAGE_FORMAT_PNG = "png"
+IMAGE_MAX_BYTES = 5 * 1024 * 1024
+IMAGE_MAX_S3_OBJECT_BYTES = 15 * 1024 * 1024
+IMAGE_HEADER_CHUNK_SIZE = 8 * 1024
+IMAGE_HEADER_MAX_SEGMENTS = 64
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+JPEG_SOI = b"\xff\xd8"
+
+# SOF0..SOF15, less DHT (C4), JPG (C8) and DAC (CC), which share the range
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# markers without a length field: TEM and RST0..RST7
+JPEG_STANDALONE_MARKERS = {0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7}
+# SOS (start of scan) and EOI (end of image) mean that there is no frame header to find
+JPEG_END_MARKERS = {0xD9, 0xDA}
+
+# each face is cropped with this much of its bounding box added on every side,
+# so that Rekognition can detect the face again within the crop
+FACE_CROP_MARGIN = 0.25
+
+
+@dataclass(frozen=True)
+class ImageHeader:
+    """The format, dimensions and byte size of an image. Dimensions are None if the header is incomplete."""
+
+    format: str
+    width: int = None
+    height: int = None
+    size: int = None
+
+
+class ChunkedReader:
+    """
+    Random access reads over a fetch(offset, length) function, in chunks of
+    IMAGE_HEADER_CHUNK_SIZE, so that the many small reads of a header walk
+    cost as few fetches as possible.
+    """
+
+    def __init__(self, fetch, chunk_size: int = IMAGE_HEADER_CHUNK_SIZE):
+        self.fetch = fetch
+        self.chunk_size = chunk_size
+        self.fetches = 0
+        self._offset = 0
+        self._chunk = b""
+
+    def read(self, offset: int, length: int) -> bytes:
+        """Return up to length bytes at offset. Fewer at the end of the image."""
+        end = offset + length
+        if not (self._offset <= offset and end <= self._offset + len(self._chunk)):
+            self._chunk = self.fetch(offset, max(length, self.chunk_size))
+            self._offset = offset
+            self.fetches += 1
+        return self._chunk[offset - self._offset : end - self._offset]
+
+
+def sniff_png(read) -> ImageHeader:
+    """Return the header of a PNG image. The IHDR chunk is always first."""
+    ihdr = read(8, 16)
+    if len(ihdr) < 16 or ihdr[4:8] != b"IHDR":
+        return ImageHeader(format=IMAGE_FORMAT_PNG)
+    return ImageHeader(
+        format=IMAGE_FORMAT_PNG,
+        width=int.from_bytes(ihdr[8:12], "big"),
+        height=int.from_bytes(ihdr[12:16], "big"),
+    )
+
+
+def sniff_jpeg(read) -> ImageHeader:
+    """Return the header of a JPEG image, by walking its marker segments up to the first SOFn."""
+    offset = len(JPEG_SOI)
+    for _ in range(IMAGE_HEADER_MAX_SEGMENTS):
+        segment = read(offset, 4)
+        if len(segment) < 2 or segment[0] != 0xFF:
+            break
+        marker = segment[1]
+        if marker == 0xFF:
+            # fill byte
+            offset += 1
+            continue
+        if marker in JPEG_STANDALONE_MARKERS:
+            offset += 2
+            continue
+        if marker in JPEG_END_MARKERS or len(segment) < 4:
+            break
+        if marker in JPEG_SOF_MARKERS:
+            # length (2), sample precision (1), height (2), width (2)
+            frame = read(offset + 5, 4)
+            if len(frame) < 4:
+                break
+            return ImageHeader(
+                format=IMAGE_FORMAT_JPEG,
+                width=int.from_bytes(frame[2:4], "big"),
+                height=int.from_bytes(frame[0:2], "big"),
+            )
+        offset += 2 + int.from_bytes(segment[2:4], "big")
+    return ImageHeader(format=IMAGE_FORMAT_JPEG)
+
+
+def sniff_image_header(read, size: int = None) -> ImageHeader:
+    """
+    Return the header of an image, reading only its first few KB.
+    read: a read(offset, length) function over the image.
+    """
+    signature = read(0, len(PNG_SIGNATURE))
+    if signature.startswith(PNG_SIGNATURE):
+        header = sniff_png(read)
+    elif signature.startswith(JPEG_SOI):
+        header = sniff_jpeg(read)
+    else:
+        raise RekognitionImageValidationError("unsupported image format. expected a JPEG or PNG image.")
+    return ImageHeader(format=header.format, width=header.width, height=header.height, size=size)
+
+
+def sniff_bytes(image: bytes) -> ImageHeader:
+    """Return the header of an image in memory."""
+    view = memoryview(image)
+    return sniff_image_header(lambda offset, length: view[offset : offset + length].tobytes(), size=len(image))
+
+
+def sniff_s3_object(s3_object: S3ObjectDescriptor) -> ImageHeader:
+    """Return the header of an image in S3, with ranged GETs of its first few KB."""
+
+    def fetch(offset: int, length: int) -> bytes:
+        if s3_object.size is not None and offset >= s3_object.size:
+            # S3 rejects a range that starts past the end of the object
+            return b""
+        response = get_s3_client().get_object(
+            Bucket=s3_object.bucket,
+            Key=s3_object.key,
+            Range=f"bytes={offset}-{offset + length - 1}",
+        )
+        return response["Body"].read()
+
+    return sniff_image_header(ChunkedReader(fetch).read, size=s3_object.size)
+
+
+def validate_image_header(header: ImageHeader, max_bytes: int = IMAGE_MAX_BYTES) -> ImageHeader:
+    """
+    Raise RekognitionImageValidationError if Rekognition would reject the
+    image, or couldn't possibly find a face in it. Dimensions that couldn't
+    be sniffed are left for Rekognition to judge.
+    """
+    if header.size is not None and header.size > max_bytes:
+        raise RekognitionImageValidationError(
+            f"image is too large: {header.size} bytes. the maximum is {max_bytes} bytes."
+        )
+    min_edge = settings.aws_rekognition_image_min_edge
+    if header.width is not None and min(header.width, header.height) < min_edge:
+        raise RekognitionImageValidationError(
+            f"image is too small to contain a face: {header.width}x{header.height}. "
+            f"the minimum is {min_edge} pixels on each edge."
+        )
+    return header
+
+
+@dataclass(frozen=True)
+class NormalizedImage:
+    """The result of normalizing an image, and what it saved."""
+
+    data: bytes
+    original_bytes: int
+    normalized_bytes: int
+    width: int = None
+    height: int = None
+    elapsed_ms: float = 0.0
+
+    @property
+    def bytes_saved(self) -> int:
+        """Return the number of bytes that normalization saved."""
+        return self.original_bytes - self.normalized_bytes
+
+    def to_dict(self) -> dict:
+        """Return the stats of this normalization, for logging."""
+        stats = asdict(self)
+        stats.pop("data")
+        stats["bytes_saved"] = self.bytes_saved
+        return stats
+
+
+def is_normalization_available() -> bool:
+    """Is image normalization enabled, and is Pillow installed?"""
+    return settings.aws_rekognition_image_normalize and Image is not None
+
+
+def is_face_cropping_available() -> bool:
+    """Is Pillow installed, so that the faces of a multi-face search can be cropped?"""
+    return Image is not None
+
+
+def needs_normalization(header: ImageHeader, max_bytes: int = IMAGE_MAX_BYTES, max_edge: int = None) -> bool:
+    """Should this image be normalized before it is sent to Rekognition?"""
+    if header.size is not None and header.size > max_bytes:
+        return True
+    return max_edge is not None and header.width is not None and max(header.width, header.height) > max_edge
+
+
+def normalize_image(image: bytes, max_edge: int = None, quality: int = None) -> NormalizedImage:
+    """
+    Downscale an image to max_edge pixels on its longest edge, and re-encode
+    it as JPEG. The original is kept if the result isn't any smaller.
+    """
+    started = time.perf_counter()
+    max_edge = max_edge or settings.aws_rekognition_image_max_edge
+    quality = quality or settings.aws_rekognition_image_jpeg_quality
+
+    with Image.open(io.BytesIO(image)) as original:
+        # let the JPEG decoder scale by 1/2, 1/4 or 1/8 while decoding, which is much faster than a full decode
+        original.draft("RGB", (max_edge, max_edge))
+        # re-encoding drops the EXIF orientation tag, so apply it to the pixels first
+        normalized = ImageOps.exif_transpose(original)
+        normalized.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+        if normalized.mode != "RGB":
+            normalized = normalized.convert("RGB")
+        output = io.BytesIO()
+        normalized.save(output, format="JPEG", quality=quality, optimize=True)
+
+    data = output.getvalue()
+    if len(data) >= len(image):
+        data = image
+    return NormalizedImage(
+        data=data,
+        original_bytes=len(image),
+        normalized_bytes=len(data),
+        width=normalized.width,
+        height=normalized.height,
+        elapsed_ms=round((time.perf_counter() - started) * 1000, 1),
+    )
+
+
+def log_normalization(normalized: NormalizedImage):
+    """log the bytes saved, and the latency that normalization added"""
+    if settings.debug_mode:
+        print(json.dumps({"image_normalization": normalized.to_dict()}))
+
+
+def prepare_image_bytes(image: bytes) -> dict:
+    """
+    Return the Rekognition Image parameter for an image in memory, after
+    pre-flight validation and optional normalization.
+    """
+    preflight = settings.aws_rekognition_image_preflight
+    normalize = is_normalization_available()
+    if not (preflight or normalize):
+        return {"Bytes": image}
+
+    header = sniff_bytes(image)
+    if normalize and needs_normalization(header, max_edge=settings.aws_rekognition_image_max_edge):
+        normalized = normalize_image(image)
+        log_normalization(normalized)
+        image = normalized.data
+        header = sniff_bytes(image)
+    if preflight:
+        validate_image_header(header)
+    return {"Bytes": image}
+
+
+def prepare_s3_image(s3_object: S3ObjectDescriptor) -> dict:
+    """
+    Return the Rekognition Image parameter for an image in S3, after
+    pre-flight validation and, for objects that are too large to be read
+    from S3 by Rekognition, optional normalization.
+    """
+    preflight = settings.aws_rekognition_image_preflight
+    normalize = is_normalization_available()
+    if not (preflight or normalize):
+        return s3_object.rekognition_image
+
+    header = sniff_s3_object(s3_object)
+    if normalize and needs_normalization(header, max_bytes=IMAGE_MAX_S3_OBJECT_BYTES):
+        return prepare_image_bytes(get_object_bytes(s3_object.bucket, s3_object.key))
+    if preflight:
+        validate_image_header(header, max_bytes=IMAGE_MAX_S3_OBJECT_BYTES)
+    return s3_object.rekognition_image
+
+
+def crop_box(bounding_box: dict, width: int, height: int, margin: float = FACE_CROP_MARGIN) -> tuple:
+    """
+    Return the (left, upper, right, lower) pixel box of a Rekognition
+    BoundingBox, whose values are ratios of the image width and height,
+    widened by `margin` on every side and clipped to the image.
+    """
+    box_width = bounding_box["Width"] * width
+    box_height = bounding_box["Height"] * height
+    left = bounding_box["Left"] * width - margin * box_width
+    top = bounding_box["Top"] * height - margin * box_height
+    right = left + box_width * (1 + 2 * margin)
+    bottom = top + box_height * (1 + 2 * margin)
+    return (
+        max(0, int(left)),
+        max(0, int(top)),
+        min(width, int(round(right))),
+        min(height, int(round(bottom))),
+    )
+
+
+def crop_faces(image: bytes, bounding_boxes: list, margin: float = FACE_CROP_MARGIN, quality: int = None) -> list:
+    """
+    Crop each Rekognition BoundingBox out of an image, and encode the crops
+    as JPEG. The image is decoded once for all of its faces.
+
+    Rekognition reports bounding boxes as ratios of the orientation-corrected
+    image, so the EXIF orientation is applied to the whole image before the
+    crops are cut.
+    """
+    if Image is None:
+        raise RekognitionConfigurationError("multi-face search requires Pillow, which is not installed")
+    quality = quality or settings.aws_rekognition_image_jpeg_quality
+    crops = []
+    with Image.open(io.BytesIO(image)) as original:
+        oriented = ImageOps.exif_transpose(original)
+        pixels = oriented if oriented.mode == "RGB" else oriented.convert("RGB")
+        for bounding_box in bounding_boxes:
+            crop = pixels.crop(crop_box(bounding_box, pixels.width, pixels.height, margin))
+            output = io.BytesIO()
+            crop.save(output, format="JPEG", quality=quality)
+            crops.append(output.getvalue())
+    return crops
@@ -0,0 +1,401 @@
+# -*- coding: utf-8 -*-
+"""
+Asynchronous search jobs.
+
+A batch search has to finish within API Gateway's 29 second integration
+timeout, which caps its size. A search job takes the same request body as a
+batch search, see uploads.py, and returns right away:
+
+1.) POST /search/jobs stores the images in the S3 bucket, writes a job item
+    to the job table, and enqueues the job on an SQS queue in chunks of
+    settings.aws_lambda_search_batch_max_images images.
+2.) lambda_search consumes the queue. Each chunk is searched with
+    search_batch(), exactly like a batch search, and its results are written
+    to the S3 bucket. Chunks are searched in parallel by as many Lambda
+    containers as the event source mapping allows.
+3.) the chunk that completes the job marks it as SUCCEEDED and, if the job
+    has a callback URL, POSTs the finished job to it.
+4.) GET /search/jobs/{job_id} returns the status of the job, and its results
+    once it has SUCCEEDED.
+
+Job images are stored under search-jobs/ without a .jpg suffix, so that the
+bucket notification of lambda_index doesn't index them. They are deleted as
+soon as their chunk has been searched. Job items and results expire after
+settings.aws_lambda_search_jobs_retention_days.
+"""
+
+# python stuff
+import http.client
+import ipaddress
+import json
+import socket
+import ssl
+import threading
+import time
+import urllib.parse
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# our stuff
+from rekognition_api.conf import settings
+from rekognition_api.exceptions import RekognitionSearchJobError, RekognitionValueError
+from rekognition_api.s3 import get_s3_client
+from rekognition_api.utils import DateTimeEncoder
+
+
+SEARCH_JOBS_PREFIX = "search-jobs/"
+JOB_STATUS_QUEUED = "QUEUED"
+JOB_STATUS_RUNNING = "RUNNING"
+JOB_STATUS_SUCCEEDED = "SUCCEEDED"
+JOB_STATUS_FAILED = "FAILED"
+JOB_CALLBACK_TIMEOUT_SECONDS = 10
+SQS_SEND_MESSAGE_BATCH_MAX = 10
+
+_lock = threading.Lock()
+_queue_client = None
+
+
+def get_jobs_client():
+    """Return the thread-safe client of the DynamoDB resource."""
+    return settings.aws_dynamodb_resource.meta.client
+
+
+def get_queue_client():
+    """Return the SQS client that is shared by every invocation of this container."""
+    global _queue_client  # pylint: disable=global-statement
+    with _lock:
+        if _queue_client is None:
+            _queue_client = settings.aws_session.client("sqs")
+    return _queue_client
+
+
+def get_job_image_key(job_id: str, index: int) -> str:
+    """Return the S3 key of an image of a job. Not a .jpg, so that lambda_index ignores it."""
+    return f"{SEARCH_JOBS_PREFIX}{job_id}/images/{index:05d}"
+
+
+def get_job_results_key(job_id: str, chunk: int) -> str:
+    """Return the S3 key of the results of a chunk of a job."""
+    return f"{SEARCH_JOBS_PREFIX}{job_id}/results/{chunk:05d}.json"
+
+
+def is_ip_address(host: str) -> bool:
+    """Is this host an IPv4 or IPv6 address literal, rather than a host name?"""
+    try:
+        ipaddress.ip_address(host.split("%")[0])
+    except ValueError:
+        return False
+    return True
+
+
+def validate_callback_url(callback_url: str):
+    """
+    Only https callbacks to a public host name are allowed. The results hold
+    the names of the matched faces, and lambda_search must not POST them to
+    internal endpoints such as the instance metadata service.
+    """
+    if callback_url is None:
+        return
+    try:
+        parts = urllib.parse.urlsplit(callback_url)
+        _ = parts.port
+    except ValueError as e:
+        raise RekognitionValueError(f"callbackUrl is not a valid URL: {e}") from e
+    host = parts.hostname
+    if parts.scheme != "https" or not host:
+        raise RekognitionValueError("callbackUrl must be an https URL")
+    if is_ip_address(host):
+        raise RekognitionValueError("callbackUrl must have a host name, not an IP address")
+    if "." not in host or host == "localhost" or host.endswith(".localhost"):
+        raise RekognitionValueError(f"callbackUrl host {host} is not a public host name")
+
+
+def resolve_callback_address(callback_url: str) -> str:
+    """
+    Validate a callback URL, and resolve its host name right before the
+    callback is sent, since DNS can change. Every address must be public,
+    that is, not loopback, private, link-local or reserved. Returns the
+    address to connect to, so that the host name isn't resolved again.
+    """
+    validate_callback_url(callback_url)
+    parts = urllib.parse.urlsplit(callback_url)
+    addresses = [info[4][0] for info in socket.getaddrinfo(parts.hostname, parts.port or 443, proto=socket.IPPROTO_TCP)]
+    if not addresses or not all(ipaddress.ip_address(address.split("%")[0]).is_global for address in addresses):
+        raise RekognitionValueError(f"callbackUrl host {parts.hostname} does not resolve to a public address")
+    return addresses[0]
+
+
+class PinnedHTTPSConnection(http.client.HTTPSConnection):
+    """
+    An HTTPSConnection to an address that was already resolved and validated.
+    The certificate is still verified against the host name of the URL.
+    """
+
+    def __init__(self, *args, address: str = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.address = address
+
+    def connect(self):
+        """Connect to the pinned address rather than resolving the host name again."""
+        sock = socket.create_connection((self.address, self.port), self.timeout, self.source_address)
+        self.sock = self._context.wrap_socket(sock, server_hostname=self.host)
+
+
+class PinnedHTTPSHandler(urllib.request.HTTPSHandler):
+    """An HTTPSHandler whose connections go to a pinned address, see PinnedHTTPSConnection."""
+
+    def __init__(self, address: str):
+        super().__init__(context=ssl.create_default_context())
+        self.address = address
+
+    def https_open(self, req):
+        return self.do_open(PinnedHTTPSConnection, req, context=self._context, address=self.address)
+
+
+def get_callback_opener(address: str) -> urllib.request.OpenerDirector:
+    """
+    Return an opener that only speaks https to a pinned address. It has no
+    HTTPRedirectHandler, so a redirect is returned as is rather than followed
+    to a host that was never validated.
+    """
+    opener = urllib.request.OpenerDirector()
+    opener.add_handler(PinnedHTTPSHandler(address))
+    return opener
+
+
+def put_job_image(job_id: str, index: int, image_id: str, image) -> dict:
+    """Store an image of a job. Returns its manifest entry, or the decoding error of the image."""
+    if isinstance(image, Exception):
+        return {"id": image_id, "error": str(image)}
+    key = get_job_image_key(job_id, index)
+    get_s3_client().put_object(Bucket=settings.aws_lambda_search_bucket, Key=key, Body=image)
+    return {"id": image_id, "key": key}
+
+
+def create_job(images: list, multi_face: bool = False, callback_url: str = None, search_overrides: dict = None) -> dict:
+    """
+    Store the images of a job, and enqueue its chunks. images is a list of
+    (id, image bytes) pairs, see uploads.get_batch_images(). Returns the status of the job.
+
+    search_overrides: the validated per-request search parameters that every
+                      chunk of the job is searched with, see lambda_search.get_search_overrides()
+    """
+    validate_callback_url(callback_url)
+    job_id = uuid.uuid4().hex
+    max_workers = max(1, min(len(images), settings.aws_lambda_search_batch_max_workers))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        manifest = list(
+            executor.map(lambda args: put_job_image(job_id, *args), [(i, *image) for i, image in enumerate(images)])
+        )
+
+    chunk_size = settings.aws_lambda_search_batch_max_images
+    chunks = [manifest[i : i + chunk_size] for i in range(0, len(manifest), chunk_size)]
+    now = int(time.time())
+    item = {
+        "JobId": job_id,
+        "status": JOB_STATUS_QUEUED,
+        "multiFace": multi_face,
+        "imageCount": len(images),
+        "chunkCount": len(chunks),
+        "createdAt": now,
+        "expiresAt": now + settings.aws_lambda_search_jobs_retention_days * 24 * 60 * 60,
+    }
+    if callback_url:
+        item["callbackUrl"] = callback_url
+    if search_overrides:
+        # FaceMatchThreshold is a float, which the DynamoDB serializer rejects
+        item["searchOverrides"] = json.dumps(search_overrides)
+    get_jobs_client().put_item(TableName=settings.aws_dynamodb_search_jobs_table_id, Item=item)
+
+    # the job item has to exist before a worker can receive one of its chunks
+    entries = [
+        {"Id": str(chunk), "MessageBody": json.dumps({"jobId": job_id, "chunk": chunk, "images": chunk_images})}
+        for chunk, chunk_images in enumerate(chunks)
+    ]
+    for i in range(0, len(entries), SQS_SEND_MESSAGE_BATCH_MAX):
+        response = get_queue_client().send_message_batch(
+            QueueUrl=settings.aws_lambda_search_jobs_queue_url, Entries=entries[i : i + SQS_SEND_MESSAGE_BATCH_MAX]
+        )
+        if response.get("Failed"):
+            raise RekognitionSearchJobError(f"could not enqueue search job {job_id}: {response['Failed']}")
+    return get_job_status(item)
+
+
+def get_job(job_id: str) -> dict:
+    """Return the job item, or None if there is no such job."""
+    response = get_jobs_client().get_item(
+        TableName=settings.aws_dynamodb_search_jobs_table_id, Key={"JobId": job_id}, ConsistentRead=True
+    )
+    return response.get("Item")
+
+
+def get_job_chunk_results(job_id: str, chunk: int) -> list:
+    """Return the results of a chunk of a job."""
+    response = get_s3_client().get_object(
+        Bucket=settings.aws_lambda_search_bucket, Key=get_job_results_key(job_id, chunk)
+    )
+    return json.loads(response["Body"].read())
+
+
+def get_job_results(job: dict) -> list:
+    """Return the results of every chunk of a job, in the order of its images."""
+    chunk_count = int(job["chunkCount"])
+    max_workers = max(1, min(chunk_count, settings.aws_lambda_search_batch_max_workers))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        chunks = executor.map(lambda chunk: get_job_chunk_results(job["JobId"], chunk), range(chunk_count))
+        return [result for results in chunks for result in results]
+
+
+def get_job_search_overrides(job: dict) -> dict:
+    """Return the per-request search parameters of a job, see create_job()."""
+    return json.loads(job.get("searchOverrides") or "{}")
+
+
+def get_job_status(job: dict, results: bool = False) -> dict:
+    """Return the client-facing status of a job, with its results if it has SUCCEEDED and results is set."""
+    retval = {
+        "jobId": job["JobId"],
+        "status": job["status"],
+        "imageCount": int(job["imageCount"]),
+        "chunkCount": int(job["chunkCount"]),
+        "chunksDone": len(job.get("chunksDone", [])),
+        "createdAt": int(job["createdAt"]),
+    }
+    if "finishedAt" in job:
+        retval["finishedAt"] = int(job["finishedAt"])
+    if "error" in job:
+        retval["error"] = job["error"]
+    if results and job["status"] == JOB_STATUS_SUCCEEDED:
+        retval["results"] = get_job_results(job)
+    return retval
+
+
+def load_job_image(entry: dict) -> tuple:
+    """Return the (id, image bytes) pair of a manifest entry, or the error of an image that couldn't be decoded."""
+    if "error" in entry:
+        return entry["id"], RekognitionValueError(entry["error"])
+    response = get_s3_client().get_object(Bucket=settings.aws_lambda_search_bucket, Key=entry["key"])
+    return entry["id"], response["Body"].read()
+
+
+def load_job_images(images: list) -> list:
+    """Return the (id, image bytes) pairs of a chunk of a job, see search_batch()."""
+    max_workers = max(1, min(len(images), settings.aws_lambda_search_batch_max_workers))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(load_job_image, images))
+
+
+def start_job_chunk(job_id: str) -> dict:
+    """Mark a job as RUNNING, unless it has already finished. Returns the job item, or None."""
+    client = get_jobs_client()
+    try:
+        response = client.update_item(
+            TableName=settings.aws_dynamodb_search_jobs_table_id,
+            Key={"JobId": job_id},
+            UpdateExpression="SET #status = :running",
+            ConditionExpression="attribute_exists(JobId) AND #status IN (:queued, :running)",
+            ExpressionAttributeNames={"#status": "status"},
+            ExpressionAttributeValues={
+                ":queued": JOB_STATUS_QUEUED,
+                ":running": JOB_STATUS_RUNNING,
+            },
+            ReturnValues="ALL_NEW",
+        )
+    except client.exceptions.ConditionalCheckFailedException:
+        # the job expired, failed, or a redelivered chunk of a job that already SUCCEEDED
+        return None
+    return response["Attributes"]
+
+
+def finish_job_chunk(job: dict, chunk: int, images: list, results: list) -> dict:
+    """
+    Store the results of a chunk, and mark the job as SUCCEEDED if this was
+    its last chunk. Returns the job item if this call finished the job, otherwise None.
+    """
+    job_id = job["JobId"]
+    s3_client = get_s3_client()
+    s3_client.put_object(
+        Bucket=settings.aws_lambda_search_bucket,
+        Key=get_job_results_key(job_id, chunk),
+        Body=json.dumps(results, cls=DateTimeEncoder).encode("utf-8"),
+        ContentType="application/json",
+    )
+    keys = [{"Key": entry["key"]} for entry in images if "key" in entry]
+    if keys:
+        s3_client.delete_objects(Bucket=settings.aws_lambda_search_bucket, Delete={"Objects": keys, "Quiet": True})
+
+    # chunksDone is a set, so that a redelivered chunk is only counted once
+    client = get_jobs_client()
+    response = client.update_item(
+        TableName=settings.aws_dynamodb_search_jobs_table_id,
+        Key={"JobId": job_id},
+        UpdateExpression="ADD chunksDone :chunk",
+        ExpressionAttributeValues={":chunk": {str(chunk)}},
+        ReturnValues="ALL_NEW",
+    )
+    if len(response["Attributes"]["chunksDone"]) < int(job["chunkCount"]):
+        return None
+    try:
+        response = client.update_item(
+            TableName=settings.aws_dynamodb_search_jobs_table_id,
+            Key={"JobId": job_id},
+            UpdateExpression="SET #status = :succeeded, finishedAt = :now",
+            ConditionExpression="#status = :running",
+            ExpressionAttributeNames={"#status": "status"},
+            ExpressionAttributeValues={
+                ":succeeded": JOB_STATUS_SUCCEEDED,
+                ":running": JOB_STATUS_RUNNING,
+                ":now": int(time.time()),
+            },
+            ReturnValues="ALL_NEW",
+        )
+    except client.exceptions.ConditionalCheckFailedException:
+        # another container finished the job
+        return None
+    return response["Attributes"]
+
+
+def fail_job(job_id: str, error: str) -> dict:
+    """Mark a job as FAILED. Returns the job item if this call failed the job, otherwise None."""
+    client = get_jobs_client()
+    try:
+        response = client.update_item(
+            TableName=settings.aws_dynamodb_search_jobs_table_id,
+            Key={"JobId": job_id},
+            UpdateExpression="SET #status = :failed, finishedAt = :now, #error = :error",
+            ConditionExpression="attribute_exists(JobId) AND #status IN (:queued, :running)",
+            ExpressionAttributeNames={"#status": "status", "#error": "error"},
+            ExpressionAttributeValues={
+                ":failed": JOB_STATUS_FAILED,
+                ":queued": JOB_STATUS_QUEUED,
+                ":running": JOB_STATUS_RUNNING,
+                ":now": int(time.time()),
+                ":error": error,
+            },
+            ReturnValues="ALL_NEW",
+        )
+    except client.exceptions.ConditionalCheckFailedException:
+        return None
+    return response["Attributes"]
+
+
+def send_job_callback(job: dict):
+    """POST the status of a finished job, with its results, to its callback URL. Failures are only logged."""
+    callback_url = job.get("callbackUrl")
+    if not callback_url:
+        return
+    body = json.dumps(get_job_status(job, results=True), cls=DateTimeEncoder).encode("utf-8")
+    request = urllib.request.Request(
+        callback_url, data=body, headers={"Content-Type": "application/json"}, method="POST"
+    )
+    try:
+        opener = get_callback_opener(resolve_callback_address(callback_url))
+        with opener.open(request, timeout=JOB_CALLBACK_TIMEOUT_SECONDS) as response:
+            if not 200 <= response.status < 300:
+                # including a 3xx, which is never followed
+                raise RekognitionSearchJobError(f"callback returned HTTP {response.status}")
+            print(json.dumps({"jobId": job["JobId"], "callback": callback_url, "statusCode": response.status}))
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        # the results can still be polled
+        print(json.dumps({"jobId": job["JobId"], "callback": callback_url, "error": str(e)}))
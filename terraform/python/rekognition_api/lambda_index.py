@@ -26,15 +26,27 @@ and search operations using the SearchFaces and SearchFacesByImage operations.
 - The input image is passed either as base64-encoded image bytes,
     or as a reference to an image in an Amazon S3 bucket.
 
-Facial recognition analysis and indexing of images. Invoked by S3.
+Facial recognition analysis and indexing of images. Invoked by S3, either
+directly or through an SQS queue that buffers the S3 notifications.
 
 AWS Lambda to process image files uploaded to S3.
 1.) analyze image file with Rekognition.index_faces() to generate
     'faceprints' of all faces found in the image
 
-2.) index each 'faceprint' by persisting it to DynamoDB
+2.) index each 'faceprint' by persisting it to DynamoDB. writes are
+    batched with BatchWriteItem and coalesced across all event records.
 
-returns: a JSON HTTP response object.
+    S3 object versions that were already indexed, identified by
+    (bucket, key, ETag) in an idempotency ledger, are skipped before
+    calling Rekognition. see ledger.py
+
+    optionally, identical images uploaded under different keys are linked
+    to the existing faceprints by content hash. see dedup.py
+
+3.) repeat steps 1 and 2 for every record in the S3 event, on a bounded
+    thread pool so that multi-record notifications are indexed concurrently.
+
+returns: a JSON HTTP response object with one result per event record.
 
 Note that this Lambda is invoked by an S3 'put' event, and as of sep-2023
 the response goes undetected by S3. I'm hopeful that the http response
@@ -45,22 +57,51 @@ detecting and forwarding these downstream to API Gateway.
 # python stuff
 import json  # library for interacting with JSON data https://www.json.org/json-en.html
 import logging  # library for interacting with application log data
-from decimal import (  # Python Decimal data type, for type casting JSON return data https://docs.python.org/3/library/decimal.html
-    Decimal,
-)
-from urllib.parse import (  # to 'de-escape' string representations of URL values
-    unquote_plus,
+from concurrent.futures import (  # bounded thread pool for multi-record events
+    ThreadPoolExecutor,
 )
 
 from rekognition_api.conf import settings
+from rekognition_api.dedup import (
+    content_entry,
+    get_content_entry,
+    hash_s3_object,
+    link_content_entry,
+)
+from rekognition_api.dynamodb import BatchWriter
 from rekognition_api.exceptions import EXCEPTION_MAP, RekognitionIlligalInvocationError
+from rekognition_api.images import prepare_s3_image
+from rekognition_api.ledger import (
+    claim_ledger_entry,
+    completed_ledger_entry,
+    get_ledger_entry,
+    is_indexed,
+    release_ledger_entry,
+)
+from rekognition_api.s3 import (
+    S3ObjectDescriptor,
+    get_bucket_name_from_record,
+    get_object_etag_from_record,
+    get_object_key_from_record,
+)
+from rekognition_api.search_cache import bump_collection_version
 
 # our stuff
+from rekognition_api.throttle import get_rekognition_client
 from rekognition_api.utils import (
     cloudwatch_handler,
     exception_response_factory,
+    face_record_to_dynamodb_item,
+    get_display_name,
     http_response_factory,
 )
+from rekognition_api.warmup import (
+    is_warmup_event,
+    prime_dynamodb,
+    prime_rekognition,
+    prime_s3,
+    warm_up,
+)
 
 
 # vanity stuff to reduce the verbosity of superfluous log data generated by urllib3
@@ -79,13 +120,50 @@ def get_bucket_name(event):
     return records[0]["s3"]["bucket"]["name"]
 
 
+def is_sqs_event(event) -> bool:
+    """is this event a batch of SQS-wrapped S3 notifications?"""
+    return get_records(event)[0].get("eventSource") == "aws:sqs"
+
+
+def get_sqs_s3_records(message) -> list:
+    """returns the validated S3 event records wrapped in an SQS message"""
+    body = json.loads(message["body"])
+    if not isinstance(body, dict):
+        raise TypeError("SQS message body is not an S3 event notification")
+
+    # S3 sends an s3:TestEvent, which has no Records, when the notification is created.
+    records = body.get("Records", [])
+    for record in records:
+        validate_s3_record(record)
+    return records
+
+
+def validate_s3_record(record):
+    """raise an exception if record is not an S3 'ObjectCreated:Put' event record"""
+    if record["eventSource"] != "aws:s3":
+        service = record["eventSource"]
+        msg = f"lambda_index() is intended to be called from aws:s3 or aws:sqs, but was invoked by {service}"
+        raise RekognitionIlligalInvocationError(msg)
+
+    if "bucket" not in record["s3"]:
+        raise TypeError("bucket not found in event object")
+
+    if record["eventName"] != "ObjectCreated:Put":
+        event = record["eventName"]
+        msg = f"lambda_index() is intended to be called for ObjectCreated:Put event, but was invoked by {event}"
+        raise RekognitionIlligalInvocationError(msg)
+
+
 def validate_event(event):
     """
-    This Lambda is supposed to be invoked by S3 'ObjectCreated:Put' events.
+    This Lambda is supposed to be invoked by S3 'ObjectCreated:Put' events, either
+    directly or buffered through an SQS queue ('aws:sqs' envelope).
     however, nothing prevents it from being invoked for any other reason.
 
     So, we add some basic business rule enforcement to ensure that the contents of the
-    'event' variable match what we are expecting.
+    'event' variable match what we are expecting. The S3 notifications inside of an
+    SQS envelope are validated per message, so that one bad message doesn't fail
+    the whole batch.
     ---------------------------
     """
     try:
@@ -97,44 +175,34 @@ def validate_event(event):
 
         records = event.get("Records")
 
-        if records[0]["eventSource"] != "aws:s3":
-            service = records[0]["eventSource"]
-            msg = f"lambda_index() is intended to be called from aws:s3, but was invoked by {service}"
-            raise RekognitionIlligalInvocationError(msg)
-
-        if "bucket" not in records[0]["s3"]:
-            raise TypeError("bucket not found in event object")
-
-        if records[0]["eventName"] != "ObjectCreated:Put":
-            event = records[0]["eventName"]
-            msg = f"lambda_index() is intended to be called for ObjectCreated:Put event, but was invoked by {event}"
-            raise RekognitionIlligalInvocationError(msg)
+        if records[0]["eventSource"] == "aws:sqs":
+            for message in records:
+                if "messageId" not in message or "body" not in message:
+                    raise TypeError("messageId and body not found in SQS message")
+        else:
+            validate_s3_record(records[0])
 
     except (KeyError, TypeError, RekognitionIlligalInvocationError) as e:
         return http_response_factory(status_code=500, body=exception_response_factory(e))
     return True
 
 
-def unpack_s3_object(event, record):
-    """extracts the s3 object key, object, and object metadata from the event record"""
-    s3_bucket_name = get_bucket_name(event)
-    s3_object_key = unquote_plus(record["s3"]["object"]["key"], encoding="utf-8")
-    s3_object = settings.aws_s3_client.Object(s3_bucket_name, s3_object_key)
-    s3_object_metadata = {key.replace("x-amz-meta-", ""): s3_object.metadata[key] for key in s3_object.metadata.keys()}
-    return s3_object_key, s3_object_metadata
-
-
-def get_faces(event, record):
-    """returns a list of faces found in the image"""
-    s3_bucket_name = get_bucket_name(event)
-    s3_object_key, _ = unpack_s3_object(event, record)
+def get_faces(s3_object: S3ObjectDescriptor, collection_id: str = None):
+    """
+    returns a list of faces found in the image
 
+    collection_id: the collection to index into. defaults to settings.aws_rekognition_collection_id
+    """
     faces = {"FaceRecords": []}
     try:
-        faces = settings.aws_rekognition_client.index_faces(
-            CollectionId=settings.aws_rekognition_collection_id,
-            Image={"S3Object": {"Bucket": s3_bucket_name, "Name": s3_object_key}},
-            ExternalImageId=s3_object_key,
+        # reject images that Rekognition can't index, after a ranged GET of their first few KB,
+        # and optionally downscale the ones that are too large for it.
+        image = prepare_s3_image(s3_object)
+
+        faces = get_rekognition_client().index_faces(
+            CollectionId=collection_id or settings.aws_rekognition_collection_id,
+            Image=image,
+            ExternalImageId=s3_object.key,
             DetectionAttributes=[settings.aws_rekognition_face_detect_attributes],
             MaxFaces=settings.aws_rekognition_face_detect_max_faces_count,
             QualityFilter=settings.aws_rekognition_face_detect_quality_filter,
@@ -154,21 +222,29 @@ def get_faces(event, record):
     return faces
 
 
-def persist_faceprints(event, record, faces):
+def persist_faceprints(s3_object: S3ObjectDescriptor, faces, writer: BatchWriter = None):
     """
     Iterate the FaceRecords list, adding each face to DynamoDB table.
     Note: see the return JSON structure in doc/rekognition_index_faces.json
-    """
-    s3_bucket_name = get_bucket_name(event)
-    s3_object_key, s3_object_metadata = unpack_s3_object(event, record)
 
+    Each faceprint also gets the DisplayName that lambda_search returns for
+    it, so that a search reads only FaceId and DisplayName.
+
+    writer: a shared BatchWriter, so that the writes of many records coalesce.
+            if omitted then the faces of this record are written immediately.
+    """
+    batch_writer = writer or BatchWriter()
     for face in faces["FaceRecords"]:
         face = face["Face"]
-        face["bucket"] = s3_bucket_name
-        face["key"] = s3_object_key
-        face["metadata"] = s3_object_metadata
-        face = json.loads(json.dumps(face), parse_float=Decimal)
-        settings.dynamodb_table.put_item(Item=face)
+        if "ExternalImageId" in face:
+            face["DisplayName"] = get_display_name(face["ExternalImageId"])
+        face["bucket"] = s3_object.bucket
+        face["key"] = s3_object.key
+        face["metadata"] = s3_object.metadata
+        batch_writer.put_item(face_record_to_dynamodb_item(face))
+
+    if writer is None:
+        batch_writer.flush()
 
 
 def log_event_record(record):
@@ -177,15 +253,256 @@ def log_event_record(record):
         print(json.dumps({"event_record": record}))
 
 
+def complete_indexing(s3_object: S3ObjectDescriptor, face_ids: list, claimed: bool, content_hash: str, writer):
+    """record an indexed S3 object in the idempotency ledger and in the content table"""
+    if claimed:
+        writer.put_item(
+            completed_ledger_entry(s3_object, face_ids),
+            table_name=settings.aws_dynamodb_ledger_table_id,
+            key_names=("LedgerId",),
+        )
+    if content_hash:
+        writer.put_item(
+            content_entry(content_hash, s3_object, face_ids),
+            table_name=settings.aws_dynamodb_content_table_id,
+            key_names=("ContentHash",),
+        )
+
+
+def get_skipped_result(entry: dict) -> dict:
+    """return the statusCode and body of an S3 object that the idempotency ledger has as indexed, or None"""
+    if not is_indexed(entry):
+        return None
+    return {"statusCode": 200, "body": {"skipped": "already indexed", "FaceIds": entry.get("FaceIds", [])}}
+
+
+def claim_indexing(s3_object: S3ObjectDescriptor) -> tuple:
+    """
+    claim an S3 object in the idempotency ledger. returns (claimed, result),
+    where result is the statusCode and body if this invocation must not
+    index the object.
+    """
+    if not settings.aws_lambda_index_idempotency:
+        return False, None
+    if claim_ledger_entry(s3_object):
+        return True, None
+    entry = get_ledger_entry(s3_object.bucket, s3_object.key, s3_object.etag)
+    # another invocation holds the claim. if it dies then only a retry will index the object.
+    return False, get_skipped_result(entry) or {"statusCode": 409, "body": {"error": "indexing in progress"}}
+
+
+def link_duplicate_content(s3_object: S3ObjectDescriptor, claimed: bool, completion_writer) -> tuple:
+    """
+    link an S3 object to the existing faceprints of the same image, uploaded
+    under a different key. returns (content_hash, result), where result is
+    the statusCode and body if the object was linked.
+    """
+    if not settings.aws_lambda_index_content_dedup:
+        return None, None
+    content_hash = hash_s3_object(s3_object)
+    content = get_content_entry(content_hash)
+    if content is None:
+        return content_hash, None
+    link_content_entry(content_hash, s3_object)
+    face_ids = content.get("FaceIds", [])
+    complete_indexing(s3_object, face_ids, claimed, None, completion_writer)
+    body = {"skipped": "duplicate content", "ContentHash": content_hash, "FaceIds": face_ids}
+    return content_hash, {"statusCode": 200, "body": body}
+
+
+def index_record(record, writer: BatchWriter = None, completion_writer: BatchWriter = None):
+    """
+    index a single event record and return its per-record result.
+
+    writer: a shared BatchWriter for faceprints.
+    completion_writer: a shared BatchWriter for the idempotency ledger and the
+                       content table, flushed only after the faceprints have been written.
+    """
+    log_event_record(record)
+    s3_object_key = get_object_key_from_record(record)
+    s3_object = None
+    claimed = False
+    owns_completion_writer = completion_writer is None and writer is None
+    completion_writer = completion_writer or writer or BatchWriter()
+    try:
+        # re-deliveries and re-uploads of identical content cost one DynamoDB read.
+        etag = get_object_etag_from_record(record)
+        if settings.aws_lambda_index_idempotency and etag:
+            result = get_skipped_result(get_ledger_entry(get_bucket_name_from_record(record), s3_object_key, etag))
+            if result is not None:
+                return {"key": s3_object_key, **result}
+
+        s3_object = S3ObjectDescriptor.from_record(record)
+        claimed, result = claim_indexing(s3_object)
+        if result is not None:
+            return {"key": s3_object_key, **result}
+
+        # the same image uploaded under a different key is linked to the existing faceprints.
+        content_hash, result = link_duplicate_content(s3_object, claimed, completion_writer)
+        if result is None:
+            faces = get_faces(s3_object)
+            if "FaceRecords" not in faces:
+                # get_faces() returns an http response object if anything went wrong
+                if claimed:
+                    release_ledger_entry(s3_object)
+                return {"key": s3_object_key, "statusCode": faces["statusCode"], "body": json.loads(faces["body"])}
+            persist_faceprints(s3_object, faces, writer=writer)
+
+            face_ids = [face_record["Face"]["FaceId"] for face_record in faces["FaceRecords"]]
+            complete_indexing(s3_object, face_ids, claimed, content_hash, completion_writer)
+            result = {"statusCode": 200, "body": faces}
+        if owns_completion_writer:
+            completion_writer.flush()
+
+    except Exception as e:
+        if claimed:
+            release_ledger_entry(s3_object)
+        status_code, _message = EXCEPTION_MAP.get(type(e), (500, "Internal server error"))
+        return {"key": s3_object_key, "statusCode": status_code, "body": exception_response_factory(e)}
+
+    return {"key": s3_object_key, **result}
+
+
+def flush_writer(writer: BatchWriter) -> set:
+    """flush a shared BatchWriter, and return the owners of every item that could not be written"""
+    try:
+        writer.flush()
+    except Exception as e:
+        print(json.dumps({"error": exception_response_factory(e)}))
+    return set(writer.failed_owners)
+
+
+def fail_indexed_record(record, result: dict) -> dict:
+    """
+    fail a record whose buffered writes were lost, releasing its ledger
+    claim so that a retry can index it. returns its per-record result.
+    """
+    if result["statusCode"] != 200:
+        return result
+    s3_object_key = get_object_key_from_record(record)
+    etag = get_object_etag_from_record(record)
+    if settings.aws_lambda_index_idempotency and etag:
+        # otherwise the claim is only released when its lease expires
+        release_ledger_entry(
+            S3ObjectDescriptor(bucket=get_bucket_name_from_record(record), key=s3_object_key, etag=etag)
+        )
+    return {"key": s3_object_key, "statusCode": 500, "body": {"error": "faceprints could not be written"}}
+
+
+def index_records(records, max_workers: int = None) -> tuple:
+    """
+    index a list of S3 event records on a bounded thread pool, coalescing
+    their DynamoDB writes. returns the per-record results and the write stats.
+
+    max_workers: size of the thread pool. defaults to settings.aws_lambda_index_max_workers
+    """
+    # initialize the shared AWS clients before fanning out, so that the
+    # worker threads don't race each other to lazily create them.
+    _ = get_rekognition_client(), settings.aws_s3_client.meta.client, settings.aws_dynamodb_resource
+
+    max_workers = max(1, min(len(records), max_workers or settings.aws_lambda_index_max_workers))
+    writer = BatchWriter()
+    completion_writer = BatchWriter(auto_flush=False)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(
+            executor.map(
+                lambda i: index_record(records[i], writer.for_owner(i), completion_writer.for_owner(i)),
+                range(len(records)),
+            )
+        )
+
+    # an object only counts as indexed once its faceprints are safely written
+    failed_owners = flush_writer(writer)
+    completion_writer.discard(failed_owners)
+    failed_owners = failed_owners | flush_writer(completion_writer)
+    for i in sorted(failed_owners):
+        results[i] = fail_indexed_record(records[i], results[i])
+
+    # cached search results could be missing the new faces
+    if settings.aws_lambda_search_result_cache and any(
+        result["statusCode"] == 200 and result["body"].get("FaceRecords") for result in results
+    ):
+        bump_collection_version()
+    return results, writer.stats
+
+
+def is_retryable(result: dict) -> bool:
+    """
+    could a retry index this record? throttling, server errors and objects
+    that another invocation is still indexing (409) are retried. other 4xx,
+    such as an invalid or missing image, would fail the same way every time.
+    """
+    status_code = result["statusCode"]
+    return status_code in (409, 429) or status_code >= 500
+
+
+def index_sqs_messages(event) -> dict:
+    """
+    index a batch of SQS-wrapped S3 notifications.
+
+    returns a partial batch response so that SQS only redelivers the messages
+    of images that failed with a retryable error. the messages of images that
+    can never be indexed are logged and consumed. requires ReportBatchItemFailures
+    on the event source mapping.
+    see https://docs.aws.amazon.com/lambda/latest/dg/services-sqs-errorhandling.html
+    """
+    messages = get_records(event)
+    failed_message_ids = set()
+    message_records = []  # (messageId, S3 event record)
+    for message in messages:
+        try:
+            message_records += [(message["messageId"], record) for record in get_sqs_s3_records(message)]
+        except (KeyError, TypeError, ValueError, RekognitionIlligalInvocationError) as e:
+            print(json.dumps({"messageId": message["messageId"], "error": exception_response_factory(e)}))
+            failed_message_ids.add(message["messageId"])
+
+    results = []
+    try:
+        if message_records:
+            results, _stats = index_records([record for _, record in message_records])
+    except Exception as e:
+        # buffered faceprints might not have been written, so every message has to be retried.
+        print(json.dumps({"error": exception_response_factory(e)}))
+        failed_message_ids = {message["messageId"] for message in messages}
+
+    for (message_id, _), result in zip(message_records, results):
+        if result["statusCode"] == 200:
+            continue
+        if is_retryable(result):
+            failed_message_ids.add(message_id)
+        else:
+            print(json.dumps({"messageId": message_id, "consumed": result}))
+
+    return {
+        "batchItemFailures": [
+            {"itemIdentifier": message["messageId"]}
+            for message in messages
+            if message["messageId"] in failed_message_ids
+        ]
+    }
+
+
 # pylint: disable=unused-argument
 def lambda_handler(event, context):  # noqa: C901
     """Lambda entry point"""
+    if is_warmup_event(event):
+        body = warm_up({"dynamodb": prime_dynamodb, "rekognition": prime_rekognition, "s3": prime_s3})
+        return http_response_factory(status_code=200, body=body)
 
     cloudwatch_handler(event, settings.dump, debug_mode=settings.debug_mode)
-    validate_event(event)
-    records = get_records(event)
-    for record in records:
-        log_event_record(record)
-        faces = get_faces(event, record)
-        persist_faceprints(event, record, faces)
-        return http_response_factory(status_code=200, body=faces)
+    invalid_event_response = validate_event(event)
+    if invalid_event_response is not True:
+        return invalid_event_response
+
+    if is_sqs_event(event):
+        return index_sqs_messages(event)
+
+    try:
+        results, stats = index_records(get_records(event))
+
+    except Exception as e:
+        status_code, _message = EXCEPTION_MAP.get(type(e), (500, "Internal server error"))
+        return http_response_factory(status_code=status_code, body=exception_response_factory(e))
+
+    status_code = 200 if all(result["statusCode"] == 200 for result in results) else 207
+    return http_response_factory(status_code=status_code, body={"records": results, "dynamodb": stats})
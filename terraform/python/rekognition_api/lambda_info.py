@@ -7,11 +7,15 @@ import json
 from rekognition_api.aws import aws_infrastructure_config as aws_config
 from rekognition_api.conf import settings
 from rekognition_api.utils import http_response_factory
+from rekognition_api.warmup import is_warmup_event, prime_apigateway, warm_up
 
 
 # pylint: disable=unused-argument
 def lambda_handler(event, context):  # noqa: C901
     """Lambda entry point"""
+    if is_warmup_event(event):
+        return http_response_factory(status_code=200, body=warm_up({"apigateway": prime_apigateway}))
+
     info = {
         "aws": aws_config.dump,
         "settings": settings.dump,
@@ -20,8 +20,51 @@
 # bounding box (and a confidence level that the bounding box contains a face)
 # of the face that Amazon Rekognition used for the input image.
 #
+# Multi-face search (?mode=multi):
+# search_faces_by_image() only searches the largest face in the image. In
+# multi-face mode, detect_faces() is called once, each detected face is
+# cropped out of the image locally, and the crops are searched concurrently
+# on a bounded thread pool. Matches are grouped per detected face.
+#
+# Batch search (Content-Type: application/json or multipart/form-data):
+# the body holds several images, see uploads.py. The images are searched
+# concurrently on a bounded thread pool, the faceprints of every match are
+# read with one BatchGetItem, and each image gets its own result, or its own
+# error, so that one bad image doesn't fail the whole batch.
+#
+# Search jobs (POST /search/jobs, GET /search/jobs/{job_id}):
+# batches that wouldn't finish within API Gateway's integration timeout are
+# stored in S3 and searched asynchronously, in chunks that are delivered to
+# this Lambda by an SQS queue. see jobs.py
+#
+# Search by reference (Content-Type: application/json, {"bucket", "key"}):
+# the image is uploaded to the S3 bucket beforehand, with a presigned URL
+# from POST /search/uploads, and Rekognition reads it from S3. Large images
+# then bypass both the API Gateway payload limit and the Lambda's memory.
+# see uploads.py
+#
+# Search by FaceId (?faceId=...):
+# faces that are already indexed, for instance the FaceId of an earlier index
+# result, are searched with search_faces(), so no image is uploaded at all.
+#
+# Search parameters: ?maxFaces=1&threshold=95&qualityFilter=HIGH, or the same
+# keys in the body of a search by reference, narrow a single request. The
+# deployment's settings are the limits: a request can ask for fewer matches,
+# a higher threshold or a stricter quality filter, but not the reverse. see
+# get_search_overrides()
+#
+# Warm-up ({"warmup": true}, from a schedule): the clients, caches and
+# connections of the next request are set up, and nothing is searched. see
+# warmup.py
+#
+# Responses: ?compact=true drops the raw Rekognition data and ?fields=...
+# selects fields, see responses.py. Responses are gzip or br compressed
+# when the request's Accept-Encoding allows it, see utils.py
+#
 # Notes:
-# - incoming image file is base64 encoded.
+# - incoming image file is base64 encoded by API Gateway, whose binary media
+#   types are */*. The request body itself can be the raw image, with an
+#   image/* content type, or a base64 encoded image. see uploads.py
 #   see https://code.tutsplus.com/base64-encoding-and-decoding-using-python--cms-25588t
 #
 # - The image must be either a PNG or JPEG formatted file.
@@ -34,27 +77,99 @@
 # - https://gist.github.com/alexcasalboni/0f21a1889f09760f8981b643326730ff
 """
 
-import base64  # library with base63 encoding/decoding functions
 import json  # library for interacting with JSON data https://www.json.org/json-en.html
+import re
+from concurrent.futures import ThreadPoolExecutor
 
+from rekognition_api.cache import MISSING, NOT_FOUND, get_face_cache
 from rekognition_api.conf import settings
-from rekognition_api.exceptions import EXCEPTION_MAP
+from rekognition_api.dynamodb import batch_get_items
+from rekognition_api.exceptions import EXCEPTION_MAP, RekognitionValueError
+from rekognition_api.images import (
+    crop_faces,
+    is_face_cropping_available,
+    prepare_image_bytes,
+    prepare_s3_image,
+)
+from rekognition_api.jobs import (
+    create_job,
+    fail_job,
+    finish_job_chunk,
+    get_job,
+    get_job_search_overrides,
+    get_job_status,
+    get_queue_client,
+    load_job_images,
+    send_job_callback,
+    start_job_chunk,
+)
+from rekognition_api.responses import get_response_options, shape_search_response
+from rekognition_api.s3 import S3ObjectDescriptor, get_object_bytes, get_s3_client
+from rekognition_api.search_cache import get_search_cache, get_search_cache_key
+from rekognition_api.throttle import get_rekognition_client
+from rekognition_api.uploads import (
+    create_presigned_upload,
+    get_batch_images,
+    get_header,
+    get_s3_reference,
+    get_single_image,
+    is_batch_request,
+)
 from rekognition_api.utils import (
     cloudwatch_handler,
     exception_response_factory,
+    get_display_name,
     http_response_factory,
 )
+from rekognition_api.warmup import (
+    is_warmup_event,
+    prime_dynamodb,
+    prime_rekognition,
+    prime_s3,
+    warm_up,
+)
+
+
+# the only faceprint attributes that a search response needs. DisplayName is
+# precomputed by lambda_index.persist_faceprints()
+MATCHED_FACE_ATTRIBUTES = ("FaceId", "DisplayName")
+# faceprints that were indexed before DisplayName was, see get_faceprint_items()
+LEGACY_MATCHED_FACE_ATTRIBUTES = ("FaceId", "ExternalImageId")
+MULTI_FACE_MODE = "multi"
+# see https://docs.aws.amazon.com/rekognition/latest/APIReference/API_SearchFaces.html
+# the search parameters that a request can override, keyed on their query string parameter
+SEARCH_PARAMETER_OVERRIDES = {
+    "maxFaces": "MaxFaces",
+    "threshold": "FaceMatchThreshold",
+    "qualityFilter": "QualityFilter",
+}
+# see https://docs.aws.amazon.com/rekognition/latest/APIReference/API_SearchFacesByImage.html
+QUALITY_FILTERS = ("NONE", "AUTO", "LOW", "MEDIUM", "HIGH")
+# the strictness of each QualityFilter. AUTO lets Rekognition choose, which is at least LOW.
+QUALITY_FILTER_RANKS = {"NONE": 0, "AUTO": 1, "LOW": 1, "MEDIUM": 2, "HIGH": 3}
+FACE_ID_PATTERN = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+SEARCH_JOBS_RESOURCE = "/search/jobs"
+SEARCH_JOB_RESOURCE = "/search/jobs/{job_id}"
+SEARCH_UPLOADS_RESOURCE = "/search/uploads"
+
+
+def get_query_parameter(event, name: str, default=None):
+    """return a query string parameter of the API Gateway event"""
+    return (event.get("queryStringParameters") or {}).get(name, default)
+
+
+def get_image_bytes_from_event(event) -> bytes:
+    """
+    extract and decode the raw image data from the event. the body is either
+    the raw image or a base64 encoded image, and is itself base64 encoded
+    when API Gateway sets isBase64Encoded. see uploads.get_single_image()
+    """
+    return get_single_image(event)
 
 
 def get_image_from_event(event):
-    """extract and decode the raw image data from the event"""
-    # see
-    #  - https://stackoverflow.com/questions/9942594/unicodeencodeerror-ascii-codec-cant-encode-character-u-xa0-in-position-20
-    #  - line 39, in _bytes_from_decode_data ValueError: string argument should contain only ASCII characters
-    #  - https://stackoverflow.com/questions/53340627/typeerror-expected-bytes-like-object-not-str
-    #  - alternate syntax: image_raw = ''.join(image_raw).encode('ascii').strip()
-    image_raw = str(event["body"]).encode("ascii")
-    image_decoded = base64.b64decode(image_raw)
+    """extract, decode and prepare the image of the event for Rekognition"""
+    image_decoded = get_image_bytes_from_event(event)
 
     # https://stackoverflow.com/questions/6269765/what-does-the-b-character-do-in-front-of-a-string-literal
     # Image: base64-encoded bytes or an S3 object.
@@ -66,40 +181,463 @@ def get_image_from_event(event):
     #         'Version': 'string'
     #     }
     # },
-    return {"Bytes": image_decoded}
+    #
+    # images that Rekognition can't search are rejected without a round trip,
+    # and oversized images are optionally downscaled. see images.py
+    return prepare_image_bytes(image_decoded)
+
+
+def get_search_params(overrides: dict = None) -> dict:
+    """
+    return the search_faces_by_image() parameters, other than the image.
+
+    overrides: validated per-request parameters, see get_search_overrides()
+    """
+    params = {
+        "CollectionId": settings.aws_rekognition_collection_id,
+        "MaxFaces": settings.aws_rekognition_face_detect_max_faces_count,
+        "FaceMatchThreshold": settings.aws_rekognition_face_detect_threshold,
+        "QualityFilter": settings.aws_rekognition_face_detect_quality_filter,
+    }
+    params.update(overrides or {})
+    return params
+
+
+def validate_search_override(name: str, value):
+    """
+    return a per-request search parameter, converted to its Rekognition type.
+    a request can only narrow the search that the deployment's settings allow.
+    """
+    try:
+        if name == "MaxFaces":
+            value = int(value)
+            limit = settings.aws_rekognition_face_detect_max_faces_count
+            if not 1 <= value <= limit:
+                raise RekognitionValueError(f"maxFaces must be between 1 and {limit}, not {value}")
+        elif name == "FaceMatchThreshold":
+            value = float(value)
+            limit = settings.aws_rekognition_face_detect_threshold
+            if not limit <= value <= 100:
+                raise RekognitionValueError(f"threshold must be between {limit} and 100, not {value}")
+        else:
+            value = str(value).upper()
+            if value not in QUALITY_FILTERS:
+                raise RekognitionValueError(f"qualityFilter must be one of {', '.join(QUALITY_FILTERS)}, not {value}")
+            limit = str(settings.aws_rekognition_face_detect_quality_filter).upper()
+            if QUALITY_FILTER_RANKS[value] < QUALITY_FILTER_RANKS.get(limit, 0):
+                raise RekognitionValueError(f"qualityFilter can't be less strict than {limit}, not {value}")
+    except (TypeError, ValueError) as e:
+        raise RekognitionValueError(f"invalid search parameter {name}: {e}") from e
+    return value
 
 
-def get_faces(image):
+def get_search_overrides(event, body: dict = None) -> dict:
+    """
+    return the validated per-request search parameters of the query string
+    and of a JSON request body, keyed on their Rekognition name. body values
+    take precedence.
+    """
+    query = event.get("queryStringParameters") or {}
+    overrides = {}
+    for source in (query, body or {}):
+        for key, name in SEARCH_PARAMETER_OVERRIDES.items():
+            if source.get(key) not in (None, ""):
+                overrides[name] = validate_search_override(name, source[key])
+    return overrides
+
+
+def get_faces(image, search_params: dict = None):
     """return a list of faces found in the image"""
-    return settings.aws_rekognition_client.search_faces_by_image(
-        Image=image,
-        CollectionId=settings.aws_rekognition_collection_id,
-        MaxFaces=settings.aws_rekognition_face_detect_max_faces_count,
-        FaceMatchThreshold=settings.aws_rekognition_face_detect_threshold,
-        QualityFilter=settings.aws_rekognition_face_detect_quality_filter,
-    )
+    return get_rekognition_client().search_faces_by_image(Image=image, **(search_params or get_search_params()))
+
+
+def get_faces_by_face_id(face_id: str, search_params: dict = None):
+    """
+    return a list of faces that match an indexed face. search_faces() has no
+    QualityFilter, the face was quality filtered when it was indexed.
+    """
+    params = dict(search_params or get_search_params())
+    del params["QualityFilter"]
+    return get_rekognition_client().search_faces(FaceId=face_id, **params)
+
+
+def get_faceprint_items(face_ids: list) -> dict:
+    """
+    return the faceprint items of a list of FaceIds, keyed on FaceId. FaceIds
+    that are in the warm-container face cache are not read from DynamoDB, and
+    the rest are read with one BatchGetItem. see cache.py
+
+    only FaceId and DisplayName are read. faceprints that were indexed before
+    DisplayName was get it from their ExternalImageId, with a second
+    BatchGetItem, until a rebuild rewrites them. see rebuild.py
+    """
+    cache = get_face_cache()
+    items = {}
+    misses = []
+    for face_id in face_ids:
+        item = cache.get(face_id)
+        if item is MISSING:
+            misses.append(face_id)
+        elif item is not NOT_FOUND:
+            items[face_id] = item
+
+    if misses:
+        found = batch_get_items(misses, key_name="FaceId", projection=MATCHED_FACE_ATTRIBUTES)
+        legacy = [face_id for face_id, item in found.items() if "DisplayName" not in item]
+        if legacy:
+            legacy_items = batch_get_items(legacy, key_name="FaceId", projection=LEGACY_MATCHED_FACE_ATTRIBUTES)
+            for face_id in legacy:
+                item = legacy_items.get(face_id)
+                if item is None:
+                    # deleted in between
+                    del found[face_id]
+                else:
+                    found[face_id] = {"FaceId": face_id, "DisplayName": get_display_name(item["ExternalImageId"])}
+        for face_id in misses:
+            if face_id in found:
+                cache.put(face_id, found[face_id])
+                items[face_id] = found[face_id]
+            else:
+                cache.put_not_found(face_id)
+    return items
 
 
-def get_matched_faces(faces):
-    """return a list of matched faces"""
-    matched_faces = []  # any indexed faces found in the Rekognition return value
+def get_matched_faces(faces, items: dict = None):
+    """
+    return a list of matched faces
+
+    items: faceprint items that were already read, keyed on FaceId.
+    """
     # ----------------------------------------------------------------------
     # return structure: doc/rekogition_search_faces_by_image.json
     # ----------------------------------------------------------------------
-    for face in faces["FaceMatches"]:
-        item = settings.dynamodb_table.get_item(Key={"FaceId": face["Face"]["FaceId"]})
-        if "Item" in item:
-            matched = (
-                str(item["Item"]["ExternalImageId"])
-                .replace("-", " ")
-                .replace("_", " ")
-                .replace(".jpg", "")
-                .replace(".png", "")
-                .capitalize()
+    # FaceMatches are ordered by similarity, highest first. Faceprint items
+    # come back in no particular order, so the matched faces are re-ordered
+    # by FaceMatches.
+    face_ids = [face["Face"]["FaceId"] for face in faces["FaceMatches"]]
+    if items is None:
+        items = get_faceprint_items(face_ids) if face_ids else {}
+
+    # any indexed faces found in the Rekognition return value
+    return [items[face_id]["DisplayName"] for face_id in face_ids if face_id in items]
+
+
+def detect_faces(image) -> list:
+    """return the FaceDetails of every face in the image, largest first"""
+    face_details = get_rekognition_client().detect_faces(Image=image, Attributes=["DEFAULT"])["FaceDetails"]
+    return sorted(
+        face_details, key=lambda detail: detail["BoundingBox"]["Width"] * detail["BoundingBox"]["Height"], reverse=True
+    )
+
+
+def search_face(crop: bytes, search_params: dict = None) -> dict:
+    """search the collection for the face of a crop. errors are returned rather than raised."""
+    try:
+        return get_faces({"Bytes": crop}, search_params=search_params)
+    except settings.aws_rekognition_client.exceptions.InvalidParameterException:
+        # Rekognition didn't find the face again within the crop
+        return {"FaceMatches": []}
+    except Exception as e:
+        status_code, _message = EXCEPTION_MAP.get(type(e), (500, "Internal server error"))
+        return {"FaceMatches": [], "statusCode": status_code, "error": str(e)}
+
+
+def search_faces_in_image(image, search_params: dict = None) -> dict:
+    """
+    search the collection for every face in an image, not just the largest
+    one. returns the matches grouped per detected face, largest face first.
+    """
+    face_details = detect_faces(image)
+    searched = face_details[: settings.aws_lambda_search_multi_face_max_faces]
+    crops = crop_faces(image["Bytes"], [detail["BoundingBox"] for detail in searched])
+    max_workers = max(1, min(len(crops), settings.aws_lambda_search_multi_face_max_workers))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(lambda crop: search_face(crop, search_params=search_params), crops))
+
+    # one faceprint lookup for the matches of every face
+    face_ids = [match["Face"]["FaceId"] for result in results for match in result["FaceMatches"]]
+    items = get_faceprint_items(face_ids) if face_ids else {}
+
+    faces = []
+    for detail, result in zip(searched, results):
+        face = {
+            "BoundingBox": detail["BoundingBox"],
+            "Confidence": detail["Confidence"],
+            "FaceMatches": result["FaceMatches"],
+            "matchedFaces": get_matched_faces(result, items=items),
+        }
+        if "error" in result:
+            face.update(statusCode=result["statusCode"], error=result["error"])
+        faces.append(face)
+
+    return {
+        "detectedFaces": len(face_details),
+        "faces": faces,  # the matches of each detected face, largest face first
+        "matchedFaces": list(dict.fromkeys(name for face in faces for name in face["matchedFaces"])),
+    }
+
+
+def get_cached_search(image_bytes: bytes, multi_face: bool = False, search_params: dict = None) -> tuple:
+    """
+    return (cache_key, version, result) of an image. result is None if the
+    search result cache has no result for the current version of the
+    collection, in which case the result has to be put with
+    put_cached_search(). see search_cache.py
+
+    search_params: the search parameters, which are part of the cache key
+    """
+    if not settings.aws_lambda_search_result_cache:
+        return None, None, None
+    params = dict(search_params or get_search_params())
+    if multi_face:
+        params.update(Mode=MULTI_FACE_MODE, MultiFaceMaxFaces=settings.aws_lambda_search_multi_face_max_faces)
+    cache_key = get_search_cache_key(image_bytes, params)
+    retval, version = get_search_cache().get(cache_key, params["CollectionId"])
+    return cache_key, version, retval
+
+
+def put_cached_search(cache_key: str, version: int, retval: dict):
+    """cache the result of a search that get_cached_search() missed"""
+    if cache_key is not None:
+        get_search_cache().put(cache_key, version, retval)
+
+
+def search_image(image_bytes: bytes, multi_face: bool = False, search_params: dict = None) -> dict:
+    """
+    return the faces found in an image and the indexed faces that they match.
+    resubmissions of the same image are served by the search result cache,
+    until lambda_index adds faces to the collection. see search_cache.py
+
+    multi_face: search every face in the image rather than just the largest one.
+    search_params: per-request search parameters, see get_search_params()
+    """
+    cache_key, version, retval = get_cached_search(image_bytes, multi_face=multi_face, search_params=search_params)
+    if retval is not None:
+        return retval
+
+    # images that Rekognition can't search are rejected without a round trip,
+    # and oversized images are optionally downscaled. see images.py
+    image = prepare_image_bytes(image_bytes)
+    if multi_face:
+        retval = search_faces_in_image(image, search_params=search_params)
+    else:
+        faces = get_faces(image, search_params=search_params)
+        matched_faces = get_matched_faces(faces)
+        retval = {
+            "faces": faces,  # all of the faces that Rekognition found in the image
+            "matchedFaces": matched_faces,  # any indexed faces found in DynamoDB
+        }
+    put_cached_search(cache_key, version, retval)
+    return retval
+
+
+def search_s3_image(bucket: str, key: str, multi_face: bool = False, search_params: dict = None) -> dict:
+    """
+    return the faces found in an image in S3 and the indexed faces that they
+    match. Rekognition reads the image from S3, so unlike search_image() the
+    image isn't read into the Lambda, unless it has to be normalized, or
+    cropped for a multi-face search. results are cached on the object's ETag.
+    """
+    try:
+        s3_object = S3ObjectDescriptor.head(bucket, key)
+    except get_s3_client().exceptions.ClientError as e:
+        raise RekognitionValueError(f"image s3://{bucket}/{key} can't be read: {e}") from e
+    if multi_face:
+        # each face is cropped out of the image locally
+        return search_image(get_object_bytes(bucket, key), multi_face=True, search_params=search_params)
+
+    cache_key, version, retval = get_cached_search(
+        f"s3://{bucket}/{key}#{s3_object.etag}".encode("utf-8"), search_params=search_params
+    )
+    if retval is not None:
+        return retval
+    faces = get_faces(prepare_s3_image(s3_object), search_params=search_params)
+    retval = {
+        "faces": faces,  # all of the faces that Rekognition found in the image
+        "matchedFaces": get_matched_faces(faces),  # any indexed faces found in DynamoDB
+    }
+    put_cached_search(cache_key, version, retval)
+    return retval
+
+
+def search_face_id(face_id: str, search_params: dict = None) -> dict:
+    """
+    return the indexed faces that match an indexed face. like search_image(),
+    results are served by the search result cache until lambda_index adds
+    faces to the collection.
+    """
+    if not FACE_ID_PATTERN.match(face_id or ""):
+        raise RekognitionValueError(f"{face_id} is not a FaceId")
+    cache_key, version, retval = get_cached_search(f"FaceId:{face_id}".encode("utf-8"), search_params=search_params)
+    if retval is not None:
+        return retval
+    try:
+        faces = get_faces_by_face_id(face_id, search_params=search_params)
+    except settings.aws_rekognition_client.exceptions.InvalidParameterException as e:
+        # the FaceId is not in the collection
+        raise RekognitionValueError(str(e)) from e
+    retval = {
+        "faces": faces,  # all of the indexed faces that match the face, other than the face itself
+        "matchedFaces": get_matched_faces(faces),  # any indexed faces found in DynamoDB
+    }
+    put_cached_search(cache_key, version, retval)
+    return retval
+
+
+def log_cache_stats():
+    """log the hit rates of the faceprint and search result caches"""
+    if settings.debug_mode:
+        print(json.dumps({"faceCache": get_face_cache().stats, "searchCache": get_search_cache().stats}))
+
+
+def get_batch_error(image_id: str, e: Exception) -> dict:
+    """return the result of an image of a batch that couldn't be searched"""
+    if isinstance(e, (RekognitionValueError, settings.aws_rekognition_client.exceptions.InvalidParameterException)):
+        # the image couldn't be decoded, or Rekognition didn't find a face in it
+        status_code = 400
+    else:
+        status_code, _message = EXCEPTION_MAP.get(type(e), (500, "Internal server error"))
+    return {"id": image_id, "statusCode": status_code, "error": str(e)}
+
+
+def search_batch_image(image_id: str, image_bytes, multi_face: bool = False, search_params: dict = None) -> tuple:
+    """
+    search one image of a batch, but leave the faceprint lookup to
+    search_batch(). returns (result, cache_key, version). result has no
+    matchedFaces yet if they still have to be looked up.
+    """
+    if isinstance(image_bytes, Exception):
+        return get_batch_error(image_id, image_bytes), None, None
+    try:
+        if multi_face:
+            # each image needs a detect_faces() and a search per face anyway
+            retval = search_image(image_bytes, multi_face=True, search_params=search_params)
+            return {"id": image_id, "statusCode": 200, **retval}, None, None
+        cache_key, version, retval = get_cached_search(image_bytes, search_params=search_params)
+        if retval is not None:
+            return {"id": image_id, "statusCode": 200, **retval}, None, None
+        faces = get_faces(prepare_image_bytes(image_bytes), search_params=search_params)
+        return {"id": image_id, "statusCode": 200, "faces": faces}, cache_key, version
+    except Exception as e:
+        return get_batch_error(image_id, e), None, None
+
+
+def search_batch(images: list, multi_face: bool = False, search_params: dict = None) -> list:
+    """
+    search every image of a batch. images is a list of (id, image bytes)
+    pairs, where an image that couldn't be decoded is the exception that
+    explains why. returns one result per image, in the same order.
+    """
+    max_workers = max(1, min(len(images), settings.aws_lambda_search_batch_max_workers))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        searched = list(
+            executor.map(
+                lambda image: search_batch_image(*image, multi_face=multi_face, search_params=search_params), images
+            )
+        )
+
+    # one faceprint lookup for the matches of every image
+    pending = [
+        (result, cache_key, version)
+        for result, cache_key, version in searched
+        if "faces" in result and "matchedFaces" not in result
+    ]
+    face_ids = [match["Face"]["FaceId"] for result, _, _ in pending for match in result["faces"]["FaceMatches"]]
+    try:
+        items = get_faceprint_items(face_ids) if face_ids else {}
+    except Exception as e:
+        for result, _, _ in pending:
+            result.update(get_batch_error(result["id"], e))
+            del result["faces"]
+        return [result for result, _, _ in searched]
+
+    for result, cache_key, version in pending:
+        result["matchedFaces"] = get_matched_faces(result["faces"], items=items)
+        put_cached_search(cache_key, version, {"faces": result["faces"], "matchedFaces": result["matchedFaces"]})
+    return [result for result, _, _ in searched]
+
+
+def search_job_chunk(job_id: str, body: dict):
+    """search a chunk of a search job, and finish the job if this was its last chunk"""
+    job = start_job_chunk(job_id)
+    if job is None:
+        # the job has already finished, or has expired
+        return
+    results = search_batch(
+        load_job_images(body["images"]),
+        multi_face=job["multiFace"],
+        search_params=get_search_params(get_job_search_overrides(job)),
+    )
+    finished_job = finish_job_chunk(job, body["chunk"], body["images"], results)
+    if finished_job is not None:
+        send_job_callback(finished_job)
+
+
+def search_job_messages(event) -> dict:
+    """
+    search the chunks of search jobs that SQS delivered.
+
+    returns a partial batch response so that SQS only redelivers the chunks
+    that failed. a chunk that fails on its last delivery fails its job.
+    see https://docs.aws.amazon.com/lambda/latest/dg/services-sqs-errorhandling.html
+    """
+    failed_message_ids = []
+    for message in event["Records"]:
+        job_id = None
+        try:
+            body = json.loads(message["body"])
+            job_id = body["jobId"]
+            search_job_chunk(job_id, body)
+        except Exception as e:
+            print(
+                json.dumps({"messageId": message["messageId"], "jobId": job_id, "error": exception_response_factory(e)})
             )
-            matched_faces.append(matched)
+            failed_message_ids.append(message["messageId"])
+            receive_count = int(message.get("attributes", {}).get("ApproximateReceiveCount", 1))
+            if job_id and receive_count >= settings.aws_lambda_search_jobs_max_receive_count:
+                failed_job = fail_job(job_id, str(e))
+                if failed_job is not None:
+                    send_job_callback(failed_job)
+
+    return {"batchItemFailures": [{"itemIdentifier": message_id} for message_id in failed_message_ids]}
+
 
-    return matched_faces
+def prime_search():
+    """create the warm-container caches and the search job queue client"""
+    get_face_cache()
+    get_search_cache()
+    get_queue_client()
+
+
+def is_sqs_event(event) -> bool:
+    """is this event a batch of search job chunks, delivered by SQS?"""
+    records = event.get("Records") or [{}]
+    return records[0].get("eventSource") == "aws:sqs"
+
+
+def route_search_jobs(event, multi_face: bool, overrides: dict, fields: tuple, compact: bool) -> dict:
+    """
+    route the /search/jobs, /search/jobs/{job_id} and /search/uploads resources.
+    returns the status_code and body of the http response, or None for a search.
+    """
+    resource = event.get("resource")
+    if resource == SEARCH_JOB_RESOURCE:
+        job_id = (event.get("pathParameters") or {}).get("job_id")
+        job = get_job(job_id) if job_id else None
+        if job is None:
+            return {"status_code": 404, "body": {"error": f"search job {job_id} not found"}}
+        return {"status_code": 200, "body": shape_search_response(get_job_status(job, results=True), fields, compact)}
+    if resource == SEARCH_JOBS_RESOURCE:
+        job = create_job(
+            get_batch_images(event, settings.aws_lambda_search_jobs_max_images),
+            multi_face=multi_face,
+            callback_url=get_query_parameter(event, "callbackUrl"),
+            search_overrides=overrides,
+        )
+        return {"status_code": 202, "body": job}
+    if resource == SEARCH_UPLOADS_RESOURCE:
+        return {"status_code": 200, "body": create_presigned_upload(get_query_parameter(event, "method", "POST"))}
+    return None
 
 
 # pylint: disable=unused-argument
@@ -107,16 +645,58 @@ def lambda_handler(event, context):  # noqa: C901
     """
     Facial recognition image analysis and search for indexed faces. invoked by API Gateway.
     """
+    if is_warmup_event(event):
+        return http_response_factory(
+            status_code=200,
+            body=warm_up(
+                {"dynamodb": prime_dynamodb, "rekognition": prime_rekognition, "s3": prime_s3, "search": prime_search}
+            ),
+        )
+
     cloudwatch_handler(event, settings.dump, debug_mode=settings.debug_mode)
-    try:
-        image = get_image_from_event(event)
-        faces = get_faces(image)
-        matched_faces = get_matched_faces(faces)
+    if is_sqs_event(event):
+        return search_job_messages(event)
 
-        retval = {
-            "faces": faces,  # all of the faces that Rekognition found in the image
-            "matchedFaces": matched_faces,  # any indexed faces found in DynamoDB
-        }
+    accept_encoding = get_header(event, "Accept-Encoding")
+    fields, compact = get_response_options(event)
+    try:
+        multi_face = get_query_parameter(event, "mode") == MULTI_FACE_MODE
+        if multi_face and not is_face_cropping_available():
+            raise RekognitionValueError("mode=multi is not available, Pillow is not installed in the Lambda layer")
+        overrides = get_search_overrides(event)
+        response = route_search_jobs(event, multi_face, overrides, fields, compact)
+        if response is not None:
+            return http_response_factory(**response, accept_encoding=accept_encoding)
+        face_id = get_query_parameter(event, "faceId")
+        s3_reference = None if face_id is not None else get_s3_reference(event)
+        if s3_reference is not None:
+            overrides = get_search_overrides(event, body=s3_reference)
+        search_params = get_search_params(overrides)
+        if face_id is None and s3_reference is None and is_batch_request(event):
+            retval = {
+                "results": search_batch(
+                    get_batch_images(event, settings.aws_lambda_search_batch_max_images),
+                    multi_face=multi_face,
+                    search_params=search_params,
+                )
+            }
+            log_cache_stats()
+            # 207: some of the images couldn't be searched, see the statusCode of each result
+            status_code = 200 if all(result["statusCode"] == 200 for result in retval["results"]) else 207
+            return http_response_factory(
+                status_code=status_code,
+                body=shape_search_response(retval, fields, compact),
+                accept_encoding=accept_encoding,
+            )
+        if face_id is not None:
+            retval = search_face_id(face_id, search_params=search_params)
+        elif s3_reference is not None:
+            retval = search_s3_image(
+                s3_reference["bucket"], s3_reference["key"], multi_face=multi_face, search_params=search_params
+            )
+        else:
+            retval = search_image(get_image_bytes_from_event(event), multi_face=multi_face, search_params=search_params)
+        log_cache_stats()
 
     # handle anything that went wrong
     # see https://docs.aws.amazon.com/rekognition/latest/dg/error-handling.html
@@ -125,8 +705,19 @@ def lambda_handler(event, context):  # noqa: C901
         # returns an InvalidParameterException error
         pass
 
+    except RekognitionValueError as e:
+        # the request body or a search parameter is malformed, the callback URL or the S3 image is not allowed,
+        # or the requested mode is not available in this deployment
+        return http_response_factory(
+            status_code=400, body=exception_response_factory(e), accept_encoding=accept_encoding
+        )
+
     except Exception as e:
         status_code, _message = EXCEPTION_MAP.get(type(e), (500, "Internal server error"))
-        return http_response_factory(status_code=status_code, body=exception_response_factory(e))
+        return http_response_factory(
+            status_code=status_code, body=exception_response_factory(e), accept_encoding=accept_encoding
+        )
 
-    return http_response_factory(status_code=200, body=retval)
+    return http_response_factory(
+        status_code=200, body=shape_search_response(retval, fields, compact), accept_encoding=accept_encoding
+    )
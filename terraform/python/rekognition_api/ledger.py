@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+Idempotency ledger for lambda_index.
+
+Every indexed S3 object version is recorded in a DynamoDB table keyed on
+(bucket, key, ETag), so that re-uploads of identical content and duplicate
+event deliveries are skipped with a single DynamoDB read instead of a paid
+Rekognition IndexFaces call plus a DynamoDB write per face.
+
+A ledger entry is first claimed with a conditional put (status IN_PROGRESS),
+which expires after a lease so that a crashed invocation doesn't block the
+object forever. It becomes COMPLETE once the faceprints have been written.
+"""
+
+# python stuff
+import time
+
+# our stuff
+from rekognition_api.conf import settings
+from rekognition_api.s3 import S3ObjectDescriptor
+
+
+LEDGER_STATUS_IN_PROGRESS = "IN_PROGRESS"
+LEDGER_STATUS_COMPLETE = "COMPLETE"
+
+
+def get_ledger_client():
+    """
+    Return the thread-safe client of the DynamoDB resource. It (de)serializes
+    native Python types, just like Table does.
+    """
+    return settings.aws_dynamodb_resource.meta.client
+
+
+def get_ledger_id(bucket: str, key: str, etag: str) -> str:
+    """Return the ledger primary key of an S3 object version."""
+    return f"s3://{bucket}/{key}#{etag}"
+
+
+def get_ledger_entry(bucket: str, key: str, etag: str) -> dict:
+    """Return the ledger entry of an S3 object version, or None."""
+    response = get_ledger_client().get_item(
+        TableName=settings.aws_dynamodb_ledger_table_id,
+        Key={"LedgerId": get_ledger_id(bucket, key, etag)},
+        ConsistentRead=True,
+    )
+    return response.get("Item")
+
+
+def is_indexed(entry: dict) -> bool:
+    """Has the S3 object version of this ledger entry already been indexed?"""
+    return entry is not None and entry.get("status") == LEDGER_STATUS_COMPLETE
+
+
+def claim_ledger_entry(s3_object: S3ObjectDescriptor) -> bool:
+    """
+    Claim an S3 object version for indexing. Returns False if it is already
+    indexed, or if another invocation holds an unexpired claim on it.
+    """
+    now = int(time.time())
+    client = get_ledger_client()
+    try:
+        client.put_item(
+            TableName=settings.aws_dynamodb_ledger_table_id,
+            Item={
+                "LedgerId": get_ledger_id(s3_object.bucket, s3_object.key, s3_object.etag),
+                "bucket": s3_object.bucket,
+                "key": s3_object.key,
+                "etag": s3_object.etag,
+                "status": LEDGER_STATUS_IN_PROGRESS,
+                "leaseExpiresAt": now + settings.aws_lambda_index_ledger_lease_seconds,
+            },
+            ConditionExpression="attribute_not_exists(LedgerId) OR (#status = :in_progress AND leaseExpiresAt < :now)",
+            ExpressionAttributeNames={"#status": "status"},
+            ExpressionAttributeValues={":in_progress": LEDGER_STATUS_IN_PROGRESS, ":now": now},
+        )
+    except client.exceptions.ConditionalCheckFailedException:
+        return False
+    return True
+
+
+def release_ledger_entry(s3_object: S3ObjectDescriptor):
+    """Release a claim, so that a retry can index the S3 object version."""
+    client = get_ledger_client()
+    try:
+        client.delete_item(
+            TableName=settings.aws_dynamodb_ledger_table_id,
+            Key={"LedgerId": get_ledger_id(s3_object.bucket, s3_object.key, s3_object.etag)},
+            ConditionExpression="#status = :in_progress",
+            ExpressionAttributeNames={"#status": "status"},
+            ExpressionAttributeValues={":in_progress": LEDGER_STATUS_IN_PROGRESS},
+        )
+    except client.exceptions.ConditionalCheckFailedException:
+        pass
+
+
+def completed_ledger_entry(s3_object: S3ObjectDescriptor, face_ids: list) -> dict:
+    """Return the COMPLETE ledger entry of an indexed S3 object version."""
+    return {
+        "LedgerId": get_ledger_id(s3_object.bucket, s3_object.key, s3_object.etag),
+        "bucket": s3_object.bucket,
+        "key": s3_object.key,
+        "etag": s3_object.etag,
+        "status": LEDGER_STATUS_COMPLETE,
+        "FaceIds": face_ids,
+        "indexedAt": int(time.time()),
+    }
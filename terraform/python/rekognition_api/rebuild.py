@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+"""
+Rebuild: re-index every image in the faceprint table into a Rekognition
+collection, for instance after changing the collection ID, the detection
+attributes or the quality filter.
+
+    AWS_REKOGNITION_FACE_DETECT_ATTRIBUTES=ALL \\
+    python -m rekognition_api.rebuild --target-collection rekognition-collection-v2 --checkpoint rebuild.jsonl
+
+The faceprint table is read with a parallel, segmented Scan, one thread per
+segment, projecting only the bucket, key and metadata attributes. A face
+table has one row per face, so rows are deduplicated by bucket/key across
+all segments and each image is indexed once, with lambda_index.get_faces(),
+into the target collection. The new FaceIds are written to the target table
+with lambda_index.persist_faceprints() through a shared BatchWriter.
+
+Rekognition calls are paced by the rate limiter, see throttle.py. After each
+Scan page has been indexed and written, the images it covered and the
+LastEvaluatedKey of its segment are appended to a local JSON Lines checkpoint
+file, so that an interrupted rebuild resumes where each segment left off.
+Images that failed are checkpointed with their Scan item, and are indexed
+again when the rebuild resumes.
+
+The faceprints of the source collection are left in place.
+"""
+
+# python stuff
+import argparse
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# our stuff
+from rekognition_api.checkpoint import append_checkpoint, read_checkpoint
+from rekognition_api.conf import settings
+from rekognition_api.dynamodb import BatchWriter
+from rekognition_api.exceptions import RekognitionValueError
+from rekognition_api.lambda_index import get_faces, persist_faceprints
+from rekognition_api.s3 import S3ObjectDescriptor
+from rekognition_api.search_cache import bump_collection_version
+from rekognition_api.throttle import get_rekognition_client
+
+
+REBUILD_PAGE_SIZE = 100
+
+
+def get_scan_client():
+    """Return the thread-safe client of the DynamoDB resource."""
+    return settings.aws_dynamodb_resource.meta.client
+
+
+def get_s3_uri(bucket: str, key: str) -> str:
+    """Return the s3:// uri of an image."""
+    return f"s3://{bucket}/{key}"
+
+
+def ensure_collection(collection_id: str):
+    """Create the target Rekognition collection if it doesn't exist."""
+    client = get_rekognition_client()
+    try:
+        client.describe_collection(CollectionId=collection_id)
+    except client.exceptions.ResourceNotFoundException:
+        client.create_collection(CollectionId=collection_id)
+        print(json.dumps({"rebuild": f"created collection {collection_id}"}))
+
+
+class RebuildCheckpoint:
+    """
+    Thread-safe, append-only JSON Lines checkpoint of a rebuild. Each indexed
+    Scan page appends one {"uri", "statusCode"} line per image, with the Scan
+    "item" if the image failed, followed by a {"segment", "totalSegments",
+    "lastEvaluatedKey", "done"} line.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.statuses = {}
+        self.failed = {}  # uri -> the Scan item of an image that failed, to index again
+        self.segments = {}  # segment -> its most recent {"segment", "totalSegments", "lastEvaluatedKey", "done"}
+        self._lock = threading.Lock()
+        self.load()
+
+        # images that were already indexed, by this run or by a previous one
+        self._claimed = {uri for uri, status_code in self.statuses.items() if status_code == 200}
+
+    def load(self):
+        """Read the state of a previous run of the rebuild."""
+        for entry in read_checkpoint(self.path):
+            if "uri" in entry:
+                self.add_status(entry["uri"], entry["statusCode"], entry.get("item"))
+            else:
+                self.segments[entry["segment"]] = entry
+
+    def add_status(self, uri: str, status_code: int, item: dict = None):
+        """Record the result of an image, and keep the Scan item of a failed image so that it can be retried."""
+        self.statuses[uri] = status_code
+        if status_code == 200 or item is None:
+            self.failed.pop(uri, None)
+        else:
+            self.failed[uri] = item
+
+    def claim(self, uri: str) -> bool:
+        """Claim an image for this thread. False if it was already indexed, or claimed by another row of the image."""
+        with self._lock:
+            if uri in self._claimed:
+                return False
+            self._claimed.add(uri)
+            return True
+
+    def segment(self, segment: int) -> dict:
+        """Return the checkpointed state of a Scan segment."""
+        return self.segments.get(segment, {"lastEvaluatedKey": None, "done": False})
+
+    def save_results(self, results: list, segment_entry: dict = None):
+        """Append the (item, statusCode) results of indexed images, and optionally where a segment continues from."""
+        entries = []
+        for item, status_code in results:
+            entry = {"uri": get_s3_uri(item["bucket"], item["key"]), "statusCode": status_code}
+            if status_code != 200:
+                entry["item"] = item
+            entries.append(entry)
+        if segment_entry:
+            entries.append(segment_entry)
+        with self._lock:
+            for entry in entries:
+                if "uri" in entry:
+                    self.add_status(entry["uri"], entry["statusCode"], entry.get("item"))
+            if segment_entry:
+                self.segments[segment_entry["segment"]] = segment_entry
+            append_checkpoint(self.path, entries)
+
+    def save_page(self, segment: int, total_segments: int, results: list, last_evaluated_key: dict):
+        """Append the per-image results of an indexed Scan page, and where its segment continues from."""
+        entry = {
+            "segment": segment,
+            "totalSegments": total_segments,
+            "lastEvaluatedKey": last_evaluated_key,
+            "done": last_evaluated_key is None,
+        }
+        self.save_results(results, segment_entry=entry)
+
+
+class RebuildStats:
+    """Thread-safe running totals and throughput of a rebuild."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.counts = {"images": 0, "faces": 0, "failed": 0}
+        self._lock = threading.Lock()
+
+    def add(self, **counts):
+        """Add to the totals."""
+        with self._lock:
+            for name, count in counts.items():
+                self.counts[name] += count
+
+    def add_results(self, results: list):
+        """Add the (item, statusCode) results of indexed images."""
+        self.add(images=len(results), failed=sum(1 for _, status_code in results if status_code != 200))
+
+    def to_dict(self, dynamodb_stats: dict) -> dict:
+        """Return the totals and the throughput since the rebuild started."""
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        return {
+            **self.counts,
+            "dynamodb": dynamodb_stats,
+            "elapsedSeconds": round(elapsed, 1),
+            "imagesPerSecond": round(self.counts["images"] / elapsed, 2),
+        }
+
+
+class CollectionRebuild:
+    """Re-index the images of the faceprint table into a target collection."""
+
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    def __init__(
+        self,
+        target_collection_id: str,
+        source_table_name: str = None,
+        target_table_name: str = None,
+        total_segments: int = None,
+        checkpoint_path: str = None,
+        page_size: int = REBUILD_PAGE_SIZE,
+    ):
+        self.target_collection_id = target_collection_id
+        self.source_table_name = source_table_name or settings.aws_dynamodb_table_id
+        self.total_segments = total_segments or settings.aws_lambda_index_max_workers
+        self.page_size = page_size
+        self.checkpoint = RebuildCheckpoint(checkpoint_path)
+        self.writer = BatchWriter(table_name=target_table_name or self.source_table_name)
+        self.totals = RebuildStats()
+
+        # a LastEvaluatedKey is only meaningful for the segmentation that produced it
+        for state in self.checkpoint.segments.values():
+            if state["totalSegments"] != self.total_segments:
+                raise RekognitionValueError(
+                    f"checkpoint was written with {state['totalSegments']} segments, not {self.total_segments}"
+                )
+
+    def scan_pages(self, segment: int):
+        """Yield (items, LastEvaluatedKey) for each page of a Scan segment, from its checkpoint."""
+        state = self.checkpoint.segment(segment)
+        if state["done"]:
+            return
+        exclusive_start_key = state["lastEvaluatedKey"]
+        while True:
+            kwargs = {
+                "TableName": self.source_table_name,
+                "Segment": segment,
+                "TotalSegments": self.total_segments,
+                "Limit": self.page_size,
+                "ProjectionExpression": "#bucket, #key, #metadata",
+                "ExpressionAttributeNames": {"#bucket": "bucket", "#key": "key", "#metadata": "metadata"},
+            }
+            if exclusive_start_key:
+                kwargs["ExclusiveStartKey"] = exclusive_start_key
+            response = get_scan_client().scan(**kwargs)
+            exclusive_start_key = response.get("LastEvaluatedKey")
+            yield response.get("Items", []), exclusive_start_key
+            if not exclusive_start_key:
+                return
+
+    def index_image(self, item: dict) -> int:
+        """Index one image into the target collection. Returns the http status code."""
+        s3_object = S3ObjectDescriptor(bucket=item["bucket"], key=item["key"], metadata=item.get("metadata") or {})
+        faces = get_faces(s3_object, collection_id=self.target_collection_id)
+        if "FaceRecords" not in faces:
+            # get_faces() returns an http response object if anything went wrong
+            print(json.dumps({"uri": get_s3_uri(s3_object.bucket, s3_object.key), "error": faces["body"]}))
+            return faces["statusCode"]
+        persist_faceprints(s3_object, faces, writer=self.writer)
+        self.totals.add(faces=len(faces["FaceRecords"]))
+        return 200
+
+    def retry_failed(self):
+        """Index the images that failed in a previous run again. Their Scan pages are already checkpointed."""
+        items = [item for uri, item in list(self.checkpoint.failed.items()) if self.checkpoint.claim(uri)]
+        if not items:
+            return
+        with ThreadPoolExecutor(max_workers=self.total_segments) as executor:
+            results = list(zip(items, executor.map(self.index_image, items)))
+        self.writer.flush()
+        self.checkpoint.save_results(results)
+        self.totals.add_results(results)
+        print(json.dumps({"rebuild": self.stats}))
+
+    def rebuild_segment(self, segment: int):
+        """Index every image of a Scan segment."""
+        for items, last_evaluated_key in self.scan_pages(segment):
+            results = []
+            for item in items:
+                if "bucket" not in item or "key" not in item:
+                    continue
+                if self.checkpoint.claim(get_s3_uri(item["bucket"], item["key"])):
+                    results.append((item, self.index_image(item)))
+
+            # the faceprints have to be written before the page is checkpointed
+            self.writer.flush()
+            self.checkpoint.save_page(segment, self.total_segments, results, last_evaluated_key)
+            self.totals.add_results(results)
+            print(json.dumps({"rebuild": self.stats}))
+
+    @property
+    def stats(self) -> dict:
+        """Return the totals and the throughput since the rebuild started."""
+        return self.totals.to_dict(self.writer.stats)
+
+    def run(self) -> dict:
+        """Rebuild the target collection from all Scan segments in parallel. Returns the stats."""
+        ensure_collection(self.target_collection_id)
+        _ = get_rekognition_client(), settings.aws_dynamodb_resource
+        self.retry_failed()
+        with ThreadPoolExecutor(max_workers=self.total_segments) as executor:
+            # list() re-raises the first exception of any segment
+            list(executor.map(self.rebuild_segment, range(self.total_segments)))
+        self.writer.flush()
+        if settings.aws_lambda_search_result_cache:
+            bump_collection_version(self.target_collection_id)
+        return self.stats
+
+
+def main(argv=None):
+    """Command-line entry point."""
+    parser = argparse.ArgumentParser(
+        prog="python -m rekognition_api.rebuild",
+        description="Re-index the images of the faceprint table into a Rekognition collection.",
+    )
+    parser.add_argument("--target-collection", required=True, help="the collection to index into")
+    parser.add_argument("--source-table", default=None, help="defaults to the faceprint table of this deployment")
+    parser.add_argument("--target-table", default=None, help="where to write the new faceprints. defaults to source")
+    parser.add_argument("--segments", type=int, default=None, help="number of parallel Scan segments and threads")
+    parser.add_argument("--page-size", type=int, default=REBUILD_PAGE_SIZE, help="Scan Limit")
+    parser.add_argument("--checkpoint", default=None, help="JSON Lines file to checkpoint to and resume from")
+    args = parser.parse_args(argv)
+
+    rebuild = CollectionRebuild(
+        target_collection_id=args.target_collection,
+        source_table_name=args.source_table,
+        target_table_name=args.target_table,
+        total_segments=args.segments,
+        checkpoint_path=args.checkpoint,
+        page_size=args.page_size,
+    )
+    try:
+        stats = rebuild.run()
+    except KeyboardInterrupt:
+        print(json.dumps({"rebuild": "interrupted. re-run with the same --checkpoint and --segments to resume."}))
+        return 130
+
+    print(json.dumps({"rebuild": "complete", "stats": stats}))
+    return 1 if stats["failed"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
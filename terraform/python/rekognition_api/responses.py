@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Response shaping for the search API.
+
+A search result holds the raw search_faces_by_image() response, including
+its ResponseMetadata and the BoundingBox, ImageId and model version of every
+FaceMatch, although most clients only read matchedFaces. Two query string
+parameters shrink the response:
+
+- compact=true keeps only the searched face and, per FaceMatch, its
+  Similarity, FaceId and ExternalImageId.
+- fields=matchedFaces,faces keeps only the listed fields of each result. The
+  id, statusCode and error of a batch result are always kept.
+
+Results are shaped after they are cached, so the search result cache always
+holds full results. Compression is up to http_response_factory(), see utils.py.
+"""
+
+# the fields of a search response that compact=true keeps
+COMPACT_SEARCH_FIELDS = ("SearchedFaceBoundingBox", "SearchedFaceConfidence", "SearchedFaceId", "FaceModelVersion")
+COMPACT_FACE_FIELDS = ("FaceId", "ExternalImageId")
+ALWAYS_INCLUDED_FIELDS = ("id", "statusCode", "error")
+
+
+def get_response_options(event) -> tuple:
+    """return the (fields, compact) response options of the API Gateway event"""
+    query = event.get("queryStringParameters") or {}
+    fields = query.get("fields")
+    fields = tuple(field.strip() for field in fields.split(",") if field.strip()) if fields else None
+    compact = str(query.get("compact", "")).lower() in ["true", "1", "t", "y", "yes"]
+    return fields, compact
+
+
+def compact_face_matches(face_matches: list) -> list:
+    """return the FaceMatches of a search response without the raw Rekognition data"""
+    return [
+        {
+            "Similarity": match["Similarity"],
+            "Face": {key: match["Face"][key] for key in COMPACT_FACE_FIELDS if key in match["Face"]},
+        }
+        for match in face_matches
+    ]
+
+
+def compact_result(result: dict) -> dict:
+    """return a search result without the raw Rekognition data"""
+    faces = result.get("faces")
+    if isinstance(faces, dict):
+        # search_faces_by_image() or search_faces() response
+        compact = {key: faces[key] for key in COMPACT_SEARCH_FIELDS if key in faces}
+        compact["FaceMatches"] = compact_face_matches(faces.get("FaceMatches", []))
+        return dict(result, faces=compact)
+    if isinstance(faces, list):
+        # multi-face search, see lambda_search.search_faces_in_image()
+        return dict(result, faces=[dict(face, FaceMatches=compact_face_matches(face["FaceMatches"])) for face in faces])
+    return result
+
+
+def shape_result(result: dict, fields: tuple = None, compact: bool = False) -> dict:
+    """return a search result with only the requested fields"""
+    if compact:
+        result = compact_result(result)
+    if fields:
+        result = {key: value for key, value in result.items() if key in fields or key in ALWAYS_INCLUDED_FIELDS}
+    return result
+
+
+def shape_search_response(body: dict, fields: tuple = None, compact: bool = False) -> dict:
+    """
+    return a search response with only the requested fields. the results of a
+    batch search or of a search job are shaped one by one.
+    """
+    if not fields and not compact:
+        return body
+    if isinstance(body.get("results"), list):
+        return dict(body, results=[shape_result(result, fields, compact) for result in body["results"]])
+    return shape_result(body, fields, compact)
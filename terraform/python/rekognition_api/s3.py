@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+S3 helpers shared by the Lambda functions.
+
+S3ObjectDescriptor holds everything that the indexing pipeline needs to know
+about an uploaded image. It is fetched once per event record with a single
+HEAD request and then passed through the pipeline.
+
+see https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3/client/head_object.html
+"""
+
+# python stuff
+from dataclasses import dataclass, field
+from urllib.parse import (  # to 'de-escape' string representations of URL values
+    unquote_plus,
+)
+
+# our stuff
+from rekognition_api.conf import settings
+
+
+def get_s3_client():
+    """
+    Return the low-level S3 client behind settings.aws_s3_client. Unlike the
+    resource, the client is thread-safe.
+    """
+    return settings.aws_s3_client.meta.client
+
+
+def get_object_bytes(bucket: str, key: str) -> bytes:
+    """Read the whole body of an S3 object."""
+    body = get_s3_client().get_object(Bucket=bucket, Key=key)["Body"]
+    try:
+        return body.read()
+    finally:
+        body.close()
+
+
+def get_bucket_name_from_record(record) -> str:
+    """returns the bucket name from an S3 event record"""
+    return record["s3"]["bucket"]["name"]
+
+
+def get_object_key_from_record(record) -> str:
+    """returns the decoded object key from an S3 event record"""
+    return unquote_plus(record["s3"]["object"]["key"], encoding="utf-8")
+
+
+def get_object_etag_from_record(record) -> str:
+    """returns the object ETag from an S3 event record, if any"""
+    return record["s3"]["object"].get("eTag")
+
+
+@dataclass(frozen=True)
+class S3ObjectDescriptor:
+    """An S3 object, as described by a single HEAD request."""
+
+    bucket: str
+    key: str
+    etag: str = None
+    size: int = None
+    content_type: str = None
+    metadata: dict = field(default_factory=dict)
+
+    @classmethod
+    def head(cls, bucket: str, key: str) -> "S3ObjectDescriptor":
+        """Describe an S3 object with a single HEAD request."""
+        response = get_s3_client().head_object(Bucket=bucket, Key=key)
+        return cls(
+            bucket=bucket,
+            key=key,
+            etag=response.get("ETag", "").strip('"'),
+            size=response.get("ContentLength"),
+            content_type=response.get("ContentType"),
+            metadata=response.get("Metadata", {}),
+        )
+
+    @classmethod
+    def from_record(cls, record) -> "S3ObjectDescriptor":
+        """Describe the S3 object referenced by an S3 event record."""
+        return cls.head(bucket=get_bucket_name_from_record(record), key=get_object_key_from_record(record))
+
+    @property
+    def rekognition_image(self) -> dict:
+        """Return the Rekognition Image parameter for this object."""
+        return {"S3Object": {"Bucket": self.bucket, "Name": self.key}}
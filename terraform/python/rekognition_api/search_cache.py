@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Search result cache for lambda_search.
+
+Clients often resubmit the exact same image, on retries or from polling
+kiosks, and each resubmission costs a SearchFacesByImage call plus the
+faceprint reads. Results are cached under a SHA-256 hash of the decoded
+image bytes and of the search parameters, at two levels:
+
+1.) an LRUCache in the warm Lambda container, see cache.py
+2.) a DynamoDB table that is shared by every container, whose items expire
+    with the table's TTL
+
+Every cached result carries the version of the collection that it was
+computed against. lambda_index bumps the version, a DynamoDB counter, after
+it indexes new faces, so a result that could be missing the new faces is
+never served again. The version and the shared result are read with one
+BatchGetItem, and a container trusts its copy of the version for
+settings.aws_lambda_search_result_cache_version_ttl_seconds.
+"""
+
+# python stuff
+import hashlib
+import json
+import threading
+import time
+
+# our stuff
+from rekognition_api.cache import MISSING, LRUCache
+from rekognition_api.conf import settings
+from rekognition_api.dynamodb import batch_get_items
+from rekognition_api.exceptions import RekognitionUnprocessedItemsError
+
+
+SEARCH_CACHE_KEY_PREFIX = "search#"
+COLLECTION_VERSION_KEY_PREFIX = "version#"
+SEARCH_CACHE_MAX_ITEM_BYTES = 350 * 1024  # DynamoDB items are limited to 400KB
+
+_lock = threading.Lock()
+_search_cache = None
+
+
+def get_search_cache_client():
+    """Return the thread-safe client of the DynamoDB resource."""
+    return settings.aws_dynamodb_resource.meta.client
+
+
+def get_search_cache_key(image: bytes, params: dict) -> str:
+    """Return the cache key of a search, a hash of the decoded image bytes and of the search parameters."""
+    digest = hashlib.sha256(image)
+    digest.update(json.dumps(params, sort_keys=True).encode("utf-8"))
+    return SEARCH_CACHE_KEY_PREFIX + digest.hexdigest()
+
+
+def get_collection_version_key(collection_id: str) -> str:
+    """Return the cache table key of the version counter of a collection."""
+    return COLLECTION_VERSION_KEY_PREFIX + collection_id
+
+
+def bump_collection_version(collection_id: str = None) -> int:
+    """Invalidate every cached search result of a collection. Returns the new version."""
+    response = get_search_cache_client().update_item(
+        TableName=settings.aws_dynamodb_search_cache_table_id,
+        Key={"CacheKey": get_collection_version_key(collection_id or settings.aws_rekognition_collection_id)},
+        UpdateExpression="ADD #version :one",
+        ExpressionAttributeNames={"#version": "version"},
+        ExpressionAttributeValues={":one": 1},
+        ReturnValues="UPDATED_NEW",
+    )
+    return int(response["Attributes"]["version"])
+
+
+class SearchResultCache:
+    """Two-level cache of search results, invalidated by the collection version."""
+
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    def __init__(
+        self,
+        table_name: str,
+        ttl_seconds: int,
+        max_entries: int,
+        max_bytes: int,
+        version_ttl_seconds: float,
+    ):
+        self.table_name = table_name
+        self.ttl_seconds = ttl_seconds
+        self.memory = LRUCache(max_entries, max_bytes, ttl_seconds)  # key -> (version, result json)
+        self.versions = LRUCache(max_entries=64, max_bytes=64 * 1024, ttl_seconds=version_ttl_seconds)
+        self.counts = {"memoryHits": 0, "sharedHits": 0, "misses": 0}
+        self._lock = threading.Lock()
+
+    def _count(self, counter: str):
+        with self._lock:
+            self.counts[counter] += 1
+
+    def get(self, cache_key: str, collection_id: str) -> tuple:
+        """
+        Return (result, version). result is None if there is no cached
+        result for the current version of the collection, in which case the
+        search result has to be put() with the returned version. version is
+        None if the cache table could not be read.
+        """
+        version = self.versions.get(collection_id)
+        entry = self.memory.get(cache_key)
+        if version is not MISSING and entry is not MISSING and entry[0] == version:
+            self._count("memoryHits")
+            return json.loads(entry[1]), version
+
+        version_key = get_collection_version_key(collection_id)
+        client = get_search_cache_client()
+        try:
+            items = batch_get_items(
+                [version_key, cache_key],
+                key_name="CacheKey",
+                table_name=self.table_name,
+                projection=("CacheKey", "version", "result"),
+            )
+        except (client.exceptions.ClientError, RekognitionUnprocessedItemsError) as e:
+            # an unavailable or throttled cache must not fail the search. without a version, the result is not cached.
+            print(json.dumps({"searchCache": "batch_get_item failed", "error": str(e)}))
+            self._count("misses")
+            return None, None
+        version = int(items.get(version_key, {}).get("version", 0))
+        self.versions.put(collection_id, version)
+
+        if entry is not MISSING and entry[0] == version:
+            self._count("memoryHits")
+            return json.loads(entry[1]), version
+        item = items.get(cache_key)
+        if item is not None and int(item["version"]) == version:
+            self.memory.put(cache_key, (version, item["result"]))
+            self._count("sharedHits")
+            return json.loads(item["result"]), version
+
+        self._count("misses")
+        return None, version
+
+    def put(self, cache_key: str, version: int, result: dict):
+        """Cache the result of a search that was computed against a version of the collection."""
+        if version is None:
+            return
+        result_json = json.dumps(result)
+        self.memory.put(cache_key, (version, result_json))
+        if len(result_json) > SEARCH_CACHE_MAX_ITEM_BYTES:
+            return
+        client = get_search_cache_client()
+        try:
+            client.put_item(
+                TableName=self.table_name,
+                Item={
+                    "CacheKey": cache_key,
+                    "version": version,
+                    "result": result_json,
+                    "expiresAt": int(time.time()) + self.ttl_seconds,
+                },
+            )
+        except client.exceptions.ClientError as e:
+            # the search itself succeeded, so a failed cache write is only logged
+            print(json.dumps({"searchCache": "put_item failed", "error": str(e)}))
+
+    @property
+    def stats(self) -> dict:
+        """Return the hit and miss counters of both levels."""
+        return {**self.counts, "memory": self.memory.stats}
+
+
+def get_search_cache() -> SearchResultCache:
+    """Return the search result cache that is shared by every invocation of this container."""
+    global _search_cache  # pylint: disable=global-statement
+    with _lock:
+        if _search_cache is None:
+            _search_cache = SearchResultCache(
+                table_name=settings.aws_dynamodb_search_cache_table_id,
+                ttl_seconds=settings.aws_lambda_search_result_cache_ttl_seconds,
+                max_entries=settings.aws_lambda_search_result_cache_max_entries,
+                max_bytes=settings.aws_lambda_search_result_cache_max_bytes,
+                version_ttl_seconds=settings.aws_lambda_search_result_cache_version_ttl_seconds,
+            )
+    return _search_cache
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=wrong-import-position
+"""
+Micro-benchmark: face_record_to_dynamodb_item() vs the json round trip that
+persist_faceprints() previously used to convert FaceRecords to DynamoDB items.
+
+usage (from terraform/python):
+    python -m rekognition_api.tests.benchmark_face_record_to_dynamodb_item
+"""
+
+# python stuff
+import json
+import os
+import sys
+import timeit
+from decimal import Decimal
+
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+PYTHON_ROOT = os.path.dirname(os.path.dirname(HERE))
+if PYTHON_ROOT not in sys.path:
+    sys.path.append(PYTHON_ROOT)  # noqa: E402
+
+# our stuff
+from rekognition_api.tests.test_setup import get_face_record_sample  # noqa: E402
+from rekognition_api.utils import face_record_to_dynamodb_item  # noqa: E402
+
+
+NUMBER = 20000
+
+
+def json_round_trip(face):
+    """The conversion that face_record_to_dynamodb_item() replaces."""
+    return json.loads(json.dumps(face), parse_float=Decimal)
+
+
+def main():
+    """Time both conversions for the persisted Face and for a full FaceRecord."""
+    face_record = get_face_record_sample()["FaceRecords"][0]
+    face = dict(face_record["Face"], bucket="bucket", key="key.jpg", metadata={})
+    for label, value in (("Face", face), ("FaceRecord (DetectionAttributes=ALL)", face_record)):
+        assert face_record_to_dynamodb_item(value) == json_round_trip(value)
+        before = min(timeit.repeat(lambda v=value: json_round_trip(v), number=NUMBER, repeat=5))
+        after = min(timeit.repeat(lambda v=value: face_record_to_dynamodb_item(v), number=NUMBER, repeat=5))
+        print(
+            f"{label}: json round trip {before / NUMBER * 1e6:.2f} us, "
+            f"face_record_to_dynamodb_item {after / NUMBER * 1e6:.2f} us, "
+            f"speedup {before / after:.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=wrong-import-position
+"""
+Benchmark: peak memory of decoding a search request body. Compares the
+original decoding of a single image, str(body).encode("ascii") followed by
+base64.b64decode(), and the original email-parser multipart decoding, with
+the decoding of uploads.py. Peak memory is measured with tracemalloc, and
+excludes the event itself.
+
+usage (from terraform/python):
+    python -m rekognition_api.tests.benchmark_image_upload
+"""
+
+# python stuff
+import base64
+import os
+import sys
+import time
+import tracemalloc
+from email.parser import BytesParser
+from email.policy import HTTP
+
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+PYTHON_ROOT = os.path.dirname(os.path.dirname(HERE))
+if PYTHON_ROOT not in sys.path:
+    sys.path.append(PYTHON_ROOT)  # noqa: E402
+
+# our stuff
+from rekognition_api.tests.test_setup import get_test_image  # noqa: E402
+from rekognition_api.uploads import get_batch_images, get_single_image  # noqa: E402
+
+
+IMG_DIR = os.path.join(HERE, "mock_data", "img")
+BOUNDARY = "----boundary"
+
+
+def original_single_image(event) -> bytes:
+    """the original lambda_search.get_image_bytes_from_event()"""
+    image_raw = str(event["body"]).encode("ascii")
+    return base64.b64decode(image_raw)
+
+
+def original_multipart_images(event) -> list:
+    """multipart decoding with the standard library email parser"""
+    body = base64.b64decode(event["body"])
+    content_type = event["headers"]["Content-Type"].encode("latin-1")
+    message = BytesParser(policy=HTTP).parsebytes(b"Content-Type: " + content_type + b"\r\n\r\n" + body)
+    return [(part.get_filename(), part.get_payload(decode=True)) for part in message.iter_parts()]
+
+
+def measure(decode, event) -> tuple:
+    """return the (peak bytes, milliseconds) of decoding an event"""
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = decode(event)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return peak, elapsed * 1000
+
+
+def report(name: str, size: int, original: tuple, current: tuple):
+    """print the peak memory of both decodings, as a multiple of the image size"""
+    print(
+        f"{name}: {size} bytes, original peak {original[0] / size:.2f}x in {original[1]:.1f} ms, "
+        f"uploads.py peak {current[0] / size:.2f}x in {current[1]:.1f} ms"
+    )
+
+
+def main():
+    """Decode every mock image as a single image, then all of them as one multipart body."""
+    images = [(filename, get_test_image(filename)) for filename in sorted(os.listdir(IMG_DIR))]
+    for filename, image in images:
+        event = {
+            "headers": {"Content-Type": "image/jpeg"},
+            "body": base64.b64encode(image).decode("ascii"),
+            "isBase64Encoded": True,
+        }
+        report(filename, len(image), measure(original_single_image, event), measure(get_single_image, event))
+
+    body = b""
+    for filename, image in images:
+        body += f"--{BOUNDARY}\r\n".encode()
+        body += f'Content-Disposition: form-data; name="image"; filename="{filename}"\r\n'.encode()
+        body += b"Content-Type: image/jpeg\r\n\r\n" + image + b"\r\n"
+    body += f"--{BOUNDARY}--\r\n".encode()
+    event = {
+        "headers": {"Content-Type": f"multipart/form-data; boundary={BOUNDARY}"},
+        "body": base64.b64encode(body).decode("ascii"),
+        "isBase64Encoded": True,
+    }
+    size = sum(len(image) for _, image in images)
+    report(
+        f"multipart, {len(images)} images",
+        size,
+        measure(original_multipart_images, event),
+        measure(lambda event: get_batch_images(event, max_images=len(images)), event),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=wrong-import-position
+"""
+Benchmark: image normalization of the mock images. Reports the bytes saved
+per image, the latency that normalization adds, and the batch throughput
+on a thread pool the size of lambda_search.search_batch()'s vs one image
+at a time. Pillow releases the GIL while it decodes and resamples.
+
+requires Pillow.
+
+usage (from terraform/python):
+    python -m rekognition_api.tests.benchmark_normalize_image
+"""
+
+# python stuff
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+PYTHON_ROOT = os.path.dirname(os.path.dirname(HERE))
+if PYTHON_ROOT not in sys.path:
+    sys.path.append(PYTHON_ROOT)  # noqa: E402
+
+# our stuff
+from rekognition_api.conf import settings  # noqa: E402
+from rekognition_api.images import normalize_image  # noqa: E402
+from rekognition_api.tests.test_setup import get_test_image  # noqa: E402
+
+
+IMG_DIR = os.path.join(HERE, "mock_data", "img")
+
+
+def main():
+    """Normalize every mock image, then the whole batch serially and on a thread pool."""
+    images = [(filename, get_test_image(filename)) for filename in sorted(os.listdir(IMG_DIR))]
+    max_edge = settings.aws_rekognition_image_max_edge
+    quality = settings.aws_rekognition_image_jpeg_quality
+    print(f"max edge {max_edge}px, JPEG quality {quality}")
+
+    for filename, image in images:
+        normalized = normalize_image(image, max_edge=max_edge, quality=quality)
+        print(
+            f"{filename}: {normalized.original_bytes} -> {normalized.normalized_bytes} bytes "
+            f"({normalized.bytes_saved / normalized.original_bytes:.0%} saved, "
+            f"{normalized.bytes_saved * 4 // 3} fewer base64 bytes), "
+            f"{normalized.width}x{normalized.height}, +{normalized.elapsed_ms} ms"
+        )
+
+    batch = [image for _, image in images]
+    started = time.perf_counter()
+    _ = [normalize_image(image, max_edge=max_edge, quality=quality) for image in batch]
+    serial = time.perf_counter() - started
+    started = time.perf_counter()
+    max_workers = max(1, min(len(batch), settings.aws_lambda_search_batch_max_workers))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        _ = list(executor.map(lambda image: normalize_image(image, max_edge=max_edge, quality=quality), batch))
+    pooled = time.perf_counter() - started
+    print(f"batch of {len(batch)}: serial {serial * 1000:.0f} ms, {max_workers} threads {pooled * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
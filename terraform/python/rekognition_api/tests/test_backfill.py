@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=wrong-import-position
+"""Test the S3 backfill command."""
+
+# python stuff
+import os
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+PYTHON_ROOT = os.path.dirname(os.path.dirname(HERE))
+if PYTHON_ROOT not in sys.path:
+    sys.path.append(PYTHON_ROOT)  # noqa: E402
+
+# our stuff
+from rekognition_api.backfill import (  # noqa: E402
+    Checkpoint,
+    backfill,
+    main,
+    s3_event_record,
+)
+from rekognition_api.s3 import get_object_key_from_record  # noqa: E402
+
+
+def index_records_result(records, **_kwargs):
+    """Stand-in for lambda_index.index_records() that indexes one face per record."""
+    results = [
+        {"key": get_object_key_from_record(record), "statusCode": 200, "body": {"FaceRecords": [{}]}}
+        for record in records
+    ]
+    return results, {"itemsWritten": len(records)}
+
+
+class TestBackfill(unittest.TestCase):
+    """Test the S3 backfill command."""
+
+    def setUp(self):
+        """Set up a temporary checkpoint file."""
+        handle, self.checkpoint_path = tempfile.mkstemp(suffix=".jsonl")
+        os.close(handle)
+        os.remove(self.checkpoint_path)
+        self.addCleanup(lambda: os.path.exists(self.checkpoint_path) and os.remove(self.checkpoint_path))
+
+    def test_s3_event_record(self):
+        """Test that listed keys survive the url-encoding of S3 event records."""
+        record = s3_event_record("bucket", {"Key": "people/Keanu Reeves+1.jpg", "ETag": '"c9230f7b"'})
+        self.assertEqual(get_object_key_from_record(record), "people/Keanu Reeves+1.jpg")
+        self.assertEqual(record["s3"]["object"]["eTag"], "c9230f7b")
+
+    @patch("rekognition_api.backfill.index_records", side_effect=index_records_result)
+    @patch("rekognition_api.backfill.get_s3_client")
+    def test_backfill_checkpoints_and_resumes(self, mock_get_s3_client, mock_index_records):
+        """Test that an interrupted backfill resumes from the last checkpointed page."""
+        client = mock_get_s3_client.return_value
+        client.list_objects_v2.side_effect = [
+            {"Contents": [{"Key": "a.jpg"}, {"Key": "b.png"}], "NextContinuationToken": "token-2"},
+            KeyboardInterrupt(),
+        ]
+        with self.assertRaises(KeyboardInterrupt):
+            backfill("bucket", checkpoint_path=self.checkpoint_path, max_workers=2)
+
+        checkpoint = Checkpoint(self.checkpoint_path)
+        self.assertEqual(checkpoint.continuation_token, "token-2")
+        self.assertEqual(checkpoint.statuses, {"a.jpg": 200})
+        self.assertFalse(checkpoint.done)
+
+        client.list_objects_v2.side_effect = [{"Contents": [{"Key": "c.jpg"}]}]
+        stats = backfill("bucket", checkpoint_path=self.checkpoint_path, max_workers=2)
+
+        self.assertEqual(client.list_objects_v2.call_args.kwargs["ContinuationToken"], "token-2")
+        self.assertEqual(stats["indexed"], 1)
+        self.assertEqual(stats["faces"], 1)
+        self.assertTrue(Checkpoint(self.checkpoint_path).done)
+        self.assertEqual(mock_index_records.call_count, 2)
+
+    @patch("rekognition_api.backfill.index_records")
+    @patch("rekognition_api.backfill.get_s3_client")
+    def test_backfill_retry_failed(self, mock_get_s3_client, mock_index_records):
+        """Test that --retry-failed re-indexes the failed keys of a finished backfill."""
+        checkpoint = Checkpoint(self.checkpoint_path)
+        checkpoint.save_page(
+            [{"key": "a.jpg", "statusCode": 200}, {"key": "b.jpg", "statusCode": 500}],
+            continuation_token=None,
+            done=True,
+        )
+        mock_index_records.side_effect = index_records_result
+
+        stats = backfill("bucket", checkpoint_path=self.checkpoint_path, retry_failed=True)
+
+        retried = [get_object_key_from_record(record) for record in mock_index_records.call_args.args[0]]
+        self.assertEqual(retried, ["b.jpg"])
+        self.assertEqual(stats["indexed"], 1)
+        self.assertEqual(Checkpoint(self.checkpoint_path).failed_keys, [])
+        mock_get_s3_client.return_value.list_objects_v2.assert_not_called()
+
+    @patch("rekognition_api.backfill.backfill")
+    def test_main_requires_bucket(self, mock_backfill):
+        """Test that the bucket is always explicit, since the deployed bucket name has a random suffix."""
+        with self.assertRaises(SystemExit), patch("sys.stderr"):
+            main(["--prefix", "photos/"])
+        mock_backfill.assert_not_called()
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=wrong-import-position
+"""Test the warm-container caches."""
+
+# python stuff
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+PYTHON_ROOT = os.path.dirname(os.path.dirname(HERE))
+if PYTHON_ROOT not in sys.path:
+    sys.path.append(PYTHON_ROOT)  # noqa: E402
+
+# our stuff
+from rekognition_api.cache import (  # noqa: E402
+    MISSING,
+    NOT_FOUND,
+    FaceCache,
+    LRUCache,
+    estimate_size,
+)
+
+
+class TestCache(unittest.TestCase):
+    """Test the warm-container caches."""
+
+    def test_lru_eviction(self):
+        """Test that the least recently used entry is evicted once max_entries is reached."""
+        cache = LRUCache(max_entries=2, max_bytes=1024 * 1024, ttl_seconds=60)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIs(cache.get("b"), MISSING)
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(cache.stats["evictions"], 1)
+        self.assertEqual(cache.stats["hits"], 3)
+        self.assertEqual(cache.stats["misses"], 1)
+
+    def test_memory_accounting(self):
+        """Test that entries are evicted to stay within max_bytes, and that oversized values are not cached."""
+        item = {"FaceId": "df1faf37-6aa7-4636-89d7-579f16d0e13f", "ExternalImageId": "Lawrence4.jpg"}
+        entry_size = estimate_size("0") + estimate_size(item)
+        cache = LRUCache(max_entries=100, max_bytes=entry_size * 3, ttl_seconds=60)
+        for i in range(5):
+            cache.put(str(i), item)
+
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache.bytes, entry_size * 3)
+        self.assertIs(cache.get("0"), MISSING)
+
+        cache.put("big", "x" * entry_size * 4)
+        self.assertIs(cache.get("big"), MISSING)
+        self.assertEqual(len(cache), 3)
+
+        cache.clear()
+        self.assertEqual((len(cache), cache.bytes), (0, 0))
+
+    @patch("rekognition_api.cache.time")
+    def test_ttl(self, mock_time):
+        """Test that an entry expires after its TTL."""
+        mock_time.monotonic.return_value = 100.0
+        cache = LRUCache(max_entries=10, max_bytes=1024 * 1024, ttl_seconds=60)
+        cache.put("a", 1)
+
+        mock_time.monotonic.return_value = 159.0
+        self.assertEqual(cache.get("a"), 1)
+        mock_time.monotonic.return_value = 160.0
+        self.assertIs(cache.get("a"), MISSING)
+        self.assertEqual(cache.stats["expirations"], 1)
+        self.assertEqual(cache.bytes, 0)
+
+    @patch("rekognition_api.cache.time")
+    def test_negative_cache(self, mock_time):
+        """Test that a FaceId without a row is remembered for the negative TTL only, and only if enabled."""
+        mock_time.monotonic.return_value = 100.0
+        cache = FaceCache(max_entries=10, max_bytes=1024 * 1024, ttl_seconds=3600, negative_ttl_seconds=5)
+        cache.put_not_found("a")
+
+        self.assertIs(cache.get("a"), NOT_FOUND)
+        self.assertEqual(cache.stats["negativeHits"], 1)
+        mock_time.monotonic.return_value = 105.0
+        self.assertIs(cache.get("a"), MISSING)
+
+        cache = FaceCache(max_entries=10, max_bytes=1024 * 1024, ttl_seconds=3600, negative=False)
+        cache.put_not_found("a")
+        self.assertIs(cache.get("a"), MISSING)
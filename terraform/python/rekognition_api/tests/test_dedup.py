@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=wrong-import-position
+"""Test content-addressed deduplication."""
+
+# python stuff
+import hashlib
+import os
+import sys
+import unittest
+from unittest.mock import MagicMock, patch
+
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+PYTHON_ROOT = os.path.dirname(os.path.dirname(HERE))
+if PYTHON_ROOT not in sys.path:
+    sys.path.append(PYTHON_ROOT)  # noqa: E402
+
+# our stuff
+from rekognition_api.dedup import content_entry, hash_s3_object  # noqa: E402
+from rekognition_api.s3 import S3ObjectDescriptor  # noqa: E402
+from rekognition_api.tests.test_setup import get_test_image  # noqa: E402
+
+
+class TestDedup(unittest.TestCase):
+    """Test content-addressed deduplication."""
+
+    image = get_test_image("Keanu-Reeves.jpg")
+    s3_object = S3ObjectDescriptor(bucket="bucket", key="Keanu-Reeves.jpg", etag="c9230f7b")
+
+    @patch("rekognition_api.dedup.get_s3_client")
+    def test_hash_s3_object_streams_body(self, mock_get_s3_client):
+        """Test that the object is hashed chunk by chunk."""
+        body = MagicMock()
+        body.iter_chunks.return_value = iter([self.image[:1000], self.image[1000:]])
+        mock_get_s3_client.return_value.get_object.return_value = {"Body": body}
+
+        content_hash = hash_s3_object(self.s3_object)
+
+        self.assertEqual(content_hash, "sha256:" + hashlib.sha256(self.image).hexdigest())
+        body.iter_chunks.assert_called_once()
+        body.close.assert_called_once()
+
+    def test_content_entry(self):
+        """Test the content table entry of a newly indexed object."""
+        entry = content_entry("sha256:abc", self.s3_object, ["face-1"])
+        self.assertEqual(entry["FaceIds"], ["face-1"])
+        self.assertEqual(entry["objects"], {"s3://bucket/Keanu-Reeves.jpg"})
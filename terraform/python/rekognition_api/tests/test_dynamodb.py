@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=wrong-import-position
+"""Test DynamoDB helpers."""
+
+# python stuff
+import os
+import sys
+import unittest
+from unittest.mock import MagicMock, patch
+
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+PYTHON_ROOT = os.path.dirname(os.path.dirname(HERE))
+if PYTHON_ROOT not in sys.path:
+    sys.path.append(PYTHON_ROOT)  # noqa: E402
+
+# our stuff
+from rekognition_api.dynamodb import BatchWriter, batch_get_items  # noqa: E402
+from rekognition_api.exceptions import (  # noqa: E402
+    RekognitionUnprocessedItemsError,
+)
+
+
+class TestBatchWriter(unittest.TestCase):
+    """Test BatchWriter."""
+
+    def setUp(self):
+        """Set up test fixtures."""
+        self.client = MagicMock()
+        self.client.batch_write_item.return_value = {
+            "UnprocessedItems": {},
+            "ConsumedCapacity": [{"TableName": "test", "CapacityUnits": 1.0}],
+        }
+        patcher = patch("rekognition_api.dynamodb.settings")
+        mock_settings = patcher.start()
+        mock_settings.aws_dynamodb_resource.meta.client = self.client
+        self.addCleanup(patcher.stop)
+        sleep_patcher = patch("rekognition_api.dynamodb.time.sleep")
+        sleep_patcher.start()
+        self.addCleanup(sleep_patcher.stop)
+
+    def test_writes_in_batches_of_25(self):
+        """Test that puts are chunked into BatchWriteItem requests of at most 25 items."""
+        with BatchWriter(table_name="test") as writer:
+            for i in range(60):
+                writer.put_item({"FaceId": str(i)})
+
+        batch_sizes = [len(c.kwargs["RequestItems"]["test"]) for c in self.client.batch_write_item.call_args_list]
+        self.assertEqual(batch_sizes, [25, 25, 10])
+        self.assertEqual(writer.stats["itemsWritten"], 60)
+        self.assertEqual(writer.stats["consumedCapacityUnits"], 3.0)
+
+    def test_duplicate_keys_coalesce(self):
+        """Test that a repeated primary key is written once, last put wins."""
+        with BatchWriter(table_name="test") as writer:
+            writer.put_item({"FaceId": "a", "value": 1})
+            writer.put_item({"FaceId": "a", "value": 2})
+
+        batch = self.client.batch_write_item.call_args.kwargs["RequestItems"]["test"]
+        self.assertEqual(batch, [{"PutRequest": {"Item": {"FaceId": "a", "value": 2}}}])
+
+    def test_unprocessed_items_are_retried(self):
+        """Test that UnprocessedItems are resent until DynamoDB accepts them."""
+        unprocessed = {"test": [{"PutRequest": {"Item": {"FaceId": "b"}}}]}
+        self.client.batch_write_item.side_effect = [
+            {"UnprocessedItems": unprocessed},
+            {"UnprocessedItems": {}},
+        ]
+        with BatchWriter(table_name="test") as writer:
+            writer.put_item({"FaceId": "a"})
+            writer.put_item({"FaceId": "b"})
+
+        self.assertEqual(self.client.batch_write_item.call_count, 2)
+        self.assertEqual(self.client.batch_write_item.call_args.kwargs["RequestItems"], unprocessed)
+        self.assertEqual(writer.stats["itemsWritten"], 2)
+        self.assertEqual(writer.stats["retries"], 1)
+
+    def test_unprocessed_items_give_up(self):
+        """Test that the writer raises once max_attempts is exhausted."""
+        unprocessed = {"test": [{"PutRequest": {"Item": {"FaceId": "a"}}}]}
+        self.client.batch_write_item.return_value = {"UnprocessedItems": unprocessed}
+        writer = BatchWriter(table_name="test", max_attempts=3)
+        writer.put_item({"FaceId": "a"})
+        with self.assertRaises(RekognitionUnprocessedItemsError):
+            writer.flush()
+        self.assertEqual(self.client.batch_write_item.call_count, 3)
+
+    def test_failed_batch_fails_every_owner(self):
+        """Test that a batch that can't be written fails the owners of all of its items, and later batches are still sent."""
+        self.client.batch_write_item.side_effect = [ValueError("boom"), {"UnprocessedItems": {}}]
+        writer = BatchWriter(table_name="test", auto_flush=False)
+        for i in range(30):
+            writer.for_owner(i % 3 if i < 25 else 3).put_item({"FaceId": str(i)})
+        with self.assertRaises(ValueError):
+            writer.flush()
+        self.assertEqual(self.client.batch_write_item.call_count, 2)
+        self.assertEqual(writer.failed_owners, {0, 1, 2})
+        self.assertEqual(writer.stats["itemsWritten"], 5)
+
+    def test_discard(self):
+        """Test that the buffered items of discarded owners are not written."""
+        with BatchWriter(table_name="test") as writer:
+            writer.put_item({"FaceId": "a"}, owner=1)
+            writer.put_item({"FaceId": "b"}, owner=2)
+            writer.discard({1})
+
+        batch = self.client.batch_write_item.call_args.kwargs["RequestItems"]["test"]
+        self.assertEqual(batch, [{"PutRequest": {"Item": {"FaceId": "b"}}}])
+
+
+class TestBatchGetItems(unittest.TestCase):
+    """Test batch_get_items."""
+
+    def setUp(self):
+        """Set up test fixtures."""
+        self.client = MagicMock()
+        self.client.batch_get_item.side_effect = lambda RequestItems: {
+            "Responses": {"test": [dict(key) for key in RequestItems["test"]["Keys"]]},
+            "UnprocessedKeys": {},
+        }
+        patcher = patch("rekognition_api.dynamodb.settings")
+        mock_settings = patcher.start()
+        mock_settings.aws_dynamodb_resource.meta.client = self.client
+        self.addCleanup(patcher.stop)
+        sleep_patcher = patch("rekognition_api.dynamodb.time.sleep")
+        sleep_patcher.start()
+        self.addCleanup(sleep_patcher.stop)
+
+    def test_reads_in_batches_of_100(self):
+        """Test that keys are deduplicated and chunked into BatchGetItem requests of at most 100 keys."""
+        face_ids = [str(i) for i in range(150)] + ["0", "1"]
+        items = batch_get_items(face_ids, table_name="test")
+
+        batch_sizes = [len(c.kwargs["RequestItems"]["test"]["Keys"]) for c in self.client.batch_get_item.call_args_list]
+        self.assertEqual(batch_sizes, [100, 50])
+        self.assertEqual(len(items), 150)
+        self.assertEqual(items["42"], {"FaceId": "42"})
+
+    def test_projection(self):
+        """Test that the projection is sent with attribute name placeholders."""
+        batch_get_items(["a"], table_name="test", projection=("FaceId", "key"))
+
+        request = self.client.batch_get_item.call_args.kwargs["RequestItems"]["test"]
+        self.assertEqual(request["ProjectionExpression"], "#p0, #p1")
+        self.assertEqual(request["ExpressionAttributeNames"], {"#p0": "FaceId", "#p1": "key"})
+
+    def test_unprocessed_keys_are_retried(self):
+        """Test that UnprocessedKeys are requested again until DynamoDB returns them."""
+        unprocessed = {"test": {"Keys": [{"FaceId": "b"}]}}
+        self.client.batch_get_item.side_effect = [
+            {"Responses": {"test": [{"FaceId": "a"}]}, "UnprocessedKeys": unprocessed},
+            {"Responses": {"test": [{"FaceId": "b"}]}, "UnprocessedKeys": {}},
+        ]
+        items = batch_get_items(["a", "b"], table_name="test")
+
+        self.assertEqual(self.client.batch_get_item.call_count, 2)
+        self.assertEqual(self.client.batch_get_item.call_args.kwargs["RequestItems"], unprocessed)
+        self.assertEqual(set(items), {"a", "b"})
+
+    def test_unprocessed_keys_give_up(self):
+        """Test that batch_get_items raises once max_attempts is exhausted."""
+        self.client.batch_get_item.side_effect = None
+        self.client.batch_get_item.return_value = {"UnprocessedKeys": {"test": {"Keys": [{"FaceId": "a"}]}}}
+        with self.assertRaises(RekognitionUnprocessedItemsError):
+            batch_get_items(["a"], table_name="test", max_attempts=3)
+        self.assertEqual(self.client.batch_get_item.call_count, 3)
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=wrong-import-position
+"""Test pre-flight image validation."""
+
+# python stuff
+import io
+import os
+import sys
+import unittest
+from unittest.mock import MagicMock, patch
+
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+PYTHON_ROOT = os.path.dirname(os.path.dirname(HERE))
+if PYTHON_ROOT not in sys.path:
+    sys.path.append(PYTHON_ROOT)  # noqa: E402
+
+# our stuff
+from rekognition_api.exceptions import RekognitionImageValidationError  # noqa: E402
+from rekognition_api.images import (  # noqa: E402
+    PNG_SIGNATURE,
+    Image,
+    ImageHeader,
+    crop_box,
+    crop_faces,
+    normalize_image,
+    prepare_image_bytes,
+    sniff_bytes,
+    sniff_s3_object,
+    validate_image_header,
+)
+from rekognition_api.s3 import S3ObjectDescriptor  # noqa: E402
+from rekognition_api.tests.test_setup import get_test_image  # noqa: E402
+
+
+def png_header(width: int, height: int) -> bytes:
+    """Return the signature and IHDR chunk of a PNG image."""
+    ihdr = width.to_bytes(4, "big") + height.to_bytes(4, "big") + b"\x08\x02\x00\x00\x00"
+    return PNG_SIGNATURE + len(ihdr).to_bytes(4, "big") + b"IHDR" + ihdr + b"\x00\x00\x00\x00"
+
+
+class TestImages(unittest.TestCase):
+    """Test pre-flight image validation."""
+
+    def test_sniff_jpeg(self):
+        """Test the dimensions of baseline and progressive JPEG images."""
+        header = sniff_bytes(get_test_image("Keanu-Reeves.jpg"))
+        self.assertEqual((header.format, header.width, header.height), ("jpeg", 3192, 1594))
+
+        # progressive (SOF2), behind a large EXIF segment
+        header = sniff_bytes(get_test_image("Lawrence19.jpg"))
+        self.assertEqual((header.format, header.width, header.height), ("jpeg", 338, 500))
+
+    def test_sniff_png(self):
+        """Test the dimensions of a PNG image."""
+        header = sniff_bytes(png_header(640, 480))
+        self.assertEqual((header.format, header.width, header.height), ("png", 640, 480))
+
+    def test_sniff_unsupported_format(self):
+        """Test that formats other than JPEG and PNG are rejected."""
+        with self.assertRaises(RekognitionImageValidationError):
+            sniff_bytes(b"GIF89a\x01\x00\x01\x00")
+
+    def test_validate_image_header(self):
+        """Test the size and dimension limits."""
+        validate_image_header(ImageHeader(format="jpeg", width=640, height=480, size=1024))
+        validate_image_header(ImageHeader(format="jpeg", size=1024))
+        with self.assertRaises(RekognitionImageValidationError):
+            validate_image_header(ImageHeader(format="png", width=640, height=40, size=1024))
+        with self.assertRaises(RekognitionImageValidationError):
+            validate_image_header(ImageHeader(format="jpeg", width=640, height=480, size=6 * 1024 * 1024))
+
+    @patch("rekognition_api.images.get_s3_client")
+    def test_sniff_s3_object_uses_ranged_gets(self, mock_get_s3_client):
+        """Test that only the first few KB of an S3 object are read."""
+        image = get_test_image("Lawrence19.jpg")
+
+        def get_object(Bucket, Key, Range):  # pylint: disable=invalid-name,unused-argument
+            start, end = (int(value) for value in Range.removeprefix("bytes=").split("-"))
+            return {"Body": MagicMock(read=MagicMock(return_value=image[start : end + 1]))}
+
+        mock_get_s3_client.return_value.get_object.side_effect = get_object
+        s3_object = S3ObjectDescriptor(bucket="bucket", key="Lawrence19.jpg", size=len(image))
+
+        header = sniff_s3_object(s3_object)
+
+        self.assertEqual((header.width, header.height, header.size), (338, 500, len(image)))
+        ranges = [call.kwargs["Range"] for call in mock_get_s3_client.return_value.get_object.call_args_list]
+        fetched = sum(int(end) - int(start) + 1 for start, end in (r.removeprefix("bytes=").split("-") for r in ranges))
+        # one chunk per segment that is too large to skip within the current chunk
+        self.assertLessEqual(len(ranges), 4)
+        self.assertLess(fetched, len(image) / 3)
+
+
+@unittest.skipIf(Image is None, "Pillow is not installed")
+class TestImageNormalization(unittest.TestCase):
+    """Test image normalization."""
+
+    def test_normalize_image(self):
+        """Test that a large image is downscaled to the max edge, and that its header still validates."""
+        image = get_test_image("Keanu-Reeves.jpg")
+
+        normalized = normalize_image(image, max_edge=1024, quality=80)
+
+        self.assertEqual(max(normalized.width, normalized.height), 1024)
+        self.assertLess(normalized.normalized_bytes, len(image))
+        self.assertEqual(normalized.bytes_saved, len(image) - len(normalized.data))
+        header = sniff_bytes(normalized.data)
+        self.assertEqual((header.width, header.height), (normalized.width, normalized.height))
+
+    @patch("rekognition_api.images.settings")
+    def test_prepare_image_bytes(self, mock_settings):
+        """Test that only images beyond the max edge are normalized on the search path."""
+        mock_settings.aws_rekognition_image_preflight = True
+        mock_settings.aws_rekognition_image_normalize = True
+        mock_settings.aws_rekognition_image_min_edge = 80
+        mock_settings.aws_rekognition_image_max_edge = 1920
+        mock_settings.aws_rekognition_image_jpeg_quality = 85
+
+        small = get_test_image("Lawrence2.jpg")
+        self.assertIs(prepare_image_bytes(small)["Bytes"], small)
+
+        large = get_test_image("Keanu-Reeves.jpg")
+        header = sniff_bytes(prepare_image_bytes(large)["Bytes"])
+        self.assertEqual(max(header.width, header.height), 1920)
+
+    def test_crop_box(self):
+        """Test that a bounding box is widened by the margin and clipped to the image."""
+        bounding_box = {"Left": 0.1, "Top": 0.5, "Width": 0.2, "Height": 0.4}
+        self.assertEqual(crop_box(bounding_box, 1000, 500, margin=0.25), (50, 200, 350, 500))
+
+    def test_crop_faces(self):
+        """Test that each face is cropped out of the EXIF orientation-corrected image."""
+        # as displayed: 200x400 white, with a red face in the top left corner
+        oriented = Image.new("RGB", (200, 400), "white")
+        oriented.paste((255, 0, 0), (0, 0, 100, 100))
+        exif = Image.Exif()
+        exif[0x0112] = 6  # stored rotated, to be displayed rotated 90 degrees clockwise
+        output = io.BytesIO()
+        oriented.transpose(Image.Transpose.ROTATE_90).save(output, format="JPEG", exif=exif)
+
+        bounding_boxes = [
+            {"Left": 0.0, "Top": 0.0, "Width": 0.5, "Height": 0.25},
+            {"Left": 0.5, "Top": 0.5, "Width": 0.2, "Height": 0.1},
+        ]
+        crops = crop_faces(output.getvalue(), bounding_boxes, margin=0)
+
+        self.assertEqual(len(crops), 2)
+        sizes = [(header.width, header.height) for header in map(sniff_bytes, crops)]
+        self.assertEqual(sizes, [(100, 100), (40, 40)])
+        with Image.open(io.BytesIO(crops[0])) as face:
+            red, green, blue = face.getpixel((50, 50))
+        self.assertGreater(red, 200)
+        self.assertLess(max(green, blue), 50)
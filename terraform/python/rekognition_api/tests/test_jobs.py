@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=wrong-import-position
+"""Test asynchronous search jobs."""
+
+# python stuff
+import io
+import json
+import os
+import sys
+import unittest
+import urllib.request
+from unittest.mock import MagicMock, patch
+
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+PYTHON_ROOT = os.path.dirname(os.path.dirname(HERE))
+if PYTHON_ROOT not in sys.path:
+    sys.path.append(PYTHON_ROOT)  # noqa: E402
+
+# our stuff
+from rekognition_api.exceptions import RekognitionValueError  # noqa: E402
+from rekognition_api.jobs import (  # noqa: E402
+    JOB_STATUS_QUEUED,
+    JOB_STATUS_SUCCEEDED,
+    PinnedHTTPSConnection,
+    create_job,
+    finish_job_chunk,
+    get_callback_opener,
+    get_job_results_key,
+    get_job_search_overrides,
+    get_job_status,
+    send_job_callback,
+)
+
+
+class ConditionalCheckFailedException(Exception):
+    """Stand-in for the DynamoDB ConditionalCheckFailedException."""
+
+
+class TestJobs(unittest.TestCase):
+    """Test asynchronous search jobs."""
+
+    def setUp(self):
+        """Set up mock S3, DynamoDB and SQS clients."""
+        patcher = patch("rekognition_api.jobs.settings")
+        self.settings = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.settings.aws_lambda_search_batch_max_images = 2
+        self.settings.aws_lambda_search_batch_max_workers = 4
+        self.settings.aws_lambda_search_jobs_retention_days = 1
+        self.settings.aws_lambda_search_bucket = "bucket"
+        self.settings.aws_lambda_search_jobs_queue_url = "queue"
+        self.settings.aws_dynamodb_search_jobs_table_id = "searchjobs"
+
+        self.objects = {}
+        self.s3_client = MagicMock()
+        self.s3_client.put_object.side_effect = lambda Bucket, Key, Body, **kwargs: self.objects.update({Key: Body})
+        self.s3_client.get_object.side_effect = lambda Bucket, Key: {"Body": io.BytesIO(self.objects[Key])}
+        self.jobs_client = MagicMock()
+        self.jobs_client.exceptions.ConditionalCheckFailedException = ConditionalCheckFailedException
+        self.queue_client = MagicMock()
+        self.queue_client.send_message_batch.return_value = {"Successful": []}
+        for name, client in (
+            ("get_s3_client", self.s3_client),
+            ("get_jobs_client", self.jobs_client),
+            ("get_queue_client", self.queue_client),
+        ):
+            patcher = patch(f"rekognition_api.jobs.{name}", return_value=client)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_create_job(self):
+        """Test that the images are stored, that the job is enqueued in chunks, and that bad images are kept."""
+        images = [("a", b"first"), ("b", RekognitionValueError("image is not base64 encoded")), ("c", b"third")]
+
+        status = create_job(images, callback_url="https://example.com/callback", search_overrides={"MaxFaces": 1})
+
+        self.assertEqual(status["status"], JOB_STATUS_QUEUED)
+        self.assertEqual((status["imageCount"], status["chunkCount"], status["chunksDone"]), (3, 2, 0))
+        self.assertEqual(sorted(self.objects.values()), [b"first", b"third"])
+        self.assertFalse(any(key.endswith(".jpg") for key in self.objects))
+        item = self.jobs_client.put_item.call_args.kwargs["Item"]
+        self.assertEqual(item["callbackUrl"], "https://example.com/callback")
+        self.assertEqual(get_job_search_overrides(item), {"MaxFaces": 1})
+        entries = self.queue_client.send_message_batch.call_args.kwargs["Entries"]
+        chunks = [json.loads(entry["MessageBody"]) for entry in entries]
+        self.assertEqual([chunk["chunk"] for chunk in chunks], [0, 1])
+        self.assertEqual([entry["id"] for entry in chunks[0]["images"]], ["a", "b"])
+        self.assertEqual(chunks[0]["images"][1]["error"], "image is not base64 encoded")
+
+    def test_create_job_callback_url(self):
+        """Test that only https callbacks to a public host name are allowed."""
+        for callback_url in [
+            "http://example.com/callback",
+            "https:///callback",
+            "https://example.com:https/callback",
+            "https://10.0.0.1/callback",
+            "https://169.254.169.254/latest/meta-data",
+            "https://[::1]/callback",
+            "https://localhost/callback",
+            "https://intranet/callback",
+        ]:
+            with self.assertRaises(RekognitionValueError, msg=callback_url):
+                create_job([("a", b"first")], callback_url=callback_url)
+        self.s3_client.put_object.assert_not_called()
+
+    @patch("rekognition_api.jobs.get_callback_opener")
+    @patch("rekognition_api.jobs.socket.getaddrinfo")
+    def test_send_job_callback_private_address(self, mock_getaddrinfo, mock_get_callback_opener):
+        """Test that a callback is only POSTed to the public address that its host name was validated with."""
+        job = {"JobId": "job", "status": JOB_STATUS_SUCCEEDED, "callbackUrl": "https://example.com/callback"}
+        mock_getaddrinfo.return_value = [(None, None, None, "", ("10.0.0.1", 443))]
+        with patch("rekognition_api.jobs.get_job_status", return_value={"jobId": "job"}):
+            send_job_callback(job)
+        mock_get_callback_opener.assert_not_called()
+
+        mock_getaddrinfo.return_value = [(None, None, None, "", ("93.184.215.14", 443))]
+        mock_get_callback_opener.return_value.open.return_value.__enter__.return_value.status = 200
+        with patch("rekognition_api.jobs.get_job_status", return_value={"jobId": "job"}):
+            send_job_callback(job)
+        mock_get_callback_opener.assert_called_once_with("93.184.215.14")
+        mock_get_callback_opener.return_value.open.assert_called_once()
+
+    @patch("builtins.print")
+    @patch("rekognition_api.jobs.get_callback_opener")
+    @patch("rekognition_api.jobs.socket.getaddrinfo")
+    def test_send_job_callback_redirect(self, mock_getaddrinfo, mock_get_callback_opener, mock_print):
+        """Test that a redirect is a failed callback, and that the callback opener never follows one."""
+        job = {"JobId": "job", "status": JOB_STATUS_SUCCEEDED, "callbackUrl": "https://example.com/callback"}
+        mock_getaddrinfo.return_value = [(None, None, None, "", ("93.184.215.14", 443))]
+        mock_get_callback_opener.return_value.open.return_value.__enter__.return_value.status = 302
+        with patch("rekognition_api.jobs.get_job_status", return_value={"jobId": "job"}):
+            send_job_callback(job)
+        self.assertIn("HTTP 302", json.loads(mock_print.call_args.args[0])["error"])
+
+        handlers = get_callback_opener("93.184.215.14").handlers
+        self.assertFalse(any(isinstance(handler, urllib.request.HTTPRedirectHandler) for handler in handlers))
+
+    @patch("rekognition_api.jobs.socket.create_connection")
+    def test_pinned_https_connection(self, mock_create_connection):
+        """Test that a callback connects to the validated address, and verifies the certificate of the host name."""
+        context = MagicMock()
+        connection = PinnedHTTPSConnection("example.com", timeout=5, context=context, address="93.184.215.14")
+        connection.connect()
+        self.assertEqual(mock_create_connection.call_args.args[0], ("93.184.215.14", 443))
+        context.wrap_socket.assert_called_once_with(mock_create_connection.return_value, server_hostname="example.com")
+
+    def test_finish_job_chunk(self):
+        """Test that only the last chunk finishes the job, and that searched images are deleted."""
+        job = {"JobId": "job", "chunkCount": 2}
+        images = [{"id": "a", "key": "search-jobs/job/images/00000"}, {"id": "b", "error": "bad image"}]
+        self.jobs_client.update_item.return_value = {"Attributes": {"chunksDone": {"0"}}}
+
+        self.assertIsNone(finish_job_chunk(job, 0, images, [{"id": "a", "statusCode": 200}]))
+        self.jobs_client.update_item.assert_called_once()
+        self.s3_client.delete_objects.assert_called_once_with(
+            Bucket="bucket", Delete={"Objects": [{"Key": "search-jobs/job/images/00000"}], "Quiet": True}
+        )
+
+        finished = {"JobId": "job", "status": JOB_STATUS_SUCCEEDED}
+        self.jobs_client.update_item.side_effect = [
+            {"Attributes": {"chunksDone": {"0", "1"}}},
+            {"Attributes": finished},
+        ]
+        self.assertEqual(finish_job_chunk(job, 1, [], []), finished)
+
+        # a redelivered last chunk doesn't finish the job twice
+        self.jobs_client.update_item.side_effect = [
+            {"Attributes": {"chunksDone": {"0", "1"}}},
+            ConditionalCheckFailedException(),
+        ]
+        self.assertIsNone(finish_job_chunk(job, 1, [], []))
+
+    def test_get_job_status(self):
+        """Test that the results of a finished job are returned in the order of its images."""
+        self.objects[get_job_results_key("job", 0)] = json.dumps([{"id": "a"}, {"id": "b"}]).encode()
+        self.objects[get_job_results_key("job", 1)] = json.dumps([{"id": "c"}]).encode()
+        job = {
+            "JobId": "job",
+            "status": JOB_STATUS_SUCCEEDED,
+            "imageCount": 3,
+            "chunkCount": 2,
+            "chunksDone": {"0", "1"},
+            "createdAt": 1700000000,
+            "finishedAt": 1700000060,
+        }
+
+        status = get_job_status(job, results=True)
+
+        self.assertEqual([result["id"] for result in status["results"]], ["a", "b", "c"])
+        self.assertEqual(status["chunksDone"], 2)
+        self.assertNotIn("results", get_job_status(dict(job, status="RUNNING"), results=True))
@@ -4,9 +4,12 @@
 """Test Index Lambda function."""
 
 # python stuff
+import copy
+import json
 import os
 import sys
 import unittest
+from unittest.mock import patch
 
 
 HERE = os.path.abspath(os.path.dirname(__file__))
@@ -18,10 +21,14 @@ from rekognition_api.exceptions import RekognitionIlligalInvocationError  # noqa
 from rekognition_api.lambda_index import (  # noqa: E402
     get_bucket_name,
     get_records,
+    is_sqs_event,
+    lambda_handler,
+    persist_faceprints,
     validate_event,
 )
 
 # our stuff
+from rekognition_api.s3 import S3ObjectDescriptor  # noqa: E402
 from rekognition_api.tests.test_setup import get_test_file  # noqa: E402
 
 
@@ -32,9 +39,28 @@ class TestLambdaIndex(unittest.TestCase):
     event = get_test_file("json/apigateway_index_lambda_event.json")
     event = event["event"]
     response = get_test_file("json/apigateway_index_lambda_response.json")
+    sqs_event = get_test_file("json/apigateway_index_lambda_event_sqs.json")["event"]
 
     def setUp(self):
         """Set up test fixtures."""
+        patches = {
+            "BatchWriter": None,
+            "get_ledger_entry": None,
+            "claim_ledger_entry": True,
+            "completed_ledger_entry": None,
+            "release_ledger_entry": None,
+            "bump_collection_version": None,
+        }
+        self.mocks = {}
+        for name, return_value in patches.items():
+            patcher = patch(f"rekognition_api.lambda_index.{name}")
+            self.mocks[name] = patcher.start()
+            if return_value is not None:
+                self.mocks[name].return_value = return_value
+            self.addCleanup(patcher.stop)
+        self.mocks["get_ledger_entry"].return_value = None
+        self.mocks["BatchWriter"].return_value.stats = {}
+        self.mocks["BatchWriter"].return_value.failed_owners = set()
 
     def get_event(self, event):
         """Get the event json from the mock file."""
@@ -66,3 +92,211 @@ class TestLambdaIndex(unittest.TestCase):
         event = self.get_event(event)
         retval = validate_event(event)
         self.assertEqual(retval["statusCode"], 500)
+
+    def multi_record_event(self, keys):
+        """Return a copy of the mock event with one record per key."""
+        event = copy.deepcopy(self.event)
+        template = event["Records"][0]
+        event["Records"] = []
+        for key in keys:
+            record = copy.deepcopy(template)
+            record["s3"]["object"]["key"] = key
+            event["Records"].append(record)
+        return event
+
+    @patch("rekognition_api.lambda_index.S3ObjectDescriptor")
+    @patch("rekognition_api.lambda_index.persist_faceprints")
+    @patch("rekognition_api.lambda_index.get_faces")
+    def test_lambda_handler_indexes_every_record(self, mock_get_faces, mock_persist_faceprints, mock_descriptor):
+        """Test that lambda_handler indexes all records, not just the first one."""
+        keys = ["Keanu-Reeves.jpg", "Jim-Carrey.jpg", "Mike-Meyers.jpg"]
+        event = self.multi_record_event(keys)
+        mock_get_faces.return_value = {"FaceRecords": []}
+
+        retval = lambda_handler(event, None)
+        body = json.loads(retval["body"])
+
+        self.assertEqual(retval["statusCode"], 200)
+        self.assertEqual(mock_get_faces.call_count, len(keys))
+        self.assertEqual(mock_persist_faceprints.call_count, len(keys))
+        self.assertEqual(mock_descriptor.from_record.call_count, len(keys))
+        self.assertEqual([result["key"] for result in body["records"]], keys)
+
+    @patch("rekognition_api.lambda_index.S3ObjectDescriptor")
+    @patch("rekognition_api.lambda_index.persist_faceprints")
+    @patch("rekognition_api.lambda_index.get_faces")
+    def test_new_faces_invalidate_search_cache(self, mock_get_faces, _mock_persist_faceprints, _mock_descriptor):
+        """Test that the collection version is bumped once per batch, and only if new faces were indexed."""
+        event = self.multi_record_event(["Keanu-Reeves.jpg", "Jim-Carrey.jpg"])
+        mock_get_faces.return_value = {"FaceRecords": []}
+        lambda_handler(event, None)
+        self.mocks["bump_collection_version"].assert_not_called()
+
+        mock_get_faces.return_value = {"FaceRecords": [{"Face": {"FaceId": "new-face"}}]}
+        lambda_handler(event, None)
+        self.mocks["bump_collection_version"].assert_called_once_with()
+
+    @patch("rekognition_api.lambda_index.S3ObjectDescriptor")
+    @patch("rekognition_api.lambda_index.persist_faceprints")
+    @patch("rekognition_api.lambda_index.get_faces")
+    def test_lambda_handler_partial_failure(self, mock_get_faces, mock_persist_faceprints, _mock_descriptor):
+        """Test that one failed record does not prevent the others from being indexed."""
+        keys = ["Keanu-Reeves.jpg", "Jim-Carrey.jpg"]
+        event = self.multi_record_event(keys)
+        mock_get_faces.return_value = {"FaceRecords": []}
+        mock_persist_faceprints.side_effect = [ValueError("boom"), None]
+
+        retval = lambda_handler(event, None)
+        body = json.loads(retval["body"])
+
+        self.assertEqual(retval["statusCode"], 207)
+        self.assertEqual(sorted(result["statusCode"] for result in body["records"]), [200, 500])
+
+    @patch("rekognition_api.lambda_index.BatchWriter")
+    def test_persist_faceprints_display_name(self, mock_batch_writer):
+        """Test that each faceprint is stored with the display name that lambda_search returns for it."""
+        s3_object = S3ObjectDescriptor(bucket="bucket", key="Keanu-Reeves.jpg")
+        faces = {"FaceRecords": [{"Face": {"FaceId": "keanu", "ExternalImageId": "Keanu-Reeves.jpg"}}]}
+
+        persist_faceprints(s3_object, faces)
+
+        item = mock_batch_writer.return_value.put_item.call_args.args[0]
+        self.assertEqual(item["DisplayName"], "Keanu reeves")
+        self.assertEqual(item["key"], "Keanu-Reeves.jpg")
+        mock_batch_writer.return_value.flush.assert_called_once_with()
+
+    def test_validate_sqs_event(self):
+        """Test validate_event with an SQS envelope."""
+        self.assertTrue(is_sqs_event(self.sqs_event))
+        self.assertFalse(is_sqs_event(self.event))
+        self.assertTrue(validate_event(self.sqs_event))
+
+        event = copy.deepcopy(self.sqs_event)
+        del event["Records"][0]["body"]
+        retval = validate_event(event)
+        self.assertEqual(retval["statusCode"], 500)
+
+    @patch("rekognition_api.lambda_index.S3ObjectDescriptor")
+    @patch("rekognition_api.lambda_index.persist_faceprints")
+    @patch("rekognition_api.lambda_index.get_faces")
+    def test_lambda_handler_sqs_batch_item_failures(self, mock_get_faces, _mock_persist_faceprints, mock_descriptor):
+        """Test that only the SQS messages of images that failed with a retryable error are reported for retry."""
+        event = copy.deepcopy(self.sqs_event)
+        event["Records"].append(dict(event["Records"][0], messageId="bad-message", body="not json"))
+        mock_descriptor.from_record.side_effect = lambda record: record["s3"]["object"]["key"]
+        mock_get_faces.side_effect = lambda key: (
+            {"statusCode": 500, "body": json.dumps({"error": "boom"})}
+            if key == "Jim-Carrey.jpg"
+            else {"FaceRecords": []}
+        )
+
+        retval = lambda_handler(event, None)
+
+        failed = [item["itemIdentifier"] for item in retval["batchItemFailures"]]
+        self.assertEqual(failed, [event["Records"][1]["messageId"], "bad-message"])
+        self.assertEqual(mock_get_faces.call_count, 2)
+
+        # an image that can never be indexed is consumed rather than redelivered
+        mock_get_faces.side_effect = lambda key: {"statusCode": 406, "body": json.dumps({"error": "not an image"})}
+        retval = lambda_handler(event, None)
+        failed = [item["itemIdentifier"] for item in retval["batchItemFailures"]]
+        self.assertEqual(failed, ["bad-message"])
+
+    @patch("rekognition_api.lambda_index.S3ObjectDescriptor")
+    @patch("rekognition_api.lambda_index.persist_faceprints")
+    @patch("rekognition_api.lambda_index.get_faces")
+    def test_lambda_handler_skips_indexed_objects(self, mock_get_faces, mock_persist_faceprints, mock_descriptor):
+        """Test that an already indexed (bucket, key, ETag) costs one ledger read and nothing else."""
+        self.mocks["get_ledger_entry"].return_value = {"status": "COMPLETE", "FaceIds": ["abc"]}
+
+        retval = lambda_handler(self.event, None)
+        body = json.loads(retval["body"])
+
+        self.assertEqual(retval["statusCode"], 200)
+        self.assertEqual(body["records"][0]["body"]["FaceIds"], ["abc"])
+        record = self.event["Records"][0]
+        self.mocks["get_ledger_entry"].assert_called_once_with(
+            record["s3"]["bucket"]["name"], record["s3"]["object"]["key"], record["s3"]["object"]["eTag"]
+        )
+        mock_descriptor.from_record.assert_not_called()
+        mock_get_faces.assert_not_called()
+        mock_persist_faceprints.assert_not_called()
+
+    @patch("rekognition_api.lambda_index.S3ObjectDescriptor")
+    @patch("rekognition_api.lambda_index.persist_faceprints")
+    @patch("rekognition_api.lambda_index.get_faces")
+    def test_lambda_handler_releases_claim_on_failure(self, mock_get_faces, mock_persist_faceprints, _mock_descriptor):
+        """Test that a failed object is released from the ledger so that a retry can index it."""
+        mock_get_faces.return_value = {"FaceRecords": []}
+        mock_persist_faceprints.side_effect = ValueError("boom")
+
+        retval = lambda_handler(self.event, None)
+
+        self.assertEqual(retval["statusCode"], 207)
+        self.mocks["claim_ledger_entry"].assert_called_once()
+        self.mocks["release_ledger_entry"].assert_called_once()
+
+    @patch("rekognition_api.lambda_index.S3ObjectDescriptor")
+    @patch("rekognition_api.lambda_index.get_faces")
+    def test_lambda_handler_claim_in_progress(self, mock_get_faces, _mock_descriptor):
+        """Test that an object claimed by another invocation is retryable, and an indexed one is not."""
+        self.mocks["claim_ledger_entry"].return_value = False
+        self.mocks["get_ledger_entry"].side_effect = [None, {"status": "IN_PROGRESS"}]
+
+        body = json.loads(lambda_handler(self.event, None)["body"])
+        self.assertEqual(body["records"][0]["statusCode"], 409)
+
+        self.mocks["get_ledger_entry"].side_effect = [None, {"status": "COMPLETE", "FaceIds": ["abc"]}]
+        body = json.loads(lambda_handler(self.event, None)["body"])
+        self.assertEqual(body["records"][0]["statusCode"], 200)
+        self.assertEqual(body["records"][0]["body"]["FaceIds"], ["abc"])
+        mock_get_faces.assert_not_called()
+
+    @patch("rekognition_api.lambda_index.S3ObjectDescriptor")
+    @patch("rekognition_api.lambda_index.persist_faceprints")
+    @patch("rekognition_api.lambda_index.get_faces")
+    def test_lambda_handler_failed_write_batch(self, mock_get_faces, _mock_persist_faceprints, mock_descriptor):
+        """Test that every record of a batch that could not be written fails and is released."""
+        keys = ["Keanu-Reeves.jpg", "Jim-Carrey.jpg", "Mike-Meyers.jpg"]
+        event = self.multi_record_event(keys)
+        mock_get_faces.return_value = {"FaceRecords": []}
+        writer = self.mocks["BatchWriter"].return_value
+        writer.failed_owners = {0, 2}
+        writer.flush.side_effect = ValueError("boom")
+
+        retval = lambda_handler(event, None)
+        body = json.loads(retval["body"])
+
+        self.assertEqual(retval["statusCode"], 207)
+        self.assertEqual([result["statusCode"] for result in body["records"]], [500, 200, 500])
+        self.assertEqual(self.mocks["release_ledger_entry"].call_count, 2)
+        released = [c.kwargs["key"] for c in mock_descriptor.call_args_list]
+        self.assertEqual(released, ["Keanu-Reeves.jpg", "Mike-Meyers.jpg"])
+        writer.discard.assert_called_once_with({0, 2})
+
+    @patch("rekognition_api.lambda_index.link_content_entry")
+    @patch("rekognition_api.lambda_index.get_content_entry")
+    @patch("rekognition_api.lambda_index.hash_s3_object")
+    @patch("rekognition_api.lambda_index.S3ObjectDescriptor")
+    @patch("rekognition_api.lambda_index.get_faces")
+    @patch("rekognition_api.lambda_index.settings")
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    def test_lambda_handler_links_duplicate_content(
+        self, mock_settings, mock_get_faces, _mock_descriptor, mock_hash, mock_get_content_entry, mock_link
+    ):
+        """Test that an image with a known content hash is linked instead of indexed."""
+        mock_settings.dump = {}
+        mock_settings.debug_mode = False
+        mock_settings.aws_lambda_index_max_workers = 1
+        mock_settings.aws_lambda_index_idempotency = False
+        mock_settings.aws_lambda_index_content_dedup = True
+        mock_hash.return_value = "sha256:abc"
+        mock_get_content_entry.return_value = {"ContentHash": "sha256:abc", "FaceIds": ["face-1"]}
+
+        retval = lambda_handler(self.event, None)
+        body = json.loads(retval["body"])
+
+        self.assertEqual(retval["statusCode"], 200)
+        self.assertEqual(body["records"][0]["body"]["FaceIds"], ["face-1"])
+        mock_link.assert_called_once()
+        mock_get_faces.assert_not_called()
@@ -3,10 +3,13 @@
 """Test Search Lambda function."""
 
 # python stuff
+import base64
+import json
 import logging
 import os
 import sys
 import unittest
+from unittest.mock import patch
 
 
 logger = logging.getLogger(__file__)
@@ -16,8 +19,27 @@ if PYTHON_ROOT not in sys.path:
     sys.path.append(PYTHON_ROOT)  # noqa: E402
 
 # our stuff
+from rekognition_api.cache import FaceCache  # noqa: E402
 from rekognition_api.conf import settings  # noqa: E402
-from rekognition_api.lambda_search import get_faces, get_image_from_event  # noqa: E402
+from rekognition_api.exceptions import RekognitionValueError  # noqa: E402
+from rekognition_api.lambda_search import (  # noqa: E402
+    LEGACY_MATCHED_FACE_ATTRIBUTES,
+    MATCHED_FACE_ATTRIBUTES,
+    get_faces,
+    get_image_from_event,
+    get_matched_faces,
+    get_search_overrides,
+    get_search_params,
+    lambda_handler,
+    search_batch,
+    search_face_id,
+    search_faces_in_image,
+    search_image,
+    search_job_messages,
+    search_s3_image,
+)
+from rekognition_api.s3 import S3ObjectDescriptor  # noqa: E402
+from rekognition_api.search_cache import SearchResultCache  # noqa: E402
 from rekognition_api.tests.test_setup import (  # noqa: E402
     get_test_file,
     get_test_image,
@@ -41,14 +63,53 @@ class TestLambdaIndex(unittest.TestCase):
 
     def setUp(self):
         """Set up test fixtures."""
+        patcher = patch("rekognition_api.lambda_search.get_face_cache")
+        self.face_cache = FaceCache(max_entries=100, max_bytes=1024 * 1024, ttl_seconds=60)
+        patcher.start().return_value = self.face_cache
+        self.addCleanup(patcher.stop)
 
     def test_get_image_from_event(self):
-        """Test get_image_from_event."""
-        #     image_from_event = get_image_from_event(self.search_event)
+        """Test that a raw image/jpeg body is decoded once, from API Gateway's base64 encoding."""
+        event = {
+            "headers": {"Content-Type": "image/jpeg"},
+            "body": base64.b64encode(self.image).decode("ascii"),
+            "isBase64Encoded": True,
+        }
+        with patch("rekognition_api.lambda_search.prepare_image_bytes", side_effect=lambda image: {"Bytes": image}):
+            image_from_event = get_image_from_event(event)
 
-        #     self.assertEqual(image_from_event, self.image)
-        logger.debug("Not implemented")
-        assert True
+        self.assertEqual(image_from_event, {"Bytes": self.image})
+
+    @patch("rekognition_api.lambda_search.search_image")
+    @patch("rekognition_api.lambda_search.warm_up")
+    def test_lambda_handler_warmup(self, mock_warm_up, mock_search_image):
+        """Test that a warm-up primes the clients and returns without searching anything."""
+        mock_warm_up.return_value = {"warmup": {"dynamodb": 1.0}, "errors": {}}
+
+        retval = lambda_handler({"warmup": True}, None)
+
+        self.assertEqual(retval["statusCode"], 200)
+        self.assertEqual(set(mock_warm_up.call_args.args[0]), {"dynamodb", "rekognition", "s3", "search"})
+        mock_search_image.assert_not_called()
+
+    @patch("rekognition_api.lambda_search.search_image")
+    @patch("rekognition_api.lambda_search.is_face_cropping_available")
+    @patch("rekognition_api.lambda_search.settings")
+    def test_lambda_handler_multi_face_unavailable(
+        self, mock_settings, mock_is_face_cropping_available, mock_search_image
+    ):
+        """Test that a multi-face search fails closed with a 400 when Pillow is not installed."""
+        mock_settings.dump = {}
+        mock_settings.debug_mode = False
+        mock_settings.aws_rekognition_client.exceptions.InvalidParameterException = KeyError
+        mock_is_face_cropping_available.return_value = False
+        event = dict(self.search_event["event"], queryStringParameters={"mode": "multi"})
+
+        retval = lambda_handler(event, None)
+
+        self.assertEqual(retval["statusCode"], 400)
+        self.assertIn("Pillow", json.loads(retval["body"])["error"])
+        mock_search_image.assert_not_called()
 
     def test_get_faces(self):
         """Test get_faces."""
@@ -62,3 +123,295 @@ class TestLambdaIndex(unittest.TestCase):
         # faces = get_faces(self.image_packed)
         logger.debug("Not implemented")
         assert True
+
+    @patch("rekognition_api.lambda_search.batch_get_items")
+    def test_get_matched_faces(self, mock_batch_get_items):
+        """Test that matched faces are read with one batched lookup and keep the similarity order."""
+        faces = self.rekognition_search_output["faces"]
+        face_ids = [face["Face"]["FaceId"] for face in faces["FaceMatches"]]
+        # BatchGetItem returns items in no particular order, and not every face is in DynamoDB
+        mock_batch_get_items.return_value = {
+            face_id: {"FaceId": face_id, "DisplayName": f"Face {i}"}
+            for i, face_id in reversed(list(enumerate(face_ids)))
+        }
+        del mock_batch_get_items.return_value[face_ids[1]]
+
+        matched_faces = get_matched_faces(faces)
+
+        mock_batch_get_items.assert_called_once_with(face_ids, key_name="FaceId", projection=MATCHED_FACE_ATTRIBUTES)
+        expected = [f"Face {i}" for i in range(len(face_ids)) if i != 1]
+        self.assertEqual(matched_faces, expected)
+
+    @patch("rekognition_api.lambda_search.batch_get_items")
+    def test_get_matched_faces_legacy(self, mock_batch_get_items):
+        """Test that faceprints without a DisplayName, indexed before it was stored, still get a name."""
+        faces = self.rekognition_search_output["faces"]
+        face_ids = [face["Face"]["FaceId"] for face in faces["FaceMatches"]]
+        mock_batch_get_items.side_effect = [
+            {face_ids[0]: {"FaceId": face_ids[0], "DisplayName": "Keanu reeves"}, face_ids[1]: {"FaceId": face_ids[1]}},
+            {face_ids[1]: {"FaceId": face_ids[1], "ExternalImageId": "Lawrence4.jpg"}},
+        ]
+
+        matched_faces = get_matched_faces(faces)
+
+        self.assertEqual(matched_faces, ["Keanu reeves", "Lawrence4"])
+        self.assertEqual(mock_batch_get_items.call_args_list[1].args[0], [face_ids[1]])
+        self.assertEqual(mock_batch_get_items.call_args.kwargs["projection"], LEGACY_MATCHED_FACE_ATTRIBUTES)
+
+    @patch("rekognition_api.lambda_search.batch_get_items")
+    def test_get_matched_faces_cached(self, mock_batch_get_items):
+        """Test that a warm container reads each FaceId from DynamoDB once, including FaceIds without a row."""
+        faces = self.rekognition_search_output["faces"]
+        face_ids = [face["Face"]["FaceId"] for face in faces["FaceMatches"]]
+        mock_batch_get_items.return_value = {
+            face_id: {"FaceId": face_id, "DisplayName": "Keanu reeves"} for face_id in face_ids[1:]
+        }
+
+        first = get_matched_faces(faces)
+        second = get_matched_faces(faces)
+
+        self.assertEqual(first, second)
+        self.assertEqual(len(first), len(face_ids) - 1)
+        mock_batch_get_items.assert_called_once()
+        self.assertEqual(self.face_cache.stats["hits"], len(face_ids))
+        self.assertEqual(self.face_cache.stats["negativeHits"], 1)
+
+    @patch("rekognition_api.lambda_search.get_search_cache")
+    @patch("rekognition_api.lambda_search.get_matched_faces")
+    @patch("rekognition_api.lambda_search.get_faces")
+    @patch("rekognition_api.lambda_search.settings")
+    def test_search_image_cached(self, mock_settings, mock_get_faces, mock_get_matched_faces, mock_get_search_cache):
+        """Test that a resubmitted image is served by the search result cache."""
+        mock_settings.aws_lambda_search_result_cache = True
+        mock_settings.aws_rekognition_collection_id = "collection"
+        mock_settings.aws_rekognition_face_detect_max_faces_count = 10
+        mock_settings.aws_rekognition_face_detect_threshold = 80
+        mock_settings.aws_rekognition_face_detect_quality_filter = "AUTO"
+        mock_get_faces.return_value = self.rekognition_search_output["faces"]
+        mock_get_matched_faces.return_value = ["Keanu reeves"]
+        search_cache = SearchResultCache(
+            "searchcache", 60, max_entries=10, max_bytes=1024 * 1024, version_ttl_seconds=60
+        )
+        mock_get_search_cache.return_value = search_cache
+        with patch("rekognition_api.search_cache.batch_get_items", return_value={}):
+            with patch("rekognition_api.search_cache.get_search_cache_client"):
+                first = search_image(self.image)
+                second = search_image(self.image)
+
+        self.assertEqual(first, second)
+        mock_get_faces.assert_called_once()
+        self.assertEqual(search_cache.stats["memoryHits"], 1)
+
+    @patch("rekognition_api.lambda_search.settings")
+    def test_search_overrides(self, mock_settings):
+        """Test that a request can narrow the search, but not widen it beyond the deployment's settings."""
+        mock_settings.aws_rekognition_collection_id = "collection"
+        mock_settings.aws_rekognition_face_detect_max_faces_count = 10
+        mock_settings.aws_rekognition_face_detect_threshold = 80
+        mock_settings.aws_rekognition_face_detect_quality_filter = "AUTO"
+        event = {"queryStringParameters": {"maxFaces": "1", "threshold": "95.5", "qualityFilter": "high"}}
+
+        overrides = get_search_overrides(event)
+        self.assertEqual(overrides, {"MaxFaces": 1, "FaceMatchThreshold": 95.5, "QualityFilter": "HIGH"})
+        self.assertEqual(get_search_params(overrides)["CollectionId"], "collection")
+        self.assertEqual(get_search_overrides(event, body={"maxFaces": 3})["MaxFaces"], 3)
+        self.assertEqual(get_search_overrides({"queryStringParameters": None}), {})
+        self.assertEqual(get_search_params()["MaxFaces"], 10)
+
+        for query in [
+            {"maxFaces": "11"},
+            {"maxFaces": "0"},
+            {"maxFaces": "one"},
+            {"threshold": "50"},
+            {"threshold": "101"},
+            {"qualityFilter": "NONE"},
+            {"qualityFilter": "BEST"},
+        ]:
+            with self.assertRaises(RekognitionValueError):
+                get_search_overrides({"queryStringParameters": query})
+
+        # NONE < AUTO, LOW < MEDIUM < HIGH
+        mock_settings.aws_rekognition_face_detect_quality_filter = "HIGH"
+        for value in ["NONE", "AUTO", "LOW", "MEDIUM"]:
+            with self.assertRaises(RekognitionValueError):
+                get_search_overrides({"queryStringParameters": {"qualityFilter": value}})
+        self.assertEqual(
+            get_search_overrides({"queryStringParameters": {"qualityFilter": "high"}})["QualityFilter"], "HIGH"
+        )
+        mock_settings.aws_rekognition_face_detect_quality_filter = "LOW"
+        self.assertEqual(
+            get_search_overrides({"queryStringParameters": {"qualityFilter": "AUTO"}})["QualityFilter"], "AUTO"
+        )
+
+    @patch("rekognition_api.lambda_search.put_cached_search")
+    @patch("rekognition_api.lambda_search.get_cached_search", return_value=(None, None, None))
+    @patch("rekognition_api.lambda_search.batch_get_items")
+    @patch("rekognition_api.lambda_search.get_rekognition_client")
+    def test_search_face_id(
+        self, mock_get_rekognition_client, mock_batch_get_items, _mock_get_cached, _mock_put_cached
+    ):
+        """Test that an indexed face is searched by its FaceId, with the same batched faceprint lookup."""
+        faces = dict(self.rekognition_search_output["faces"], SearchedFaceId="11111111-2222-3333-4444-555555555555")
+        face_ids = [face["Face"]["FaceId"] for face in faces["FaceMatches"]]
+        mock_get_rekognition_client.return_value.search_faces.return_value = faces
+        mock_batch_get_items.return_value = {face_ids[0]: {"FaceId": face_ids[0], "DisplayName": "Keanu reeves"}}
+
+        retval = search_face_id(faces["SearchedFaceId"])
+
+        kwargs = mock_get_rekognition_client.return_value.search_faces.call_args.kwargs
+        self.assertEqual(kwargs["FaceId"], faces["SearchedFaceId"])
+        self.assertNotIn("QualityFilter", kwargs)
+        mock_batch_get_items.assert_called_once()
+        self.assertEqual(retval["matchedFaces"], ["Keanu reeves"])
+
+        with self.assertRaises(RekognitionValueError):
+            search_face_id("Keanu-Reeves.jpg")
+
+    @patch("rekognition_api.lambda_search.prepare_s3_image")
+    @patch("rekognition_api.lambda_search.get_matched_faces")
+    @patch("rekognition_api.lambda_search.get_faces")
+    @patch("rekognition_api.lambda_search.S3ObjectDescriptor")
+    @patch("rekognition_api.lambda_search.settings")
+    def test_search_s3_image(
+        self, mock_settings, mock_s3_object_descriptor, mock_get_faces, mock_get_matched_faces, mock_prepare_s3_image
+    ):
+        """Test that an image in S3 is passed to Rekognition by reference, rather than read into the Lambda."""
+        mock_settings.aws_lambda_search_result_cache = False
+        s3_object = S3ObjectDescriptor(bucket="bucket", key="search-uploads/abc", etag="etag")
+        mock_s3_object_descriptor.head.return_value = s3_object
+        mock_prepare_s3_image.side_effect = lambda s3_object: s3_object.rekognition_image
+        mock_get_faces.return_value = self.rekognition_search_output["faces"]
+        mock_get_matched_faces.return_value = ["Keanu reeves"]
+
+        retval = search_s3_image("bucket", "search-uploads/abc")
+
+        mock_s3_object_descriptor.head.assert_called_once_with("bucket", "search-uploads/abc")
+        mock_get_faces.assert_called_once_with(
+            {"S3Object": {"Bucket": "bucket", "Name": "search-uploads/abc"}}, search_params=None
+        )
+        self.assertEqual(retval["matchedFaces"], ["Keanu reeves"])
+
+    @patch("rekognition_api.lambda_search.batch_get_items")
+    @patch("rekognition_api.lambda_search.crop_faces")
+    @patch("rekognition_api.lambda_search.get_faces")
+    @patch("rekognition_api.lambda_search.get_rekognition_client")
+    @patch("rekognition_api.lambda_search.settings")
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    def test_search_faces_in_image(
+        self, mock_settings, mock_get_rekognition_client, mock_get_faces, mock_crop_faces, mock_batch_get_items
+    ):
+        """Test that every detected face is searched, up to the cap, and that matches are grouped per face."""
+        mock_settings.aws_lambda_search_multi_face_max_faces = 2
+        mock_settings.aws_lambda_search_multi_face_max_workers = 4
+        mock_settings.aws_rekognition_client.exceptions.InvalidParameterException = KeyError
+        small, large, medium = (
+            {"BoundingBox": {"Left": 0, "Top": 0, "Width": width, "Height": width}, "Confidence": 99.0}
+            for width in (0.1, 0.5, 0.3)
+        )
+        mock_get_rekognition_client.return_value.detect_faces.return_value = {"FaceDetails": [small, large, medium]}
+        mock_crop_faces.side_effect = lambda image, bounding_boxes: [
+            str(box["Width"]).encode() for box in bounding_boxes
+        ]
+        matches = {
+            b"0.5": {"FaceMatches": [{"Face": {"FaceId": "keanu"}}, {"Face": {"FaceId": "unknown"}}]},
+            b"0.3": {"FaceMatches": [{"Face": {"FaceId": "lawrence"}}]},
+        }
+        mock_get_faces.side_effect = lambda image, search_params=None: matches[image["Bytes"]]
+        mock_batch_get_items.return_value = {
+            "keanu": {"FaceId": "keanu", "DisplayName": "Keanu reeves"},
+            "lawrence": {"FaceId": "lawrence", "DisplayName": "Lawrence4"},
+        }
+
+        retval = search_faces_in_image({"Bytes": self.image})
+
+        self.assertEqual(retval["detectedFaces"], 3)
+        self.assertEqual([face["BoundingBox"]["Width"] for face in retval["faces"]], [0.5, 0.3])
+        self.assertEqual([face["matchedFaces"] for face in retval["faces"]], [["Keanu reeves"], ["Lawrence4"]])
+        self.assertEqual(retval["matchedFaces"], ["Keanu reeves", "Lawrence4"])
+        mock_get_rekognition_client.return_value.detect_faces.assert_called_once()
+        mock_batch_get_items.assert_called_once()
+
+    @patch("rekognition_api.lambda_search.batch_get_items")
+    @patch("rekognition_api.lambda_search.prepare_image_bytes")
+    @patch("rekognition_api.lambda_search.get_faces")
+    @patch("rekognition_api.lambda_search.settings")
+    def test_search_batch(self, mock_settings, mock_get_faces, mock_prepare_image_bytes, mock_batch_get_items):
+        """Test that a batch shares one faceprint lookup and that errors fail only their own image."""
+        mock_settings.aws_lambda_search_result_cache = False
+        mock_settings.aws_lambda_search_batch_max_workers = 4
+        mock_settings.aws_rekognition_client.exceptions.InvalidParameterException = KeyError
+        mock_prepare_image_bytes.side_effect = lambda image_bytes: {"Bytes": image_bytes}
+        matches = {
+            b"keanu": {"FaceMatches": [{"Face": {"FaceId": "keanu"}}, {"Face": {"FaceId": "unknown"}}]},
+            b"lawrence": {"FaceMatches": [{"Face": {"FaceId": "lawrence"}}]},
+        }
+        mock_get_faces.side_effect = lambda image, search_params=None: matches[image["Bytes"]]
+        mock_batch_get_items.return_value = {
+            "keanu": {"FaceId": "keanu", "DisplayName": "Keanu reeves"},
+            "lawrence": {"FaceId": "lawrence", "DisplayName": "Lawrence4"},
+        }
+        images = [
+            ("a", b"keanu"),
+            ("b", RekognitionValueError("image is not base64 encoded")),
+            ("c", b"no-face"),
+            ("d", b"lawrence"),
+        ]
+
+        results = search_batch(images)
+
+        self.assertEqual([result["id"] for result in results], ["a", "b", "c", "d"])
+        self.assertEqual([result["statusCode"] for result in results], [200, 400, 400, 200])
+        self.assertEqual(results[0]["matchedFaces"], ["Keanu reeves"])
+        self.assertEqual(results[3]["matchedFaces"], ["Lawrence4"])
+        self.assertIn("base64", results[1]["error"])
+        mock_batch_get_items.assert_called_once()
+        self.assertEqual(sorted(mock_batch_get_items.call_args.args[0]), ["keanu", "lawrence", "unknown"])
+
+    @patch("rekognition_api.lambda_search.send_job_callback")
+    @patch("rekognition_api.lambda_search.fail_job")
+    @patch("rekognition_api.lambda_search.finish_job_chunk")
+    @patch("rekognition_api.lambda_search.search_batch")
+    @patch("rekognition_api.lambda_search.load_job_images")
+    @patch("rekognition_api.lambda_search.start_job_chunk")
+    @patch("rekognition_api.lambda_search.settings")
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    def test_search_job_messages(
+        self,
+        mock_settings,
+        mock_start_job_chunk,
+        mock_load_job_images,
+        mock_search_batch,
+        mock_finish_job_chunk,
+        mock_fail_job,
+        mock_send_job_callback,
+    ):
+        """Test that a failed chunk is redelivered, and fails its job on its last delivery."""
+        mock_settings.aws_lambda_search_jobs_max_receive_count = 3
+        mock_start_job_chunk.side_effect = lambda job_id: {"JobId": job_id, "multiFace": False}
+        mock_load_job_images.side_effect = lambda images: [(image["id"], b"image") for image in images]
+        mock_search_batch.side_effect = [[{"id": "a", "statusCode": 200}], ValueError("S3 is down")]
+        mock_finish_job_chunk.return_value = {"JobId": "done"}
+        mock_fail_job.return_value = {"JobId": "failed"}
+        chunk = {"chunk": 0, "images": [{"id": "a", "key": "search-jobs/job/images/00000"}]}
+        event = {
+            "Records": [
+                {
+                    "messageId": "ok",
+                    "eventSource": "aws:sqs",
+                    "body": json.dumps(dict(chunk, jobId="done")),
+                    "attributes": {"ApproximateReceiveCount": "1"},
+                },
+                {
+                    "messageId": "bad",
+                    "eventSource": "aws:sqs",
+                    "body": json.dumps(dict(chunk, jobId="failed")),
+                    "attributes": {"ApproximateReceiveCount": "3"},
+                },
+            ]
+        }
+
+        response = search_job_messages(event)
+
+        self.assertEqual(response, {"batchItemFailures": [{"itemIdentifier": "bad"}]})
+        mock_fail_job.assert_called_once_with("failed", "S3 is down")
+        self.assertEqual([call.args[0]["JobId"] for call in mock_send_job_callback.call_args_list], ["done", "failed"])
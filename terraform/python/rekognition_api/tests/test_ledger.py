@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=wrong-import-position
+"""Test the lambda_index idempotency ledger."""
+
+# python stuff
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+PYTHON_ROOT = os.path.dirname(os.path.dirname(HERE))
+if PYTHON_ROOT not in sys.path:
+    sys.path.append(PYTHON_ROOT)  # noqa: E402
+
+# our stuff
+from rekognition_api.ledger import (  # noqa: E402
+    claim_ledger_entry,
+    completed_ledger_entry,
+    get_ledger_id,
+    is_indexed,
+)
+from rekognition_api.s3 import S3ObjectDescriptor  # noqa: E402
+
+
+class ConditionalCheckFailedException(Exception):
+    """Stand-in for the botocore modeled exception."""
+
+
+class TestLedger(unittest.TestCase):
+    """Test the idempotency ledger."""
+
+    s3_object = S3ObjectDescriptor(bucket="bucket", key="Keanu-Reeves.jpg", etag="c9230f7b")
+
+    def test_ledger_id(self):
+        """Test that the ledger is keyed on bucket, key and ETag."""
+        self.assertEqual(
+            get_ledger_id("bucket", "Keanu-Reeves.jpg", "c9230f7b"), "s3://bucket/Keanu-Reeves.jpg#c9230f7b"
+        )
+
+    def test_is_indexed(self):
+        """Test is_indexed."""
+        self.assertFalse(is_indexed(None))
+        self.assertFalse(is_indexed({"status": "IN_PROGRESS"}))
+        self.assertTrue(is_indexed(completed_ledger_entry(self.s3_object, ["abc"])))
+
+    @patch("rekognition_api.ledger.get_ledger_client")
+    def test_claim(self, mock_get_ledger_client):
+        """Test that a claim is a conditional put, and that losing the race returns False."""
+        client = mock_get_ledger_client.return_value
+        client.exceptions.ConditionalCheckFailedException = ConditionalCheckFailedException
+        self.assertTrue(claim_ledger_entry(self.s3_object))
+        self.assertIn("attribute_not_exists(LedgerId)", client.put_item.call_args.kwargs["ConditionExpression"])
+
+        client.put_item.side_effect = ConditionalCheckFailedException()
+        self.assertFalse(claim_ledger_entry(self.s3_object))
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=wrong-import-position
+"""Test the collection rebuild command."""
+
+# python stuff
+import os
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+PYTHON_ROOT = os.path.dirname(os.path.dirname(HERE))
+if PYTHON_ROOT not in sys.path:
+    sys.path.append(PYTHON_ROOT)  # noqa: E402
+
+# our stuff
+from rekognition_api.exceptions import RekognitionValueError  # noqa: E402
+from rekognition_api.rebuild import CollectionRebuild, RebuildCheckpoint  # noqa: E402
+
+
+def scan(**kwargs):
+    """Stand-in for DynamoDB Scan. Segment 0 has two pages, and rows of the same image appear in both segments."""
+    pages = {
+        (0, None): {
+            "Items": [{"bucket": "bucket", "key": "a.jpg"}, {"bucket": "bucket", "key": "a.jpg"}],
+            "LastEvaluatedKey": {"FaceId": "face-2"},
+        },
+        (0, "face-2"): {"Items": [{"bucket": "bucket", "key": "b.jpg"}]},
+        (1, None): {"Items": [{"bucket": "bucket", "key": "b.jpg"}, {"FaceId": "no-image"}]},
+    }
+    start = kwargs.get("ExclusiveStartKey", {}).get("FaceId")
+    return pages[(kwargs["Segment"], start)]
+
+
+@patch("rekognition_api.rebuild.ensure_collection")
+@patch("rekognition_api.rebuild.BatchWriter")
+@patch("rekognition_api.rebuild.persist_faceprints")
+@patch("rekognition_api.rebuild.get_faces")
+@patch("rekognition_api.rebuild.get_scan_client")
+class TestRebuild(unittest.TestCase):
+    """Test the collection rebuild command."""
+
+    def setUp(self):
+        """Set up a temporary checkpoint file, and keep the search result cache out of the way."""
+        handle, self.checkpoint_path = tempfile.mkstemp(suffix=".jsonl")
+        os.close(handle)
+        os.remove(self.checkpoint_path)
+        self.addCleanup(lambda: os.path.exists(self.checkpoint_path) and os.remove(self.checkpoint_path))
+        patcher = patch("rekognition_api.rebuild.bump_collection_version")
+        self.mock_bump_collection_version = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    def test_rebuild_indexes_each_image_once(
+        self, mock_get_scan_client, mock_get_faces, mock_persist, mock_batch_writer, mock_ensure_collection
+    ):
+        """Test that every image is indexed into the target collection exactly once."""
+        mock_get_scan_client.return_value.scan.side_effect = scan
+        mock_get_faces.return_value = {"FaceRecords": [{"Face": {"FaceId": "new-face"}}]}
+        mock_batch_writer.return_value.stats = {}
+
+        rebuild = CollectionRebuild("target", total_segments=2, checkpoint_path=self.checkpoint_path)
+        stats = rebuild.run()
+
+        indexed = sorted(call.args[0].key for call in mock_get_faces.call_args_list)
+        self.assertEqual(indexed, ["a.jpg", "b.jpg"])
+        self.assertEqual({call.kwargs["collection_id"] for call in mock_get_faces.call_args_list}, {"target"})
+        self.assertEqual(mock_persist.call_count, 2)
+        self.assertEqual(stats["images"], 2)
+        self.assertEqual(stats["faces"], 2)
+        mock_ensure_collection.assert_called_once_with("target")
+        self.mock_bump_collection_version.assert_called_once_with("target")
+
+        checkpoint = RebuildCheckpoint(self.checkpoint_path)
+        self.assertTrue(all(state["done"] for state in checkpoint.segments.values()))
+        self.assertEqual(checkpoint.statuses, {"s3://bucket/a.jpg": 200, "s3://bucket/b.jpg": 200})
+
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    def test_rebuild_resumes_from_checkpoint(
+        self, mock_get_scan_client, mock_get_faces, _mock_persist, mock_batch_writer, _mock_ensure_collection
+    ):
+        """Test that a resumed rebuild continues each segment from its LastEvaluatedKey."""
+        checkpoint = RebuildCheckpoint(self.checkpoint_path)
+        checkpoint.save_page(0, 2, [({"bucket": "bucket", "key": "a.jpg"}, 200)], {"FaceId": "face-2"})
+        checkpoint.save_page(1, 2, [({"bucket": "bucket", "key": "b.jpg"}, 200)], None)
+        mock_get_scan_client.return_value.scan.side_effect = scan
+        mock_get_faces.return_value = {"FaceRecords": []}
+        mock_batch_writer.return_value.stats = {}
+
+        stats = CollectionRebuild("target", total_segments=2, checkpoint_path=self.checkpoint_path).run()
+
+        scan_calls = mock_get_scan_client.return_value.scan.call_args_list
+        self.assertEqual(len(scan_calls), 1)
+        self.assertEqual(scan_calls[0].kwargs["ExclusiveStartKey"], {"FaceId": "face-2"})
+        mock_get_faces.assert_not_called()
+        self.assertEqual(stats["images"], 0)
+
+        with self.assertRaises(RekognitionValueError):
+            CollectionRebuild("target", total_segments=4, checkpoint_path=self.checkpoint_path)
+
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    def test_rebuild_retries_failed_images(
+        self, mock_get_scan_client, mock_get_faces, _mock_persist, mock_batch_writer, _mock_ensure_collection
+    ):
+        """Test that a resumed rebuild indexes the images that failed again, even if their segment is done."""
+        item = {"bucket": "bucket", "key": "b.jpg", "metadata": {"name": "b"}}
+        checkpoint = RebuildCheckpoint(self.checkpoint_path)
+        checkpoint.save_page(0, 2, [({"bucket": "bucket", "key": "a.jpg"}, 200), (item, 500)], None)
+        checkpoint.save_page(1, 2, [], None)
+        mock_get_faces.return_value = {"FaceRecords": [{"Face": {"FaceId": "new-face"}}]}
+        mock_batch_writer.return_value.stats = {}
+
+        stats = CollectionRebuild("target", total_segments=2, checkpoint_path=self.checkpoint_path).run()
+
+        mock_get_scan_client.return_value.scan.assert_not_called()
+        mock_get_faces.assert_called_once()
+        self.assertEqual(mock_get_faces.call_args.args[0].metadata, {"name": "b"})
+        self.assertEqual((stats["images"], stats["faces"], stats["failed"]), (1, 1, 0))
+
+        checkpoint = RebuildCheckpoint(self.checkpoint_path)
+        self.assertEqual(checkpoint.statuses, {"s3://bucket/a.jpg": 200, "s3://bucket/b.jpg": 200})
+        self.assertEqual(checkpoint.failed, {})
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=wrong-import-position
+"""Test response shaping for the search API."""
+
+# python stuff
+import json
+import os
+import sys
+import unittest
+
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+PYTHON_ROOT = os.path.dirname(os.path.dirname(HERE))
+if PYTHON_ROOT not in sys.path:
+    sys.path.append(PYTHON_ROOT)  # noqa: E402
+
+# our stuff
+from rekognition_api.responses import (  # noqa: E402
+    get_response_options,
+    shape_search_response,
+)
+from rekognition_api.tests.test_setup import get_test_file  # noqa: E402
+from rekognition_api.utils import http_response_factory  # noqa: E402
+
+
+class TestResponses(unittest.TestCase):
+    """Test response shaping for the search API."""
+
+    result = get_test_file("json/rekognition_search_output.json")
+
+    def test_get_response_options(self):
+        """Test the fields and compact query string parameters."""
+        event = {"queryStringParameters": {"fields": "matchedFaces, faces", "compact": "true"}}
+        self.assertEqual(get_response_options(event), (("matchedFaces", "faces"), True))
+        self.assertEqual(get_response_options({"queryStringParameters": None}), (None, False))
+
+    def test_compact(self):
+        """Test that compact drops the raw Rekognition data but keeps every match."""
+        compact = shape_search_response(self.result, compact=True)
+
+        self.assertEqual(compact["matchedFaces"], self.result["matchedFaces"])
+        self.assertNotIn("ResponseMetadata", compact["faces"])
+        self.assertEqual(len(compact["faces"]["FaceMatches"]), len(self.result["faces"]["FaceMatches"]))
+        for match in compact["faces"]["FaceMatches"]:
+            self.assertEqual(set(match), {"Similarity", "Face"})
+            self.assertLessEqual(set(match["Face"]), {"FaceId", "ExternalImageId"})
+        self.assertIn("ResponseMetadata", self.result["faces"])
+
+    def test_compact_multi_face(self):
+        """Test that compact keeps the bounding box of each detected face of a multi-face search."""
+        match = {"Similarity": 99.0, "Face": {"FaceId": "keanu", "BoundingBox": {}, "ImageId": "image"}}
+        result = {"faces": [{"BoundingBox": {"Width": 0.5}, "FaceMatches": [match], "matchedFaces": ["Keanu"]}]}
+
+        compact = shape_search_response(result, compact=True)
+
+        self.assertEqual(compact["faces"][0]["BoundingBox"], {"Width": 0.5})
+        self.assertEqual(compact["faces"][0]["FaceMatches"], [{"Similarity": 99.0, "Face": {"FaceId": "keanu"}}])
+
+    def test_fields(self):
+        """Test that fields selects the fields of each batch result, but keeps their id, status and error."""
+        body = {
+            "results": [
+                dict(self.result, id="a", statusCode=200),
+                {"id": "b", "statusCode": 400, "error": "image is not base64 encoded"},
+            ]
+        }
+
+        shaped = shape_search_response(body, fields=("matchedFaces",))
+
+        self.assertEqual(
+            shaped["results"][0], {"id": "a", "statusCode": 200, "matchedFaces": self.result["matchedFaces"]}
+        )
+        self.assertEqual(shaped["results"][1], body["results"][1])
+
+    def test_payload_size(self):
+        """Test that a compact, compressed response is a fraction of the full response."""
+        full = http_response_factory(status_code=200, body=self.result)
+        slim = http_response_factory(
+            status_code=200, body=shape_search_response(self.result, compact=True), accept_encoding="gzip"
+        )
+        print(json.dumps({"payloadBytes": {"full": len(full["body"]), "compactGzip": len(slim["body"])}}))
+        self.assertLess(len(slim["body"]) * 3, len(full["body"]))
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=wrong-import-position
+"""Test S3 helpers."""
+
+# python stuff
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+PYTHON_ROOT = os.path.dirname(os.path.dirname(HERE))
+if PYTHON_ROOT not in sys.path:
+    sys.path.append(PYTHON_ROOT)  # noqa: E402
+
+# our stuff
+from rekognition_api.s3 import S3ObjectDescriptor  # noqa: E402
+from rekognition_api.tests.test_setup import get_test_file  # noqa: E402
+
+
+class TestS3ObjectDescriptor(unittest.TestCase):
+    """Test S3ObjectDescriptor."""
+
+    event = get_test_file("json/apigateway_index_lambda_event.json")["event"]
+    head_object_response = {
+        "ETag": '"c9230f7b3889b61da34a4e0057ccb6d8"',
+        "ContentLength": 879589,
+        "ContentType": "image/jpeg",
+        "Metadata": {"name": "Keanu Reeves"},
+    }
+
+    @patch("rekognition_api.s3.get_s3_client")
+    def test_from_record(self, mock_get_s3_client):
+        """Test that a record is described with exactly one HEAD request."""
+        client = mock_get_s3_client.return_value
+        client.head_object.return_value = self.head_object_response
+        record = self.event["Records"][0]
+
+        s3_object = S3ObjectDescriptor.from_record(record)
+
+        client.head_object.assert_called_once_with(Bucket=record["s3"]["bucket"]["name"], Key="Keanu-Reeves.jpg")
+        self.assertEqual(s3_object.bucket, record["s3"]["bucket"]["name"])
+        self.assertEqual(s3_object.etag, "c9230f7b3889b61da34a4e0057ccb6d8")
+        self.assertEqual(s3_object.size, 879589)
+        self.assertEqual(s3_object.content_type, "image/jpeg")
+        self.assertEqual(s3_object.metadata, {"name": "Keanu Reeves"})
+        self.assertEqual(
+            s3_object.rekognition_image,
+            {"S3Object": {"Bucket": record["s3"]["bucket"]["name"], "Name": "Keanu-Reeves.jpg"}},
+        )
+
+    @patch("rekognition_api.s3.get_s3_client")
+    def test_from_record_decodes_key(self, mock_get_s3_client):
+        """Test that url-encoded object keys are decoded."""
+        mock_get_s3_client.return_value.head_object.return_value = self.head_object_response
+        record = {"s3": {"bucket": {"name": "bucket"}, "object": {"key": "Keanu+Reeves%281%29.jpg"}}}
+
+        s3_object = S3ObjectDescriptor.from_record(record)
+
+        self.assertEqual(s3_object.key, "Keanu Reeves(1).jpg")
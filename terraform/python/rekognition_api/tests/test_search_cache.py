@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=wrong-import-position
+"""Test the search result cache."""
+
+# python stuff
+import json
+import os
+import sys
+import unittest
+from unittest.mock import MagicMock, patch
+
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+PYTHON_ROOT = os.path.dirname(os.path.dirname(HERE))
+if PYTHON_ROOT not in sys.path:
+    sys.path.append(PYTHON_ROOT)  # noqa: E402
+
+# our stuff
+from rekognition_api.exceptions import RekognitionUnprocessedItemsError  # noqa: E402
+from rekognition_api.search_cache import (  # noqa: E402
+    SEARCH_CACHE_MAX_ITEM_BYTES,
+    SearchResultCache,
+    bump_collection_version,
+    get_search_cache_key,
+)
+
+
+PARAMS = {"CollectionId": "collection", "MaxFaces": 10, "FaceMatchThreshold": 80, "QualityFilter": "AUTO"}
+RESULT = {"faces": {"FaceMatches": []}, "matchedFaces": ["Keanu reeves"]}
+
+
+class ClientError(Exception):
+    """Stand-in for botocore.exceptions.ClientError."""
+
+
+class TestSearchCache(unittest.TestCase):
+    """Test the search result cache."""
+
+    def setUp(self):
+        """Set up a search result cache in front of a mock DynamoDB table."""
+        self.table = {}
+        self.mock_batch_get_items = MagicMock(
+            side_effect=lambda keys, **kwargs: {key: self.table[key] for key in keys if key in self.table}
+        )
+        patcher = patch("rekognition_api.search_cache.batch_get_items", self.mock_batch_get_items)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        client_patcher = patch("rekognition_api.search_cache.get_search_cache_client")
+        self.client = client_patcher.start().return_value
+        self.client.exceptions.ClientError = ClientError
+        self.client.put_item.side_effect = lambda TableName, Item: self.table.update({Item["CacheKey"]: Item})
+        self.addCleanup(client_patcher.stop)
+        self.cache = SearchResultCache(
+            "searchcache", 3600, max_entries=10, max_bytes=1024 * 1024, version_ttl_seconds=60
+        )
+        self.key = get_search_cache_key(b"image", PARAMS)
+
+    def test_cache_key(self):
+        """Test that the cache key covers the image bytes and every search parameter."""
+        self.assertEqual(self.key, get_search_cache_key(b"image", dict(reversed(list(PARAMS.items())))))
+        self.assertNotEqual(self.key, get_search_cache_key(b"other image", PARAMS))
+        self.assertNotEqual(self.key, get_search_cache_key(b"image", dict(PARAMS, FaceMatchThreshold=90)))
+
+    def test_miss_then_hits(self):
+        """Test a miss, then a hit from memory, then a hit from the shared table in another container."""
+        self.assertEqual(self.cache.get(self.key, "collection"), (None, 0))
+        self.cache.put(self.key, 0, RESULT)
+        self.assertEqual(self.table[self.key]["version"], 0)
+        self.assertIn("expiresAt", self.table[self.key])
+
+        # the version is trusted for version_ttl_seconds, so a memory hit costs no DynamoDB read
+        self.assertEqual(self.cache.get(self.key, "collection"), (RESULT, 0))
+        self.assertEqual(self.mock_batch_get_items.call_count, 1)
+
+        other_container = SearchResultCache("searchcache", 3600, 10, 1024 * 1024, 60)
+        self.assertEqual(other_container.get(self.key, "collection"), (RESULT, 0))
+        self.assertEqual(self.cache.stats["memoryHits"], 1)
+        self.assertEqual(other_container.stats["sharedHits"], 1)
+
+    def test_collection_version_invalidates(self):
+        """Test that a result computed against an older version of the collection is not served."""
+        self.cache.put(self.key, 0, RESULT)
+        self.table["version#collection"] = {"CacheKey": "version#collection", "version": 1}
+
+        other_container = SearchResultCache("searchcache", 3600, 10, 1024 * 1024, 60)
+        self.assertEqual(other_container.get(self.key, "collection"), (None, 1))
+        self.assertEqual(other_container.stats["misses"], 1)
+
+    def test_large_results_stay_in_memory(self):
+        """Test that a result too large for a DynamoDB item is only cached in memory."""
+        result = {"matchedFaces": ["x" * SEARCH_CACHE_MAX_ITEM_BYTES]}
+        self.cache.put(self.key, 0, result)
+        self.client.put_item.assert_not_called()
+        self.assertEqual(json.loads(self.cache.memory.get(self.key)[1]), result)
+
+    def test_unavailable_table(self):
+        """Test that a cache table that can't be read is a miss whose result isn't cached."""
+        self.mock_batch_get_items.side_effect = ClientError()
+        result, version = self.cache.get(self.key, "collection")
+        self.assertEqual((result, version), (None, None))
+        self.cache.put(self.key, version, RESULT)
+        self.client.put_item.assert_not_called()
+
+    def test_throttled_table(self):
+        """Test that keys left unprocessed by a throttled cache table are a miss, not an error."""
+        self.mock_batch_get_items.side_effect = RekognitionUnprocessedItemsError("throttled")
+        self.assertEqual(self.cache.get(self.key, "collection"), (None, None))
+        self.assertEqual(self.cache.stats["misses"], 1)
+
+    def test_bump_collection_version(self):
+        """Test that the version counter is incremented atomically."""
+        self.client.update_item.return_value = {"Attributes": {"version": 3}}
+        self.assertEqual(bump_collection_version("collection"), 3)
+        kwargs = self.client.update_item.call_args.kwargs
+        self.assertEqual(kwargs["Key"], {"CacheKey": "version#collection"})
+        self.assertEqual(kwargs["UpdateExpression"], "ADD #version :one")
@@ -50,3 +50,22 @@ def pack_image_data(filename: str):
     #     }
     # },
     return {"Bytes": image_decoded}
+
+
+def get_face_record_sample():
+    """
+    Load the sample index_faces() response, replacing its "some data"
+    placeholders with floats so that it resembles a real FaceRecord.
+    """
+
+    def populate(value, seed=[0.1234567890123]):  # pylint: disable=dangerous-default-value
+        if isinstance(value, dict):
+            return {key: populate(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [populate(item) for item in value]
+        if value == "some data":
+            seed[0] = (seed[0] * 7.3) % 100
+            return seed[0]
+        return value
+
+    return populate(get_test_file("json/rekognition_index_faces.json"))
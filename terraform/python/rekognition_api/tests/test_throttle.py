@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=wrong-import-position
+"""Test the Rekognition rate limiter."""
+
+# python stuff
+import os
+import sys
+import unittest
+from unittest.mock import MagicMock, patch
+
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+PYTHON_ROOT = os.path.dirname(os.path.dirname(HERE))
+if PYTHON_ROOT not in sys.path:
+    sys.path.append(PYTHON_ROOT)  # noqa: E402
+
+# our stuff
+from rekognition_api.exceptions import RekognitionRateLimitExceededError  # noqa: E402
+from rekognition_api.throttle import (  # noqa: E402
+    DynamoDBRateCounter,
+    RateLimitedClient,
+    TokenBucket,
+)
+
+
+class ConditionalCheckFailedException(Exception):
+    """Stand-in for the botocore modeled exception."""
+
+
+class TestThrottle(unittest.TestCase):
+    """Test the Rekognition rate limiter."""
+
+    @patch("rekognition_api.throttle.time")
+    def test_token_bucket_paces_calls(self, mock_time):
+        """Test that calls beyond the burst capacity wait for the bucket to refill."""
+        mock_time.monotonic.return_value = 100.0
+        bucket = TokenBucket(rate=2)
+
+        waits = [bucket.acquire() for _ in range(4)]
+
+        # two tokens of burst capacity, then one token every half second
+        self.assertEqual(waits, [0.0, 0.0, 0.5, 1.0])
+        self.assertEqual(mock_time.sleep.call_count, 2)
+
+    @patch("rekognition_api.throttle.time")
+    def test_token_bucket_timeout(self, mock_time):
+        """Test that a call which would wait longer than the timeout is rejected without taking a token."""
+        mock_time.monotonic.return_value = 100.0
+        bucket = TokenBucket(rate=1)
+        bucket.acquire()
+
+        with self.assertRaises(RekognitionRateLimitExceededError):
+            bucket.acquire(timeout=0.5)
+        self.assertEqual(bucket.acquire(timeout=1.0), 1.0)
+
+    @patch("rekognition_api.throttle.time")
+    def test_rate_limited_client(self, _mock_time):
+        """Test that only the rate-limited operations take a token."""
+        client = MagicMock()
+        rate_limited_client = RateLimitedClient(client, {"index_faces": 5})
+        rate_limiter = rate_limited_client.rate_limiters["index_faces"]
+        rate_limiter.acquire = MagicMock(return_value=0.0)
+
+        rate_limited_client.index_faces(CollectionId="collection")
+        rate_limited_client.describe_collection(CollectionId="collection")
+
+        client.index_faces.assert_called_once_with(CollectionId="collection")
+        client.describe_collection.assert_called_once_with(CollectionId="collection")
+        rate_limiter.acquire.assert_called_once()
+        self.assertIs(rate_limited_client.exceptions, client.exceptions)
+
+    @patch("rekognition_api.throttle.time")
+    @patch("rekognition_api.throttle.settings")
+    def test_dynamodb_rate_counter_waits_for_next_second(self, mock_settings, mock_time):
+        """Test that an exhausted second is retried in the following second."""
+        client = mock_settings.aws_dynamodb_resource.meta.client
+        client.exceptions.ConditionalCheckFailedException = ConditionalCheckFailedException
+        client.update_item.side_effect = [ConditionalCheckFailedException(), {}]
+        mock_time.time.side_effect = [1000.5, 1000.5, 1001.05]
+
+        counter = DynamoDBRateCounter("index_faces", 50, table_name="ratelimit")
+        counter.acquire(timeout=5)
+
+        keys = [call.kwargs["Key"]["CounterId"] for call in client.update_item.call_args_list]
+        self.assertEqual(keys, ["index_faces#1000", "index_faces#1001"])
+        self.assertEqual(client.update_item.call_args.kwargs["ExpressionAttributeValues"][":limit"], 50)
+        mock_time.sleep.assert_called_once()
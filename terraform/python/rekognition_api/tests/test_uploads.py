@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=wrong-import-position
+"""Test the request bodies of the search API."""
+
+# python stuff
+import base64
+import json
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+PYTHON_ROOT = os.path.dirname(os.path.dirname(HERE))
+if PYTHON_ROOT not in sys.path:
+    sys.path.append(PYTHON_ROOT)  # noqa: E402
+
+# our stuff
+from rekognition_api.exceptions import RekognitionValueError  # noqa: E402
+from rekognition_api.tests.test_setup import get_test_image  # noqa: E402
+from rekognition_api.uploads import (  # noqa: E402
+    SEARCH_UPLOADS_PREFIX,
+    create_presigned_upload,
+    get_batch_images,
+    get_s3_reference,
+    get_single_image,
+    is_batch_request,
+)
+
+
+BOUNDARY = "----boundary"
+
+
+def get_event(body: bytes, content_type: str, base64_encoded: bool = True) -> dict:
+    """return an API Gateway event with a request body"""
+    return {
+        "headers": {"content-type": content_type},
+        "body": base64.b64encode(body).decode("ascii") if base64_encoded else body.decode("utf-8"),
+        "isBase64Encoded": base64_encoded,
+    }
+
+
+def get_multipart_body(parts: list) -> bytes:
+    """return a multipart/form-data body of (name, filename, content type, payload) parts"""
+    body = b""
+    for name, filename, content_type, payload in parts:
+        body += f"--{BOUNDARY}\r\n".encode()
+        body += f'Content-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'.encode()
+        body += f"Content-Type: {content_type}\r\n\r\n".encode() + payload + b"\r\n"
+    return body + f"--{BOUNDARY}--\r\n".encode()
+
+
+class TestUploads(unittest.TestCase):
+    """Test the request bodies of the search API."""
+
+    def test_is_batch_request(self):
+        """Test that only JSON and multipart bodies are batches, so that the original request format still works."""
+        self.assertTrue(is_batch_request(get_event(b"[]", "application/json; charset=utf-8")))
+        self.assertTrue(is_batch_request(get_event(b"", f"multipart/form-data; boundary={BOUNDARY}")))
+        self.assertFalse(is_batch_request(get_event(b"", "text/plain")))
+        self.assertFalse(is_batch_request({"body": ""}))
+
+    def test_json_images(self):
+        """Test a JSON array of images, with and without ids, and with an image that is not base64 encoded."""
+        body = json.dumps(
+            [
+                base64.b64encode(b"first").decode("ascii"),
+                {"id": "second.jpg", "image": base64.b64encode(b"second").decode("ascii")},
+                {"id": "third.jpg", "image": "not base64!"},
+            ]
+        ).encode()
+
+        images = get_batch_images(get_event(body, "application/json", base64_encoded=False), max_images=10)
+
+        self.assertEqual(images[:2], [("0", b"first"), ("second.jpg", b"second")])
+        self.assertEqual(images[2][0], "third.jpg")
+        self.assertIsInstance(images[2][1], RekognitionValueError)
+
+    def test_multipart_images(self):
+        """Test a multipart body with a raw image part and a base64 encoded part."""
+        body = get_multipart_body(
+            [
+                ("image", "raw.jpg", "image/jpeg", b"\xff\xd8raw\r\nbytes"),
+                ("image", "encoded.jpg", "text/plain", base64.b64encode(b"encoded")),
+            ]
+        )
+
+        images = get_batch_images(get_event(body, f"multipart/form-data; boundary={BOUNDARY}"), max_images=10)
+
+        self.assertEqual(images, [("raw.jpg", b"\xff\xd8raw\r\nbytes"), ("encoded.jpg", b"encoded")])
+
+    def test_single_image(self):
+        """Test raw and base64 encoded single images, with and without API Gateway's base64 encoding."""
+        image = get_test_image("Keanu-Reeves.jpg")
+        encoded = base64.b64encode(image)
+
+        self.assertEqual(get_single_image(get_event(image, "image/jpeg")), image)
+        self.assertEqual(get_single_image(get_event(image, "text/plain")), image)
+        self.assertEqual(get_single_image(get_event(encoded, "text/plain")), image)
+        self.assertEqual(get_single_image(get_event(encoded, "text/plain", base64_encoded=False)), image)
+        with self.assertRaises(RekognitionValueError):
+            get_single_image(get_event("not base64 é".encode(), "text/plain", base64_encoded=False))
+
+    def test_multipart_preamble(self):
+        """Test a multipart body with a preamble, a quoted boundary and a part without a filename."""
+        body = get_multipart_body([("image", "raw.jpg", "image/jpeg", b"\xff\xd8raw")])
+        body = b"preamble\r\n" + body.replace(b'; filename="raw.jpg"', b"")
+        event = get_event(body, f'multipart/form-data; boundary="{BOUNDARY}"')
+
+        self.assertEqual(get_batch_images(event, max_images=10), [("image", b"\xff\xd8raw")])
+
+        with self.assertRaises(RekognitionValueError):
+            get_batch_images(get_event(body[:-20], f"multipart/form-data; boundary={BOUNDARY}"), max_images=10)
+
+    def test_batch_limits(self):
+        """Test that empty and oversized batches are rejected as a whole."""
+        with self.assertRaises(RekognitionValueError):
+            get_batch_images(get_event(b"[]", "application/json"), max_images=10)
+        with self.assertRaises(RekognitionValueError):
+            get_batch_images(get_event(json.dumps(["aW1hZ2U="] * 3).encode(), "application/json"), max_images=2)
+        with self.assertRaises(RekognitionValueError):
+            get_batch_images(get_event(b"{}", "application/json"), max_images=10)
+
+    @patch("rekognition_api.uploads.settings")
+    def test_s3_reference(self, mock_settings):
+        """Test that a JSON object is a reference to an uploaded image in the search bucket, and a JSON array is not."""
+        mock_settings.aws_lambda_search_bucket = "bucket"
+        reference = json.dumps({"bucket": "bucket", "key": "search-uploads/abc"}).encode()
+
+        self.assertEqual(
+            get_s3_reference(get_event(reference, "application/json")),
+            {"bucket": "bucket", "key": "search-uploads/abc"},
+        )
+        self.assertEqual(
+            get_s3_reference(
+                get_event(b'  {"key": "search-uploads/a", "maxFaces": 1}', "application/json", base64_encoded=False)
+            ),
+            {"bucket": "bucket", "key": "search-uploads/a", "maxFaces": 1},
+        )
+        self.assertIsNone(get_s3_reference(get_event(json.dumps(["aW1hZ2U="] * 100).encode(), "application/json")))
+        self.assertIsNone(get_s3_reference(get_event(b"\xff\xd8raw", "image/jpeg")))
+
+        with self.assertRaises(RekognitionValueError):
+            get_s3_reference(get_event(json.dumps({"bucket": "other", "key": "a"}).encode(), "application/json"))
+        with self.assertRaises(RekognitionValueError):
+            get_s3_reference(get_event(json.dumps({"bucket": "bucket"}).encode(), "application/json"))
+        for key in ["photos/a.jpg", "search-jobs/job/images/00000", "search-uploads"]:
+            with self.assertRaises(RekognitionValueError, msg=key):
+                get_s3_reference(get_event(json.dumps({"key": key}).encode(), "application/json"))
+
+    @patch("rekognition_api.uploads.get_s3_client")
+    @patch("rekognition_api.uploads.settings")
+    def test_presigned_upload(self, mock_settings, mock_get_s3_client):
+        """Test that uploads go to their own prefix, without a file extension that would trigger lambda_index."""
+        mock_settings.aws_lambda_search_bucket = "bucket"
+        mock_settings.aws_lambda_search_upload_expires_seconds = 300
+        s3_client = mock_get_s3_client.return_value
+        s3_client.generate_presigned_post.return_value = {"url": "https://bucket/", "fields": {"key": "k"}}
+        s3_client.generate_presigned_url.return_value = "https://bucket/k?signature"
+
+        upload = create_presigned_upload()
+        self.assertEqual(upload["method"], "POST")
+        self.assertEqual(upload["fields"], {"key": "k"})
+        self.assertTrue(upload["key"].startswith(SEARCH_UPLOADS_PREFIX))
+        self.assertNotIn(".", upload["key"])
+        conditions = s3_client.generate_presigned_post.call_args.kwargs["Conditions"]
+        self.assertEqual(conditions[0][0], "content-length-range")
+
+        upload = create_presigned_upload("put")
+        self.assertEqual(upload["url"], "https://bucket/k?signature")
+        self.assertEqual(s3_client.generate_presigned_url.call_args.kwargs["HttpMethod"], "PUT")
+
+        with self.assertRaises(RekognitionValueError):
+            create_presigned_upload("DELETE")
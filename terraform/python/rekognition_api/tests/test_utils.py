@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=wrong-import-position
+"""Test common functions for Lambda functions."""
+
+# python stuff
+import base64
+import gzip
+import json
+import os
+import sys
+import unittest
+from decimal import Decimal
+
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+PYTHON_ROOT = os.path.dirname(os.path.dirname(HERE))
+if PYTHON_ROOT not in sys.path:
+    sys.path.append(PYTHON_ROOT)  # noqa: E402
+
+# our stuff
+from rekognition_api.tests.test_setup import (  # noqa: E402
+    get_face_record_sample,
+    get_test_file,
+)
+from rekognition_api.utils import (  # noqa: E402
+    COMPRESSION_MIN_BYTES,
+    face_record_to_dynamodb_item,
+    get_content_encoding,
+    http_response_factory,
+    to_dynamodb_value,
+)
+
+
+class TestDynamoDBConversion(unittest.TestCase):
+    """Test conversion of Rekognition FaceRecords to DynamoDB items."""
+
+    face_records = get_face_record_sample()["FaceRecords"]
+    index_response = get_test_file("json/apigateway_index_lambda_response.json")["retval"]["body"]
+
+    def json_round_trip(self, value):
+        """The conversion that face_record_to_dynamodb_item() replaces."""
+        return json.loads(json.dumps(value), parse_float=Decimal)
+
+    def test_face_record_matches_json_round_trip(self):
+        """Test that the schema-aware converter matches the json round trip."""
+        for face_record in self.face_records + self.index_response["FaceRecords"]:
+            face = dict(face_record["Face"], bucket="bucket", key="key.jpg", metadata={"a": "b"})
+            self.assertEqual(face_record_to_dynamodb_item(face), self.json_round_trip(face))
+            self.assertEqual(face_record_to_dynamodb_item(face_record), self.json_round_trip(face_record))
+
+    def test_no_floats_remain(self):
+        """Test that every float is converted to Decimal."""
+
+        def assert_no_floats(value):
+            if isinstance(value, dict):
+                for item in value.values():
+                    assert_no_floats(item)
+            elif isinstance(value, list):
+                for item in value:
+                    assert_no_floats(item)
+            else:
+                self.assertNotIsInstance(value, float)
+
+        assert_no_floats(face_record_to_dynamodb_item(self.face_records[0]))
+
+    def test_to_dynamodb_value(self):
+        """Test the generic converter."""
+        self.assertEqual(to_dynamodb_value(0.1), Decimal("0.1"))
+        self.assertEqual(to_dynamodb_value({"a": [1.5, True, None, "x"]}), {"a": [Decimal("1.5"), True, None, "x"]})
+
+
+class TestResponseCompression(unittest.TestCase):
+    """Test compression of response bodies."""
+
+    body = get_test_file("json/rekognition_search_output.json")
+
+    def test_get_content_encoding(self):
+        """Test that gzip is only used when the client accepts it."""
+        self.assertEqual(get_content_encoding("gzip, deflate"), "gzip")
+        self.assertEqual(get_content_encoding("deflate, *;q=0.5"), "gzip")
+        self.assertIsNone(get_content_encoding("gzip;q=0, deflate"))
+        self.assertIsNone(get_content_encoding("identity"))
+        self.assertIsNone(get_content_encoding(None))
+
+    def test_compressed_response(self):
+        """Test that a compressed body is base64 encoded and decodes to the uncompressed body."""
+        plain = http_response_factory(status_code=200, body=self.body)
+        compressed = http_response_factory(status_code=200, body=self.body, accept_encoding="gzip")
+
+        self.assertFalse(plain["isBase64Encoded"])
+        self.assertTrue(compressed["isBase64Encoded"])
+        self.assertEqual(compressed["headers"]["Content-Encoding"], "gzip")
+        self.assertEqual(compressed["headers"]["Vary"], "Accept-Encoding")
+        decoded = gzip.decompress(base64.b64decode(compressed["body"])).decode("utf-8")
+        self.assertEqual(decoded, plain["body"])
+        self.assertLess(len(compressed["body"]), len(plain["body"]))
+
+    def test_small_response_is_not_compressed(self):
+        """Test that bodies below the threshold are sent as is."""
+        body = {"matchedFaces": ["Keanu reeves"]}
+        self.assertLess(len(json.dumps(body)), COMPRESSION_MIN_BYTES)
+        response = http_response_factory(status_code=200, body=body, accept_encoding="gzip")
+        self.assertFalse(response["isBase64Encoded"])
+        self.assertNotIn("Content-Encoding", response["headers"])
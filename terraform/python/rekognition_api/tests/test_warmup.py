@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=wrong-import-position
+"""Test warm-up invocations."""
+
+# python stuff
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+PYTHON_ROOT = os.path.dirname(os.path.dirname(HERE))
+if PYTHON_ROOT not in sys.path:
+    sys.path.append(PYTHON_ROOT)  # noqa: E402
+
+# our stuff
+from rekognition_api.tests.test_setup import get_test_file  # noqa: E402
+from rekognition_api.warmup import is_warmup_event, prime_s3, warm_up  # noqa: E402
+
+
+class TestWarmup(unittest.TestCase):
+    """Test warm-up invocations."""
+
+    def test_is_warmup_event(self):
+        """Test that warm-ups and plain schedules are recognized, and requests are not."""
+        self.assertTrue(is_warmup_event({"warmup": True}))
+        self.assertTrue(is_warmup_event({"source": "aws.events", "detail-type": "Scheduled Event", "detail": {}}))
+        self.assertFalse(is_warmup_event({"warmup": False}))
+        self.assertFalse(is_warmup_event(get_test_file("json/apigateway_search_lambda_event.json")))
+        self.assertFalse(is_warmup_event(None))
+
+    def test_warm_up(self):
+        """Test that every primer runs, and that a failed primer is reported rather than raised."""
+        calls = []
+
+        def failing_primer():
+            raise ValueError("no route to host")
+
+        retval = warm_up({"ok": lambda: calls.append("ok"), "failing": failing_primer})
+
+        self.assertEqual(calls, ["ok"])
+        self.assertEqual(set(retval["warmup"]), {"ok", "failing"})
+        self.assertEqual(retval["errors"], {"failing": "no route to host"})
+
+    @patch("rekognition_api.warmup.get_s3_client")
+    @patch("rekognition_api.warmup.settings")
+    def test_prime_s3(self, mock_settings, mock_get_s3_client):
+        """Test that S3 is only called if the Lambda knows its bucket."""
+        mock_settings.aws_lambda_search_bucket = ""
+        prime_s3()
+        mock_get_s3_client.return_value.head_bucket.assert_not_called()
+
+        mock_settings.aws_lambda_search_bucket = "bucket"
+        prime_s3()
+        mock_get_s3_client.return_value.head_bucket.assert_called_once_with(Bucket="bucket")
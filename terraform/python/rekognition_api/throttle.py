@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+Client-side rate limiting of Rekognition API calls.
+
+Each rate-limited Rekognition operation gets a token bucket that refills at
+its configured transactions per second (TPS). Callers take a token before
+each call, sleeping until one is available, so that a thread pool, a batch
+job or a burst of S3 events paces itself at the account quota instead of
+relying on botocore's retries to recover from a storm of ThrottlingExceptions.
+
+A token bucket only paces the container that owns it. When
+settings.aws_rekognition_rate_limit_coordinated is enabled, every call also
+takes a slot in a per-second DynamoDB counter that is shared by all
+containers, at the cost of one conditional UpdateItem per Rekognition call.
+
+    client = get_rekognition_client()
+    client.index_faces(...)  # paced at settings.aws_rekognition_index_faces_tps
+
+see https://docs.aws.amazon.com/rekognition/latest/dg/limits.html
+"""
+
+# python stuff
+import logging
+import random
+import threading
+import time
+
+# our stuff
+from rekognition_api.conf import settings
+from rekognition_api.exceptions import RekognitionRateLimitExceededError
+
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_COUNTER_TTL_SECONDS = 60
+
+_lock = threading.Lock()
+_rekognition_client = None
+
+
+def get_rate_limits() -> dict:
+    """Return the configured TPS of each rate-limited Rekognition operation, keyed on its boto3 method name."""
+    return {
+        "index_faces": settings.aws_rekognition_index_faces_tps,
+        "search_faces_by_image": settings.aws_rekognition_search_faces_tps,
+        "search_faces": settings.aws_rekognition_search_faces_tps,
+    }
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket.
+
+    Tokens refill continuously at `rate` per second, up to `capacity`. A
+    caller that finds the bucket empty reserves the next token and sleeps
+    until it is due, outside of the lock, so waiting callers are served in
+    the order in which they arrived.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, self.rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout: float = None) -> float:
+        """
+        Take a token, waiting for it if necessary. Returns the number of
+        seconds waited. Raises RekognitionRateLimitExceededError, without
+        taking a token, if the wait would exceed `timeout`.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = max(0.0, (1.0 - self._tokens) / self.rate)
+            if timeout is not None and wait > timeout:
+                raise RekognitionRateLimitExceededError(
+                    f"rate limit of {self.rate} TPS would delay this call by {wait:.2f}s, more than {timeout}s"
+                )
+            self._tokens -= 1.0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class DynamoDBRateCounter:
+    """
+    Rate limit that is shared by every container, implemented as one
+    DynamoDB item per operation per second. Each call increments the item
+    of the current second with a conditional update that fails once the
+    limit is reached, in which case the caller waits for the next second.
+    Items expire through the table's TTL attribute, expiresAt.
+    """
+
+    def __init__(self, operation: str, rate: float, table_name: str = None):
+        self.operation = operation
+        self.limit = max(1, int(rate))
+        self.table_name = table_name or settings.aws_dynamodb_rate_limit_table_id
+
+    def acquire(self, timeout: float = None) -> float:
+        """Take a slot in the current second, waiting for a later second if necessary. Returns seconds waited."""
+        client = settings.aws_dynamodb_resource.meta.client
+        started = time.time()
+        while True:
+            now = time.time()
+            second = int(now)
+            try:
+                client.update_item(
+                    TableName=self.table_name,
+                    Key={"CounterId": f"{self.operation}#{second}"},
+                    UpdateExpression="ADD #count :one SET expiresAt = if_not_exists(expiresAt, :expires)",
+                    ConditionExpression="attribute_not_exists(#count) OR #count < :limit",
+                    ExpressionAttributeNames={"#count": "count"},
+                    ExpressionAttributeValues={
+                        ":one": 1,
+                        ":limit": self.limit,
+                        ":expires": second + RATE_LIMIT_COUNTER_TTL_SECONDS,
+                    },
+                )
+                return now - started
+            except client.exceptions.ConditionalCheckFailedException:
+                # jitter, so that the waiting containers don't all retry at the top of the second
+                wait = second + 1 - now + random.uniform(0, 0.1)  # nosec
+                if timeout is not None and now + wait - started > timeout:
+                    raise RekognitionRateLimitExceededError(
+                        f"shared rate limit of {self.limit} TPS for {self.operation} exhausted for {timeout}s"
+                    ) from None
+                time.sleep(wait)
+
+
+class RateLimiter:
+    """Local token bucket, optionally followed by the shared DynamoDB counter."""
+
+    def __init__(self, operation: str, rate: float, coordinated: bool = False):
+        self.operation = operation
+        self.bucket = TokenBucket(rate)
+        self.counter = DynamoDBRateCounter(operation, rate) if coordinated else None
+
+    def acquire(self, timeout: float = None) -> float:
+        """Wait for permission to make one call. Returns the number of seconds waited."""
+        waited = self.bucket.acquire(timeout=timeout)
+        if self.counter:
+            waited += self.counter.acquire(timeout=None if timeout is None else max(0.0, timeout - waited))
+        if waited > 0:
+            logger.debug("%s waited %.3fs for the rate limiter", self.operation, waited)
+        return waited
+
+
+class RateLimitedClient:
+    """
+    Wraps a boto3 Rekognition client so that the rate-limited operations take
+    a token before each call. Every other attribute, including `exceptions`,
+    is passed through to the wrapped client. Thread-safe, like the client.
+    """
+
+    def __init__(self, client, rate_limits: dict, coordinated: bool = False, timeout: float = None):
+        self.client = client
+        self.timeout = timeout
+        self.rate_limiters = {
+            operation: RateLimiter(operation, rate, coordinated=coordinated) for operation, rate in rate_limits.items()
+        }
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        rate_limiter = self.rate_limiters.get(name)
+        if rate_limiter is None:
+            return attr
+
+        def rate_limited(*args, **kwargs):
+            rate_limiter.acquire(timeout=self.timeout)
+            return attr(*args, **kwargs)
+
+        return rate_limited
+
+
+def get_rekognition_client() -> RateLimitedClient:
+    """Return the rate-limited Rekognition client that is shared by every thread of this container."""
+    global _rekognition_client  # pylint: disable=global-statement
+    with _lock:
+        if _rekognition_client is None:
+            _rekognition_client = RateLimitedClient(
+                settings.aws_rekognition_client,
+                get_rate_limits(),
+                coordinated=settings.aws_rekognition_rate_limit_coordinated,
+                timeout=settings.aws_rekognition_rate_limit_max_wait_seconds,
+            )
+    return _rekognition_client
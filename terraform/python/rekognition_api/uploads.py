@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""
+Request bodies of the search API.
+
+API Gateway hands the body of a Lambda proxy request to the Lambda as a
+string. The REST API treats every media type as binary, so the string is
+the base64 encoding of the raw request body and isBase64Encoded is set.
+Bodies are decoded straight from that string with binascii, without an
+intermediate ASCII copy, and multipart bodies are split on bytes, so that a
+search holds at most the base64 string, the raw body and the image. The
+search endpoint accepts:
+
+- a single image, as the whole body. An image/* or application/octet-stream
+  body, or any body that starts with a JPEG or PNG signature, is the raw
+  image. Any other body is a base64 encoded image, which is the original
+  request format. see get_single_image()
+- a batch of images, as a JSON array whose elements are either base64
+  encoded images or {"id": "...", "image": "<base64 encoded image>"} objects
+- a batch of images, as a multipart/form-data body with one part per image.
+  Parts with an image/* or application/octet-stream content type, or that
+  start with a JPEG or PNG signature, hold the raw image. Any other part is
+  a base64 encoded image.
+- a reference to an image in the S3 bucket, as a JSON object
+  {"bucket": "...", "key": "..."}. Rekognition reads the image from S3, so
+  it is neither limited by the API Gateway payload size nor copied into the
+  Lambda. see get_s3_reference()
+
+Each image of a batch is decoded independently, so that one bad image fails
+only its own result.
+
+Images that are too large for a request body are uploaded with a presigned
+URL, see create_presigned_upload(), and then searched by reference. Their
+keys have no file extension, so that they don't trigger lambda_index.
+"""
+
+# python stuff
+import binascii
+import json
+import uuid
+from email.message import Message
+
+# our stuff
+from rekognition_api.conf import settings
+from rekognition_api.exceptions import RekognitionValueError
+from rekognition_api.images import IMAGE_MAX_S3_OBJECT_BYTES, JPEG_SOI, PNG_SIGNATURE
+from rekognition_api.s3 import get_s3_client
+
+
+CONTENT_TYPE_JSON = "application/json"
+CONTENT_TYPE_MULTIPART = "multipart/form-data"
+RAW_IMAGE_CONTENT_TYPES = ("image/", "application/octet-stream")
+SEARCH_UPLOADS_PREFIX = "search-uploads/"
+PRESIGNED_UPLOAD_METHODS = ("POST", "PUT")
+# enough base64 characters to tell a JSON object from a JSON array
+BODY_PREFIX_LENGTH = 64
+
+
+def get_header(event, name: str, default: str = None) -> str:
+    """return a request header of the API Gateway event. header names are case-insensitive"""
+    name = name.lower()
+    for key, value in (event.get("headers") or {}).items():
+        if key.lower() == name:
+            return value
+    return default
+
+
+def get_content_type(event) -> str:
+    """return the media type of the request body, without its parameters"""
+    return (get_header(event, "Content-Type") or "").split(";")[0].strip().lower()
+
+
+def b64decode(data) -> bytes:
+    """
+    decode base64 data, an ASCII str or bytes. unlike base64.b64decode(), a
+    str is decoded in place rather than copied to bytes first.
+    """
+    try:
+        return binascii.a2b_base64(data)
+    except (binascii.Error, ValueError) as e:
+        raise RekognitionValueError(f"request body is not base64 encoded: {e}") from e
+
+
+def get_body_bytes(event) -> bytes:
+    """return the raw request body"""
+    body = event.get("body") or ""
+    if event.get("isBase64Encoded"):
+        return b64decode(body)
+    return body.encode("utf-8") if isinstance(body, str) else body
+
+
+def is_raw_image(data: bytes, content_type: str) -> bool:
+    """is this a raw image, rather than a base64 encoded one?"""
+    return content_type.startswith(RAW_IMAGE_CONTENT_TYPES) or data[:8].startswith((JPEG_SOI, PNG_SIGNATURE))
+
+
+def get_single_image(event) -> bytes:
+    """return the image of a request whose whole body is one image, raw or base64 encoded"""
+    if not event.get("isBase64Encoded"):
+        # a text body: the original request format, a base64 encoded image
+        return b64decode(event.get("body") or "")
+    body = b64decode(event.get("body") or "")
+    if is_raw_image(body, get_content_type(event)):
+        return body
+    return b64decode(body)
+
+
+def is_batch_request(event) -> bool:
+    """is this a request to search a batch of images?"""
+    return get_content_type(event) in (CONTENT_TYPE_JSON, CONTENT_TYPE_MULTIPART)
+
+
+def decode_image(data) -> bytes:
+    """decode a base64 encoded image, or return the exception that explains why it can't be"""
+    if not isinstance(data, (str, bytes)) or not data:
+        return RekognitionValueError("image is missing")
+    try:
+        # line breaks are allowed, anything else outside of the base64 alphabet is not
+        return binascii.a2b_base64(
+            "".join(data.split()) if isinstance(data, str) else b"".join(data.split()), strict_mode=True
+        )
+    except (binascii.Error, ValueError) as e:
+        return RekognitionValueError(f"image is not base64 encoded: {e}")
+
+
+def parse_json_images(body: bytes) -> list:
+    """return the (id, image) pairs of a JSON array of images"""
+    try:
+        elements = json.loads(body)
+    except ValueError as e:
+        raise RekognitionValueError(f"request body is not valid JSON: {e}") from e
+    if not isinstance(elements, list):
+        raise RekognitionValueError("request body must be a JSON array of images")
+
+    images = []
+    for i, element in enumerate(elements):
+        if isinstance(element, dict):
+            images.append((str(element.get("id", i)), decode_image(element.get("image"))))
+        else:
+            images.append((str(i), decode_image(element)))
+    return images
+
+
+def get_multipart_boundary(content_type: str) -> bytes:
+    """return the boundary parameter of a multipart/form-data content type"""
+    message = Message()
+    message["Content-Type"] = content_type
+    boundary = message.get_boundary()
+    if not boundary:
+        raise RekognitionValueError("multipart/form-data content type has no boundary")
+    return boundary.encode("latin-1")
+
+
+def parse_part_headers(data: bytes) -> Message:
+    """return the headers of a part of a multipart body"""
+    headers = Message()
+    for line in data.decode("latin-1").split("\r\n"):
+        name, separator, value = line.partition(":")
+        if separator:
+            headers[name.strip()] = value.strip()
+    return headers
+
+
+def parse_multipart_images(body: bytes, content_type: str) -> list:
+    """
+    return the (id, image) pairs of a multipart/form-data body, one per part.
+    only the headers of each part are decoded, its payload is sliced out of the body.
+
+    see https://www.rfc-editor.org/rfc/rfc7578
+    """
+    delimiter = b"--" + get_multipart_boundary(content_type)
+    position = body.find(delimiter)
+    if position < 0:
+        raise RekognitionValueError("multipart/form-data request body has no parts")
+
+    images = []
+    while True:
+        position += len(delimiter)
+        if body.startswith(b"--", position):
+            # the close delimiter
+            break
+        headers_end = body.find(b"\r\n\r\n", position)
+        next_delimiter = body.find(b"\r\n" + delimiter, position)
+        if headers_end < 0 or next_delimiter < 0 or headers_end > next_delimiter:
+            raise RekognitionValueError("multipart/form-data request body is truncated")
+        headers = parse_part_headers(body[position:headers_end].strip(b"\r\n"))
+        payload = body[headers_end + 4 : next_delimiter]
+        position = next_delimiter + 2
+
+        i = len(images)
+        image_id = headers.get_filename() or headers.get_param("name", header="content-disposition") or str(i)
+        if is_raw_image(payload, headers.get_content_type()):
+            images.append((image_id, payload))
+        else:
+            images.append((image_id, decode_image(payload)))
+    return images
+
+
+def get_batch_images(event, max_images: int) -> list:
+    """
+    return the (id, image) pairs of a batch request. image is the decoded image,
+    or the exception that explains why it couldn't be decoded.
+    """
+    body = get_body_bytes(event)
+    if get_content_type(event) == CONTENT_TYPE_MULTIPART:
+        images = parse_multipart_images(body, get_header(event, "Content-Type"))
+    else:
+        images = parse_json_images(body)
+
+    if not images:
+        raise RekognitionValueError("request body contains no images")
+    if len(images) > max_images:
+        raise RekognitionValueError(f"a batch can contain at most {max_images} images, not {len(images)}")
+    return images
+
+
+def get_body_prefix(event) -> bytes:
+    """return the first bytes of the raw request body, without decoding all of it"""
+    body = (event.get("body") or "")[:BODY_PREFIX_LENGTH]
+    if event.get("isBase64Encoded"):
+        # a truncated base64 string, so decode only whole 4-character groups
+        return b64decode(body[: len(body) // 4 * 4])
+    return body.encode("utf-8") if isinstance(body, str) else body
+
+
+def get_s3_reference(event) -> dict:
+    """
+    return the JSON object of a request whose body is a reference to an
+    image in S3, with its bucket filled in, or None if the body is anything
+    else. only images that were uploaded to the search-uploads/ prefix of the
+    search bucket, see create_presigned_upload(), can be referenced. other keys
+    of the object, such as search parameters, are returned as is.
+    """
+    if get_content_type(event) != CONTENT_TYPE_JSON or not get_body_prefix(event).lstrip().startswith(b"{"):
+        return None
+    try:
+        reference = json.loads(get_body_bytes(event))
+    except ValueError as e:
+        raise RekognitionValueError(f"request body is not valid JSON: {e}") from e
+
+    key = reference.get("key")
+    if not isinstance(key, str) or not key:
+        raise RekognitionValueError("an S3 image reference needs a key")
+    bucket = reference.get("bucket") or settings.aws_lambda_search_bucket
+    if bucket != settings.aws_lambda_search_bucket:
+        raise RekognitionValueError(f"only images in bucket {settings.aws_lambda_search_bucket} can be searched")
+    if not key.startswith(SEARCH_UPLOADS_PREFIX):
+        raise RekognitionValueError(f"only images under {SEARCH_UPLOADS_PREFIX} can be searched")
+    return dict(reference, bucket=bucket)
+
+
+def create_presigned_upload(method: str = "POST") -> dict:
+    """
+    return a presigned URL that uploads one image to the search bucket, and
+    the bucket and key to search it by. a presigned POST also limits the size
+    of the image to what Rekognition accepts from S3.
+
+    see https://boto3.amazonaws.com/v1/documentation/api/latest/guide/s3-presigned-urls.html
+    """
+    method = (method or "POST").upper()
+    if method not in PRESIGNED_UPLOAD_METHODS:
+        raise RekognitionValueError(f"upload method must be one of {', '.join(PRESIGNED_UPLOAD_METHODS)}, not {method}")
+
+    bucket = settings.aws_lambda_search_bucket
+    key = f"{SEARCH_UPLOADS_PREFIX}{uuid.uuid4().hex}"
+    expires_in = settings.aws_lambda_search_upload_expires_seconds
+    upload = {"bucket": bucket, "key": key, "method": method, "expiresIn": expires_in}
+    if method == "PUT":
+        upload["url"] = get_s3_client().generate_presigned_url(
+            "put_object", Params={"Bucket": bucket, "Key": key}, ExpiresIn=expires_in, HttpMethod="PUT"
+        )
+    else:
+        post = get_s3_client().generate_presigned_post(
+            Bucket=bucket,
+            Key=key,
+            Conditions=[["content-length-range", 1, IMAGE_MAX_S3_OBJECT_BYTES]],
+            ExpiresIn=expires_in,
+        )
+        upload.update(url=post["url"], fields=post["fields"])
+    return upload
@@ -1,9 +1,24 @@
 # -*- coding: utf-8 -*-
 """Common functions for Lambda functions"""
+import base64
 import datetime
+import gzip
 import json
 import sys
 import traceback
+from decimal import Decimal
+
+
+# optional: brotli compression of response bodies. gzip is used without it.
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# bodies smaller than this gain less from compression than the base64 encoding adds
+COMPRESSION_MIN_BYTES = 1024
+GZIP_COMPRESS_LEVEL = 6
+BROTLI_QUALITY = 5
 
 
 class DateTimeEncoder(json.JSONEncoder):
@@ -28,12 +43,52 @@ def cloudwatch_handler(
         print(json.dumps({"event": event}, cls=DateTimeEncoder))
 
 
-def http_response_factory(status_code: int, body: json, debug_mode: bool = False) -> json:
+def get_content_encoding(accept_encoding: str) -> str:
+    """
+    Return the content coding of a response, given the Accept-Encoding header
+    of the request: br if brotli is installed, then gzip, otherwise None.
+
+    see https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Accept-Encoding
+    """
+    accepted = {}
+    for coding in (accept_encoding or "").lower().split(","):
+        name, _, params = coding.strip().partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name.strip()] = quality
+
+    def is_accepted(name: str) -> bool:
+        return accepted.get(name, accepted.get("*", 0.0)) > 0
+
+    if brotli is not None and is_accepted("br"):
+        return "br"
+    if is_accepted("gzip"):
+        return "gzip"
+    return None
+
+
+def compress(data: bytes, content_encoding: str) -> bytes:
+    """Compress a response body with a content coding of get_content_encoding()."""
+    if content_encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_COMPRESS_LEVEL)
+
+
+def http_response_factory(status_code: int, body: json, debug_mode: bool = False, accept_encoding: str = None) -> json:
     """
     Generate a standardized JSON return dictionary for all possible response scenarios.
 
     status_code: an HTTP response code. see https://developer.mozilla.org/en-US/docs/Web/HTTP/Status
     body: a JSON dict of Rekognition results for status 200, an error dict otherwise.
+    accept_encoding: the Accept-Encoding header of the request. bodies of at
+        least COMPRESSION_MIN_BYTES are compressed with gzip or br, and base64
+        encoded, which API Gateway decodes because of its binary media types.
 
     see https://docs.aws.amazon.com/lambda/latest/dg/python-handler.html
     """
@@ -58,6 +113,13 @@ def http_response_factory(status_code: int, body: json, debug_mode: bool = False
         "body": json.dumps(body, cls=DateTimeEncoder),
     }
 
+    content_encoding = get_content_encoding(accept_encoding) if accept_encoding else None
+    if content_encoding and len(retval["body"]) >= COMPRESSION_MIN_BYTES:
+        compressed = compress(retval["body"].encode("utf-8"), content_encoding)
+        retval["isBase64Encoded"] = True
+        retval["headers"].update({"Content-Encoding": content_encoding, "Vary": "Accept-Encoding"})
+        retval["body"] = base64.b64encode(compressed).decode("ascii")
+
     return retval
 
 
@@ -80,3 +142,97 @@ def exception_response_factory(exception) -> json:
 def recursive_sort_dict(d):
     """Recursively sort a dictionary by key."""
     return {k: recursive_sort_dict(v) if isinstance(v, dict) else v for k, v in sorted(d.items())}
+
+
+def to_dynamodb_value(value):
+    """
+    Recursively convert a boto3 response value to a value that DynamoDB will accept.
+    DynamoDB rejects Python floats, so these become Decimal. Equivalent to
+    json.loads(json.dumps(value), parse_float=Decimal) but without the string round trip.
+    """
+    value_type = type(value)
+    if value_type is float:
+        return Decimal(repr(value))
+    if value_type is dict:
+        return {key: to_dynamodb_value(item) for key, item in value.items()}
+    if value_type in (list, tuple):
+        return [to_dynamodb_value(item) for item in value]
+    return value
+
+
+def _dynamodb_scalar(value):
+    """Convert a FaceRecord leaf, which is a float in all but exceptional cases."""
+    if type(value) is float:  # pylint: disable=unidiomatic-typecheck
+        return Decimal(repr(value))
+    return to_dynamodb_value(value)
+
+
+def _dynamodb_scalar_map(value: dict) -> dict:
+    """Convert a flat FaceRecord structure such as BoundingBox, Pose or Smile."""
+    # pylint: disable=unidiomatic-typecheck
+    return {key: Decimal(repr(item)) if type(item) is float else to_dynamodb_value(item) for key, item in value.items()}
+
+
+def _dynamodb_scalar_map_list(value: list) -> list:
+    """Convert a list of flat FaceRecord structures such as Landmarks or Emotions."""
+    # pylint: disable=unidiomatic-typecheck
+    return [
+        {key: Decimal(repr(leaf)) if type(leaf) is float else to_dynamodb_value(leaf) for key, leaf in item.items()}
+        for item in value
+    ]
+
+
+def _dynamodb_passthrough(value):
+    """FaceRecord strings such as FaceId need no conversion."""
+    return value
+
+
+# the shape of a Rekognition FaceRecord, keyed on attribute name.
+# see doc/json/rekognition_index_faces.json
+FACE_RECORD_SCHEMA = {
+    "FaceId": _dynamodb_passthrough,
+    "ImageId": _dynamodb_passthrough,
+    "ExternalImageId": _dynamodb_passthrough,
+    "DisplayName": _dynamodb_passthrough,
+    "IndexFacesModelVersion": _dynamodb_passthrough,
+    "UserId": _dynamodb_passthrough,
+    "Confidence": _dynamodb_scalar,
+    "BoundingBox": _dynamodb_scalar_map,
+    "AgeRange": _dynamodb_scalar_map,
+    "Smile": _dynamodb_scalar_map,
+    "Eyeglasses": _dynamodb_scalar_map,
+    "Sunglasses": _dynamodb_scalar_map,
+    "Gender": _dynamodb_scalar_map,
+    "Beard": _dynamodb_scalar_map,
+    "Mustache": _dynamodb_scalar_map,
+    "EyesOpen": _dynamodb_scalar_map,
+    "MouthOpen": _dynamodb_scalar_map,
+    "Pose": _dynamodb_scalar_map,
+    "Quality": _dynamodb_scalar_map,
+    "FaceOccluded": _dynamodb_scalar_map,
+    "EyeDirection": _dynamodb_scalar_map,
+    "Emotions": _dynamodb_scalar_map_list,
+    "Landmarks": _dynamodb_scalar_map_list,
+}
+
+
+def face_record_to_dynamodb_item(face: dict) -> dict:
+    """
+    Convert a Rekognition Face, FaceDetail or FaceRecord to a DynamoDB item in a
+    single pass over its known structure. Attributes that are not part of
+    the schema, such as our own 'bucket', 'key' and 'metadata', fall back
+    to to_dynamodb_value().
+    """
+    schema_get = FACE_RECORD_SCHEMA.get
+    return {key: schema_get(key, to_dynamodb_value)(value) for key, value in face.items()}
+
+
+FACE_RECORD_SCHEMA["Face"] = face_record_to_dynamodb_item
+FACE_RECORD_SCHEMA["FaceDetail"] = face_record_to_dynamodb_item
+
+
+def get_display_name(external_image_id) -> str:
+    """return the human-readable name of an indexed image"""
+    return (
+        str(external_image_id).replace("-", " ").replace("_", " ").replace(".jpg", "").replace(".png", "").capitalize()
+    )
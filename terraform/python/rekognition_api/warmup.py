@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Warm-up invocations.
+
+A scheduled EventBridge rule invokes each Lambda with {"warmup": true}, see
+lambda.tf, so that a container is kept warm without indexing or searching
+a real image. A warm-up returns before the handler's own work. It first
+runs the handler's primers concurrently. A primer creates the boto3 clients
+and resources that the handler's requests use, and opens a connection to
+each of their endpoints with one cheap metadata call. The first real
+request then pays for neither the client creation nor the TLS handshake.
+
+A primer that fails is reported in the response, but never fails the warm-up.
+
+see https://docs.aws.amazon.com/lambda/latest/dg/best-practices.html
+"""
+
+# python stuff
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# our stuff
+from rekognition_api.conf import settings
+from rekognition_api.s3 import get_s3_client
+from rekognition_api.throttle import get_rekognition_client
+
+
+WARMUP_EVENT_KEY = "warmup"
+
+
+def is_warmup_event(event) -> bool:
+    """is this a warm-up invocation, rather than a request? a plain EventBridge schedule counts too."""
+    if not isinstance(event, dict):
+        return False
+    if event.get(WARMUP_EVENT_KEY):
+        return True
+    return event.get("source") == "aws.events" and event.get("detail-type") == "Scheduled Event"
+
+
+def prime_dynamodb():
+    """create the DynamoDB resource, and connect with a DescribeTable, which reads no items"""
+    client = settings.aws_dynamodb_resource.meta.client
+    client.describe_table(TableName=settings.aws_dynamodb_table_id)
+
+
+def prime_rekognition():
+    """create the rate-limited Rekognition client, and connect with a DescribeCollection, which analyzes no image"""
+    get_rekognition_client().describe_collection(CollectionId=settings.aws_rekognition_collection_id)
+
+
+def prime_s3():
+    """create the S3 client, and connect with a HeadBucket if this Lambda knows its bucket"""
+    client = get_s3_client()
+    if settings.aws_lambda_search_bucket:
+        client.head_bucket(Bucket=settings.aws_lambda_search_bucket)
+
+
+def prime_apigateway():
+    """create the API Gateway client, and connect with a GetAccount"""
+    settings.aws_apigateway_client.get_account()
+
+
+def run_primer(primer) -> tuple:
+    """run a primer, and return its (elapsed milliseconds, error)"""
+    start = time.perf_counter()
+    try:
+        primer()
+        error = None
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        error = str(e)
+    return round((time.perf_counter() - start) * 1000, 1), error
+
+
+def warm_up(primers: dict) -> dict:
+    """
+    run the primers of a warm-up concurrently, and return how long each
+    took, in milliseconds, and the error of each primer that failed.
+
+    primers: functions keyed on a name for the log, such as "dynamodb"
+    """
+    with ThreadPoolExecutor(max_workers=max(1, len(primers))) as executor:
+        results = dict(zip(primers, executor.map(run_primer, primers.values())))
+    retval = {
+        "warmup": {name: elapsed_ms for name, (elapsed_ms, _error) in results.items()},
+        "errors": {name: error for name, (_elapsed_ms, error) in results.items() if error},
+    }
+    if settings.debug_mode:
+        print(json.dumps(retval))
+    return retval
@@ -31,5 +31,30 @@ module "s3_bucket" {
   versioning = {
     enabled = false
   }
+
+  # the images and results of asynchronous search jobs, see rekognition_api/jobs.py,
+  # and the images uploaded with presigned search upload URLs, see rekognition_api/uploads.py
+  lifecycle_rule = [
+    {
+      id      = "search-jobs"
+      enabled = true
+      filter = {
+        prefix = "search-jobs/"
+      }
+      expiration = {
+        days = var.lambda_search_jobs_retention_days
+      }
+    },
+    {
+      id      = "search-uploads"
+      enabled = true
+      filter = {
+        prefix = "search-uploads/"
+      }
+      expiration = {
+        days = var.lambda_search_jobs_retention_days
+      }
+    }
+  ]
   tags = var.tags
 }
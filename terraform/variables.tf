@@ -86,6 +86,152 @@ variable "aws_rekognition_face_detect_attributes" {
   type        = string
   default     = "DEFAULT"
 }
+
+# client-side pacing of Rekognition calls. match these to the account's
+# per-API quotas, see https://docs.aws.amazon.com/rekognition/latest/dg/limits.html
+variable "aws_rekognition_index_faces_tps" {
+  description = "Maximum IndexFaces calls per second"
+  type        = number
+  default     = 50
+}
+variable "aws_rekognition_search_faces_tps" {
+  description = "Maximum SearchFacesByImage calls per second, and SearchFaces calls per second"
+  type        = number
+  default     = 50
+}
+variable "aws_rekognition_rate_limit_max_wait_seconds" {
+  description = "Longest a Rekognition call may wait for the rate limiter before it fails with a 429"
+  type        = number
+  default     = 10
+}
+variable "aws_rekognition_rate_limit_coordinated" {
+  description = "Share the Rekognition rate limits across all Lambda containers through a DynamoDB counter"
+  type        = bool
+  default     = false
+}
+
+# downscale oversized images before they are sent to Rekognition.
+# requires Pillow in the Lambda layer, see python/rekognition_layer/requirements.txt
+variable "aws_rekognition_image_normalize" {
+  description = "Downscale and re-encode oversized images before sending them to Rekognition"
+  type        = bool
+  default     = false
+}
+variable "aws_rekognition_image_max_edge" {
+  description = "Longest edge, in pixels, of a normalized image"
+  type        = number
+  default     = 1920
+}
+variable "aws_rekognition_image_jpeg_quality" {
+  description = "JPEG quality of a normalized image"
+  type        = number
+  default     = 85
+}
+variable "lambda_search_face_cache_max_entries" {
+  description = "Maximum number of faceprints that a warm search Lambda container keeps in memory"
+  type        = number
+  default     = 10000
+}
+variable "lambda_search_face_cache_max_bytes" {
+  description = "Maximum estimated memory, in bytes, of the faceprints that a warm search Lambda container keeps"
+  type        = number
+  default     = 8388608
+}
+variable "lambda_search_face_cache_ttl_seconds" {
+  description = "How long a warm search Lambda container keeps a faceprint"
+  type        = number
+  default     = 3600
+}
+variable "lambda_search_face_cache_negative" {
+  description = "true to also remember, briefly, the FaceIds that have no faceprint"
+  type        = bool
+  default     = true
+}
+variable "lambda_search_face_cache_negative_ttl_seconds" {
+  description = "How long a warm search Lambda container remembers a FaceId that has no faceprint"
+  type        = number
+  default     = 60
+}
+variable "lambda_search_result_cache" {
+  description = "true to cache search results by image hash, until new faces are indexed"
+  type        = bool
+  default     = true
+}
+variable "lambda_search_result_cache_ttl_seconds" {
+  description = "How long a search result is cached"
+  type        = number
+  default     = 3600
+}
+variable "lambda_search_result_cache_max_entries" {
+  description = "Maximum number of search results that a warm search Lambda container keeps in memory"
+  type        = number
+  default     = 1000
+}
+variable "lambda_search_result_cache_max_bytes" {
+  description = "Maximum estimated memory, in bytes, of the search results that a warm search Lambda container keeps"
+  type        = number
+  default     = 16777216
+}
+variable "lambda_search_result_cache_version_ttl_seconds" {
+  description = "How long a warm search Lambda container trusts its copy of the collection version"
+  type        = number
+  default     = 1
+}
+variable "lambda_search_multi_face_max_faces" {
+  description = "Maximum number of detected faces that a multi-face search searches, largest first"
+  type        = number
+  default     = 10
+}
+variable "lambda_search_multi_face_max_workers" {
+  description = "Maximum number of faces that a multi-face search searches concurrently"
+  type        = number
+  default     = 4
+}
+variable "lambda_search_batch_max_images" {
+  description = "Maximum number of images in one batch search request"
+  type        = number
+  default     = 50
+}
+variable "lambda_search_batch_max_workers" {
+  description = "Maximum number of images of a batch search request that are searched concurrently"
+  type        = number
+  default     = 8
+}
+variable "lambda_search_jobs_max_images" {
+  description = "Maximum number of images in one asynchronous search job"
+  type        = number
+  default     = 1000
+}
+variable "lambda_search_jobs_retention_days" {
+  description = "Number of days that the status and the results of a search job are kept"
+  type        = number
+  default     = 1
+}
+variable "lambda_search_jobs_max_receive_count" {
+  description = "Number of delivery attempts of a chunk of a search job before the job fails"
+  type        = number
+  default     = 3
+}
+variable "lambda_search_upload_expires_seconds" {
+  description = "Number of seconds that a presigned search upload URL is valid"
+  type        = number
+  default     = 300
+}
+variable "lambda_warmup" {
+  description = "Keep the Lambda containers warm with scheduled warm-up invocations"
+  type        = bool
+  default     = true
+}
+variable "lambda_warmup_schedule" {
+  description = "EventBridge schedule expression of the warm-up invocations"
+  type        = string
+  default     = "rate(5 minutes)"
+}
+variable "lambda_search_jobs_maximum_concurrency" {
+  description = "Maximum number of chunks of search jobs that are searched concurrently"
+  type        = number
+  default     = 2
+}
 variable "quota_settings_limit" {
   type    = number
   default = 20
@@ -131,3 +277,39 @@ variable "compatible_architectures" {
   description = "A list of architectures (x86_64 or arm64) that the Lambda function is compatible with."
   default     = ["x86_64"]
 }
+
+variable "lambda_index_sqs_buffered" {
+  description = "Buffer S3 notifications in an SQS queue rather than invoking the index Lambda directly"
+  type        = bool
+  default     = false
+}
+
+variable "lambda_index_sqs_batch_size" {
+  description = "Maximum number of S3 notifications sent to the index Lambda per invocation"
+  type        = number
+  default     = 10
+}
+
+variable "lambda_index_sqs_batching_window" {
+  description = "Maximum time in seconds to gather S3 notifications into a batch"
+  type        = number
+  default     = 5
+}
+
+variable "lambda_index_sqs_maximum_concurrency" {
+  description = "Maximum number of concurrent index Lambda invocations. This caps the Rekognition IndexFaces rate."
+  type        = number
+  default     = 2
+}
+
+variable "lambda_index_sqs_max_receive_count" {
+  description = "Number of delivery attempts before a failed S3 notification is moved to the dead-letter queue"
+  type        = number
+  default     = 5
+}
+
+variable "lambda_index_content_dedup" {
+  description = "Hash each uploaded image and link duplicates to existing faceprints instead of indexing them again"
+  type        = bool
+  default     = false
+}